@@ -0,0 +1,95 @@
+'''
+    Processing benchmark: per-tick Process time on a deep chain and on a wide tree,
+        comparing the explicit-stack engine against nested Process calls (Layer.bRecursiveProcessing).
+
+    From the main directory, call 'python -m bench.BenchDepth' to run it.
+'''
+
+import time
+
+from src import Layer, Message
+
+class _BenchLayer(Layer.Layer):
+    def __init__(self):
+        super().__init__()
+        self.handlers['BENCH'] = self.HandleBench
+
+    def HandleBench(self, message):
+        pass
+
+def BuildChain(depth):
+    '''
+        Return the layers of a single chain, top first.
+    '''
+    layers = [_BenchLayer()]
+    layers[0].SetId('0')
+    for _ in range(depth):
+        layer = _BenchLayer()
+        layers[-1].RegisterSubLayer(layer)
+        layers.append(layer)
+    return layers
+
+def BuildWide(fanOut, depth):
+    '''
+        Return the layers of a tree with fanOut sub-layers per layer, top first.
+    '''
+    top = _BenchLayer()
+    top.SetId('0')
+    layers = [top]
+    level = [top]
+    for _ in range(depth):
+        nextLevel = []
+        for parent in level:
+            for _ in range(fanOut):
+                layer = _BenchLayer()
+                parent.RegisterSubLayer(layer)
+                nextLevel.append(layer)
+        layers.extend(nextLevel)
+        level = nextLevel
+    return layers
+
+def TimeTicks(layers, targets, prop, bRecursive, ticks):
+    '''
+        Return the mean seconds per tick, where each tick delivers one message to every target.
+            Returns None if the engine overflowed the stack.
+    '''
+    Layer.Layer.bRecursiveProcessing = bRecursive
+    top = layers[0]
+
+    try:
+        start = time.perf_counter()
+        for ts in range(ticks):
+            for target in targets:
+                target.ScheduleMessage(ts, Message.Message('BENCH', dest=target.GetId(), prop=prop))
+            top.Process(ts)
+        return (time.perf_counter() - start) / ticks
+    except RecursionError:
+        return None
+    finally:
+        Layer.Layer.bRecursiveProcessing = False
+
+def Row(name, build, pickTargets, prop, ticks):
+    '''
+        Print one result row; each engine gets a freshly built tree.
+    '''
+    results = []
+    for bRecursive in [True, False]:
+        layers = build()
+        t = TimeTicks(layers, pickTargets(layers), prop, bRecursive, ticks)
+        results.append('RecursionError' if t is None else f'{t*1e3:.2f}')
+    print(f'{name:>36} {results[0]:>16} {results[1]:>16}')
+
+def Main():
+    print(f'{"ms / tick":>36} {"recursive":>16} {"iterative":>16}')
+
+    for depth in [100, 1000]:
+        build = lambda: BuildChain(depth)
+        Row(f'chain {depth}, message to bottom', build, lambda layers: layers[-1:], Message.PROP_EXACT, 20)
+        Row(f'chain {depth}, bottom broadcasts up', build, lambda layers: layers[-1:], Message.PROP_GTE, 20)
+
+    build = lambda: BuildWide(10, 3)
+    Row('10x10x10, message to every leaf', build, lambda layers: layers[-1000:], Message.PROP_EXACT, 20)
+    Row('10x10x10, top broadcasts down', build, lambda layers: layers[:1], Message.PROP_LTE, 20)
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,85 @@
+'''
+    Memory benchmark: bytes per leaf layer for a tree of a million leaves,
+        comparing layers that add their handlers per instance (self.handlers) against lean ones
+        that declare __slots__ = () and a class-level messageHandlers table.
+
+    Each variant is built in its own process, and measured by how much that process's peak RSS grew.
+
+    From the main directory, call 'python -m bench.BenchMemory' to run it.
+'''
+
+import multiprocessing
+import resource
+import sys
+import time
+
+from src import Layer, Message
+
+LEAVES = 1000000
+FAN_OUT = 1000
+
+class _InstanceHandlerLayer(Layer.Layer):
+    def __init__(self):
+        super().__init__()
+        self.handlers['BENCH'] = self.HandleBench
+
+    def HandleBench(self, message):
+        pass
+
+class _LeanLayer(Layer.Layer):
+    __slots__ = ()
+
+    messageHandlers = {
+        'BENCH': 'HandleBench',
+    }
+
+    def HandleBench(self, message):
+        pass
+
+def PeakRss():
+    '''
+        Return this process's peak resident set size in bytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def Build(cls, conn):
+    '''
+        Build LEAVES leaves of class cls, FAN_OUT to a parent, under one top layer,
+            then send back (bytes per leaf, seconds to build, seconds for one tick reaching every leaf,
+            bytes per leaf once every leaf has had a message queued).
+    '''
+    start = PeakRss()
+
+    t = time.perf_counter()
+    top = Layer.Layer()
+    top.SetId('0')
+    for _ in range(LEAVES // FAN_OUT):
+        parent = Layer.Layer()
+        top.RegisterSubLayer(parent)
+        for _ in range(FAN_OUT):
+            parent.RegisterSubLayer(cls())
+    buildTime = time.perf_counter() - t
+    built = PeakRss()
+
+    t = time.perf_counter()
+    top.ScheduleMessage(0, Message.Message('BENCH', dest='0', prop=Message.PROP_LTE))
+    top.Step()
+    tickTime = time.perf_counter() - t
+
+    conn.send(((built - start) / LEAVES, buildTime, tickTime, (PeakRss() - start) / LEAVES))
+
+def Main():
+    print(f'{LEAVES} leaves, {FAN_OUT} per parent')
+    print(f'{"":>24} {"bytes / leaf":>16} {"build s":>10} {"broadcast s":>12} {"bytes / leaf after":>20}')
+
+    for name, cls in [('instance handlers', _InstanceHandlerLayer), ('lean', _LeanLayer)]:
+        conn, childConn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=Build, args=(cls, childConn))
+        process.start()
+        perLeaf, buildTime, tickTime, perLeafAfter = conn.recv()
+        process.join()
+        print(f'{name:>24} {perLeaf:>16.0f} {buildTime:>10.1f} {tickTime:>12.2f} {perLeafAfter:>20.0f}')
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,108 @@
+'''
+    Message benchmark: memory and throughput of the slotted Message/MessageHop against the old
+        dict-based Message, which made a full copy for every layer it propagated to.
+
+    From the main directory, call 'python -m bench.BenchMessage' to run it.
+'''
+
+import time
+import tracemalloc
+
+from src import Layer, Message
+
+class _DictMessage:
+    '''
+        Message as it was before __slots__ and MessageHop (PropTargets* as list membership tests).
+    '''
+    def __init__(self, type, dest, src=None, data=None, prop=Message.PROP_EXACT):
+        self.type = type
+        self.dest = dest
+        self.prop = prop
+        self.src = src
+        self.data = data
+
+    def GetType(self):
+        return self.type
+
+    def GetTypeId(self):
+        # Layer routes by interned type id now; look it up like the old string-keyed dicts did.
+        return Message.TypeId(self.type)
+
+    def GetDest(self):
+        return self.dest
+
+    def PropTargetsLower(self):
+        return self.prop in [Message.PROP_ALL, Message.PROP_BI, Message.PROP_LT, Message.PROP_LTE]
+
+    def PropTargetsHigher(self):
+        return self.prop in [Message.PROP_ALL, Message.PROP_BI, Message.PROP_GT, Message.PROP_GTE]
+
+    def PropTargetsEqual(self):
+        return self.prop in [Message.PROP_EXACT, Message.PROP_ALL, Message.PROP_LTE, Message.PROP_GTE]
+
+    def LowerEqCopy(self, newDest=None):
+        return _DictMessage(self.type, newDest or self.dest, src=self.src, data=self.data, prop=Message.PROP_LTE)
+
+def MeasureBytes(build, count):
+    '''
+        Return the bytes per object allocated by build(i) for count objects.
+    '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Don't count the list holding them.
+    return (after - before - 8 * len(objects)) / count
+
+def TimeCopies(message, count):
+    '''
+        Return the mean seconds per LowerEqCopy.
+    '''
+    start = time.perf_counter()
+    for i in range(count):
+        message.LowerEqCopy(newDest='0.0')
+    return (time.perf_counter() - start) / count
+
+def TimeBroadcast(messageClass, width, count):
+    '''
+        Return the mean seconds per PROP_ALL broadcast from a parent to width sub-layers.
+    '''
+    top = Layer.Layer()
+    top.SetId('0')
+    for _ in range(width):
+        sub = Layer.Layer()
+        sub.handlers['BENCH'] = lambda message: None
+        top.RegisterSubLayer(sub)
+
+    start = time.perf_counter()
+    for ts in range(count):
+        top.AddMessage(ts, messageClass('BENCH', '0', data=ts, prop=Message.PROP_ALL))
+        top.Process(ts)
+    return (time.perf_counter() - start) / count
+
+def Main():
+    count = 100000
+    data = {'payload': 'x'}
+
+    dictBytes = MeasureBytes(lambda i: _DictMessage('BENCH', '0.0', src='0', data=data), count)
+    slotBytes = MeasureBytes(lambda i: Message.Message('BENCH', '0.0', src='0', data=data), count)
+
+    dictOrigin = _DictMessage('BENCH', '0', src='0', data=data, prop=Message.PROP_ALL)
+    slotOrigin = Message.Message('BENCH', '0', src='0', data=data, prop=Message.PROP_ALL)
+    dictCopyBytes = MeasureBytes(lambda i: dictOrigin.LowerEqCopy(newDest='0.0'), count)
+    hopBytes = MeasureBytes(lambda i: slotOrigin.LowerEqCopy(newDest='0.0'), count)
+
+    print(f'{"":>24} {"dict":>10} {"slotted":>10}')
+    print(f'{"bytes / message":>24} {dictBytes:>10.0f} {slotBytes:>10.0f}')
+    print(f'{"bytes / fan-out copy":>24} {dictCopyBytes:>10.0f} {hopBytes:>10.0f}')
+    print(f'{"us / fan-out copy":>24} {TimeCopies(dictOrigin, count)*1e6:>10.3f} {TimeCopies(slotOrigin, count)*1e6:>10.3f}')
+
+    width = 1000
+    dictBroadcast = TimeBroadcast(_DictMessage, width, 200)
+    slotBroadcast = TimeBroadcast(Message.Message, width, 200)
+    print(f'{f"us / broadcast to {width}":>24} {dictBroadcast*1e6:>10.1f} {slotBroadcast*1e6:>10.1f}')
+
+if __name__ == '__main__':
+    Main()
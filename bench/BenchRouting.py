@@ -0,0 +1,63 @@
+'''
+    Routing benchmark: ScheduleMessageFor between siblings under one wide parent,
+        comparing the indexed sub-layer lookup against the old linear prefix scan.
+
+    From the main directory, call 'python -m bench.BenchRouting' to run it.
+'''
+
+import time
+
+from src import Layer, Message
+
+class _LinearScanLayer(Layer.Layer):
+    '''
+        Layer that routes the way Layer did before the sub-layer index: test every sub-layer's id as a prefix.
+            The prefix test is the segment-aware one; a plain startswith loops forever between '0.0.1' and '0.0.10'.
+    '''
+    def GetSubLayerToward(self, dest):
+        for subLayer in self.GetSubLayers():
+            if Message.IsSubIdOrEqual(dest, subLayer.GetId()):
+                return subLayer
+        return None
+
+def BuildWorld(layerClass, width):
+    '''
+        Build top -> planet -> width cities, return (top, cities).
+    '''
+    top = layerClass()
+    top.SetId('0')
+
+    planet = layerClass()
+    top.RegisterSubLayer(planet)
+
+    cities = []
+    for _ in range(width):
+        city = layerClass()
+        planet.RegisterSubLayer(city)
+        cities.append(city)
+
+    return top, cities
+
+def TimeRouting(layerClass, width, count):
+    '''
+        Return the mean seconds per ScheduleMessageFor call between the first and last city.
+    '''
+    _top, cities = BuildWorld(layerClass, width)
+    src, dst = cities[0], cities[-1]
+    message = Message.Message('BENCH', dest=dst.GetId(), src=src.GetId())
+
+    start = time.perf_counter()
+    for ts in range(count):
+        src.ScheduleMessageFor(ts, message)
+    return (time.perf_counter() - start) / count
+
+def Main():
+    print(f'{"width":>8} {"scan (us)":>12} {"index (us)":>12} {"speedup":>8}')
+    for width in [10, 100, 1000, 10000]:
+        count = 2000
+        scan = TimeRouting(_LinearScanLayer, width, count)
+        index = TimeRouting(Layer.Layer, width, count)
+        print(f'{width:>8} {scan*1e6:>12.2f} {index*1e6:>12.2f} {scan/index:>7.1f}x')
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,115 @@
+'''
+    Scheduling benchmark: add/pop throughput of the heap and timing wheel backends,
+        under tick distributions resembling game time. Measured both through a Scheduler
+        (one queue per timestamp, as in each Layer) and on the bare backend (one entry per event, as in the World).
+
+    From the main directory, call 'python -m bench.BenchScheduling' to run it.
+'''
+
+import random
+import time
+
+from src import Scheduler, SchedulingList
+
+def NearTicks(rng, now):
+    # Almost everything lands within the next few ticks.
+    return now + rng.randrange(1, 8)
+
+def MixedTicks(rng, now):
+    # Mostly near-future ticks, with timeouts and long-running timers further out.
+    r = rng.random()
+    if r < 0.8:
+        return now + rng.randrange(1, 8)
+    elif r < 0.95:
+        return now + rng.randrange(8, 200)
+    return now + rng.randrange(200, 100000)
+
+def SparseFloats(rng, now):
+    # Continuous time, where the wheel falls back to its overflow heap.
+    return now + rng.random() * 50
+
+def TimeBackend(makeBackend, distribution, pending, ops):
+    '''
+        Hold about pending timestamps in a Scheduler and time ops rounds of pop-min + adding two events
+            (one of them to the same timestamp as another, as events fanning out within a tick would).
+        Return the mean seconds per round.
+    '''
+    rng = random.Random(1)
+    s = Scheduler.Scheduler(makeBackend())
+
+    now = 0
+    for i in range(pending):
+        s.Add(distribution(rng, now), i)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        now, _q = s.Pop()
+        ts = distribution(rng, now)
+        s.Add(ts, i)
+        s.Add(ts, i)
+    return (time.perf_counter() - start) / ops
+
+def TimeEvents(makeBackend, span, pending, ops):
+    '''
+        Hold pending events spread over the next span ticks directly in a backend,
+            and time ops rounds of pop-min + push. Return the mean seconds per round.
+    '''
+    rng = random.Random(1)
+    b = makeBackend()
+
+    now = 0
+    for i in range(pending):
+        b.Push(now + rng.randrange(1, span), i)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        now, _event = b.Pop()
+        b.Push(now + rng.randrange(1, span), i)
+    return (time.perf_counter() - start) / ops
+
+def TimeSameTick(makeBackend, count):
+    '''
+        Push count events onto a single tick directly in a backend (as a World fanning out within a tick would),
+            then pop them all. Return the mean seconds per event.
+    '''
+    b = makeBackend()
+
+    start = time.perf_counter()
+    for i in range(count):
+        b.Push(1, i)
+    for i in range(count):
+        b.Pop()
+    return (time.perf_counter() - start) / count
+
+def Main():
+    backends = [
+        ('heap', SchedulingList.HeapBackend),
+        ('wheel', SchedulingList.WheelBackend),
+    ]
+    distributions = [
+        ('near ticks', NearTicks),
+        ('mixed ticks', MixedTicks),
+        ('sparse floats', SparseFloats),
+    ]
+
+    print(f'{"us / pop + 2 adds":>32} ' + ' '.join(f'{name:>10}' for name, _ in backends))
+    for pending in [100, 10000]:
+        for name, distribution in distributions:
+            results = [TimeBackend(makeBackend, distribution, pending, 100000) for _, makeBackend in backends]
+            label = f'{name}, {pending} pending'
+            print(f'{label:>32} ' + ' '.join(f'{r*1e6:>10.3f}' for r in results))
+
+    print()
+    print(f'{"us / pop + push, bare backend":>32} ' + ' '.join(f'{name:>10}' for name, _ in backends))
+    for span, pending in [(8, 100), (200, 10000), (4000, 100000), (4000, 1000000)]:
+        makers = [SchedulingList.HeapBackend, lambda: SchedulingList.WheelBackend(size=span)]
+        results = [TimeEvents(makeBackend, span, pending, 200000) for makeBackend in makers]
+        label = f'{pending} events over {span} ticks'
+        print(f'{label:>32} ' + ' '.join(f'{r*1e6:>10.3f}' for r in results))
+    for count in [1000, 160000]:
+        results = [TimeSameTick(makeBackend, count) for _, makeBackend in backends]
+        label = f'{count} events on one tick'
+        print(f'{label:>32} ' + ' '.join(f'{r*1e6:>10.3f}' for r in results))
+
+if __name__ == '__main__':
+    Main()
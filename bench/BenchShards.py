@@ -0,0 +1,59 @@
+'''
+    Sharding benchmark: ticks per second for CPU-heavy handlers spread across independent subtrees,
+        run serially and through Shards.ShardedRunner with increasing worker counts.
+
+    From the main directory, call 'python -m bench.BenchShards' to run it.
+'''
+
+import os
+import time
+
+from src import Layer, Message, Shards
+
+class _BenchLayer(Layer.Layer):
+    def __init__(self):
+        super().__init__()
+        self.handlers['WORK'] = self.HandleWork
+
+    def HandleWork(self, message):
+        # Stand-in for real per-entity work, then keep the entity busy next tick.
+        total = 0
+        for i in range(message.GetData()):
+            total += i * i
+        self.ScheduleMessage(self.GetNow() + 1, Message.Message('WORK', dest=self.id, data=message.GetData()))
+
+def BuildTree(shards, leaves, work):
+    top = _BenchLayer()
+    top.SetId('0')
+    for _ in range(shards):
+        shard = _BenchLayer()
+        top.RegisterSubLayer(shard)
+        for _ in range(leaves):
+            leaf = _BenchLayer()
+            shard.RegisterSubLayer(leaf)
+            leaf.ScheduleMessage(0, Message.Message('WORK', dest=leaf.GetId(), data=work))
+    return top
+
+def TimeTicks(clock, ticks):
+    start = time.perf_counter()
+    clock.RunUntil(ticks - 1)
+    return (time.perf_counter() - start) / ticks
+
+def Main():
+    shards, leaves, work, ticks = 16, 50, 2000, 20
+    print(f'{shards} shards x {leaves} leaves, {os.cpu_count()} CPU(s)')
+    print(f'{"":>16} {"ms / tick":>12}')
+
+    t = TimeTicks(BuildTree(shards, leaves, work), ticks)
+    print(f'{"serial":>16} {t*1e3:>12.2f}')
+
+    for workers in [1, 2, 4, 8, 16]:
+        if workers > (os.cpu_count() or 1) * 2:
+            break
+        runner = Shards.ShardedRunner(BuildTree(shards, leaves, work), depth=1, workers=workers)
+        t = TimeTicks(runner, ticks)
+        runner.Close()
+        print(f'{f"{workers} worker(s)":>16} {t*1e3:>12.2f}')
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,276 @@
+'''
+    Benchmark suite: the engine's main costs on a synthetic world of configurable depth and fan-out,
+        stored per commit so regressions show up between runs.
+
+    Cases (each the best of --repeat runs, as time per operation):
+        register: RegisterSubLayer, per layer, building the whole world.
+        schedule: ScheduleMessage from the top to a random leaf.
+        scheduleFor: ScheduleMessageFor from a random leaf to a random leaf.
+        broadcast: One PROP_ALL message from the top, processed through every layer.
+        broadcastTopic: The same, with every layer subscribed to its region (the top layer's sub-layer it's under)
+            and the message for one region, so it only goes through that region's layers (see Layer.Subscribe).
+        broadcastArea: A top layer with the leaves' count of sub-layers spread over a square, each with a position,
+            and one message per tick to the ones within a radius of a random point (see Spatial), so about 1% of them.
+        schedulingList(heap/wheel): SchedulingList Pop + Add, holding --pending timestamps.
+        process: One Process tick delivering a message to every leaf.
+
+    Each run appends a JSON line (commit, config, results) to --results (bench_results.jsonl by default),
+        and is compared against the latest earlier run with the same config (or of the --baseline commit):
+        cases more than --threshold slower are flagged. Only compare runs from the same machine.
+
+    From the main directory, call 'python -m bench.Suite' to run it; 'python -m bench.Suite --help' lists the options.
+'''
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+
+from src import Layer, Message, SchedulingList, Spatial
+
+class _SuiteLayer(Layer.Layer):
+    __slots__ = ()
+
+    messageHandlers = {
+        'BENCH': 'HandleBench',
+    }
+
+    def HandleBench(self, message):
+        pass
+
+class _SpatialSuiteLayer(Spatial.SpatialLayer):
+    __slots__ = ()
+
+    cellSize = 50
+
+    messageHandlers = {
+        'BENCH_AREA': 'HandleBench',
+    }
+
+    def HandleBench(self, message):
+        pass
+
+def BuildWorld(depth, fanOut):
+    '''
+        Return the layers of a tree with fanOut sub-layers per layer, depth levels below the top, top first.
+    '''
+    top = _SuiteLayer()
+    top.SetId('0')
+    layers = [top]
+    level = [top]
+    for _ in range(depth):
+        nextLevel = []
+        for parent in level:
+            for _ in range(fanOut):
+                layer = _SuiteLayer()
+                parent.RegisterSubLayer(layer)
+                nextLevel.append(layer)
+        layers.extend(nextLevel)
+        level = nextLevel
+    return layers
+
+def Leaves(layers, fanOut, depth):
+    return layers[-fanOut ** depth:] if depth else layers
+
+def TimeRegister(config):
+    count = sum(config.fanOut ** d for d in range(config.depth + 1))
+    start = time.perf_counter()
+    BuildWorld(config.depth, config.fanOut)
+    return (time.perf_counter() - start) / count
+
+def TimeSchedule(config):
+    layers = BuildWorld(config.depth, config.fanOut)
+    top = layers[0]
+    rng = random.Random(1)
+    messages = [Message.Message('BENCH', dest=leaf.id) for leaf in rng.choices(Leaves(layers, config.fanOut, config.depth), k=config.ops)]
+
+    start = time.perf_counter()
+    for ts, message in enumerate(messages):
+        top.ScheduleMessage(ts, message)
+    return (time.perf_counter() - start) / config.ops
+
+def TimeScheduleFor(config):
+    layers = BuildWorld(config.depth, config.fanOut)
+    leaves = Leaves(layers, config.fanOut, config.depth)
+    rng = random.Random(1)
+    pairs = [(rng.choice(leaves), Message.Message('BENCH', dest=rng.choice(leaves).id)) for _ in range(config.ops)]
+
+    start = time.perf_counter()
+    for ts, (src, message) in enumerate(pairs):
+        src.ScheduleMessageFor(ts, message)
+    return (time.perf_counter() - start) / config.ops
+
+def TimeBroadcast(config):
+    layers = BuildWorld(config.depth, config.fanOut)
+    top = layers[0]
+    ticks = max(1, config.ops // len(layers))
+
+    start = time.perf_counter()
+    for ts in range(ticks):
+        top.ScheduleMessage(ts, Message.Message('BENCH', dest='0', prop=Message.PROP_ALL))
+        top.Step()
+    return (time.perf_counter() - start) / ticks
+
+def TimeBroadcastTopic(config):
+    layers = BuildWorld(config.depth, config.fanOut)
+    top = layers[0]
+    for layer in layers[1:]:
+        layer.Subscribe('BENCH', [layer.id.split('.')[1]])
+    ticks = max(1, config.ops // len(layers))
+
+    start = time.perf_counter()
+    for ts in range(ticks):
+        top.ScheduleMessage(ts, Message.Message('BENCH', dest='0', data='0', prop=Message.PROP_ALL))
+        top.Step()
+    return (time.perf_counter() - start) / ticks
+
+def TimeBroadcastArea(config):
+    count = config.fanOut ** config.depth
+    side = 1000
+    radius = side * math.sqrt(0.01 / math.pi)
+    rng = random.Random(1)
+
+    top = _SpatialSuiteLayer()
+    top.SetId('0')
+    layers = [_SpatialSuiteLayer() for _ in range(count)]
+    for layer in layers:
+        layer.SetPosition(rng.uniform(0, side), rng.uniform(0, side))
+    top.RegisterSubLayers(layers)
+
+    Spatial.SetAreaKey('BENCH_AREA', lambda data: data)
+    ticks = max(1, config.ops // count)
+    areas = [Spatial.InRange(rng.uniform(0, side), rng.uniform(0, side), radius) for _ in range(ticks)]
+
+    start = time.perf_counter()
+    for ts, area in enumerate(areas):
+        top.ScheduleMessage(ts, Message.Message('BENCH_AREA', dest='0', data=area, prop=Message.PROP_ALL))
+        top.Step()
+    return (time.perf_counter() - start) / ticks
+
+def TimeSchedulingList(makeBackend):
+    '''
+        Return a case timing a SchedulingList with the given backend: hold --pending consecutive timestamps,
+            and for each op pop the earliest and add one --pending ticks after it.
+    '''
+    def Time(config):
+        order = list(range(config.pending))
+        random.Random(1).shuffle(order)
+        s = SchedulingList.SchedulingList(makeBackend())
+        for ts in order:
+            s.Add(ts, ts)
+
+        start = time.perf_counter()
+        for i in range(config.ops):
+            ts, _event = s.Pop()
+            s.Add(ts + config.pending, i)
+        return (time.perf_counter() - start) / config.ops
+    return Time
+
+def TimeProcess(config):
+    layers = BuildWorld(config.depth, config.fanOut)
+    top = layers[0]
+    leaves = Leaves(layers, config.fanOut, config.depth)
+    ticks = max(1, config.ops // len(leaves))
+
+    total = 0
+    for ts in range(ticks):
+        for leaf in leaves:
+            leaf.ScheduleMessage(ts, Message.Message('BENCH', dest=leaf.id))
+        start = time.perf_counter()
+        top.Step()
+        total += time.perf_counter() - start
+    return total / ticks
+
+CASES = [
+    ('register', TimeRegister),
+    ('schedule', TimeSchedule),
+    ('scheduleFor', TimeScheduleFor),
+    ('broadcast', TimeBroadcast),
+    ('broadcastTopic', TimeBroadcastTopic),
+    ('broadcastArea', TimeBroadcastArea),
+    ('schedulingList(heap)', TimeSchedulingList(SchedulingList.HeapBackend)),
+    ('schedulingList(wheel)', TimeSchedulingList(SchedulingList.WheelBackend)),
+    ('process', TimeProcess),
+]
+
+def GitState():
+    '''
+        Return (commit, bDirty) for the working tree, or (None, None) outside a git checkout.
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+def LoadRuns(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.Suite', description='Run the benchmark suite.')
+    parser.add_argument('--depth', type=int, default=3, help='levels below the top layer')
+    parser.add_argument('--fanOut', type=int, default=10, help='sub-layers per layer')
+    parser.add_argument('--ops', type=int, default=20000, help='operations per case')
+    parser.add_argument('--pending', type=int, default=10000, help='timestamps held by the schedulingList cases')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case; the best one counts')
+    parser.add_argument('--only', nargs='*', help='run just these cases')
+    parser.add_argument('--results', default='bench_results.jsonl', help='file the results are appended to')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown flagged as a regression, e.g. 0.1 = 10%%')
+    parser.add_argument('--baseline', help='compare with the latest run of this commit instead of the latest run')
+    parser.add_argument('--noSave', action='store_true', help='compare, but don\'t store this run')
+    config = parser.parse_args(argv)
+
+    cases = [(name, case) for name, case in CASES if not config.only or name in config.only]
+    configKey = {'depth': config.depth, 'fanOut': config.fanOut, 'ops': config.ops, 'pending': config.pending}
+
+    previous = [run for run in LoadRuns(config.results)
+        if run['config'] == configKey and (not config.baseline or (run['commit'] or '').startswith(config.baseline))]
+    baseline = previous[-1] if previous else None
+
+    commit, bDirty = GitState()
+    print(f'commit {commit}{" (dirty)" if bDirty else ""}, depth {config.depth}, fan-out {config.fanOut}, '
+        f'{sum(config.fanOut ** d for d in range(config.depth + 1))} layers')
+    if baseline:
+        print(f'compared with {baseline["commit"]}{" (dirty)" if baseline["bDirty"] else ""} from {baseline["time"]}')
+    print(f'{"us / op":>24} {"this run":>12} {"baseline":>12} {"change":>8}')
+
+    results = {}
+    regressions = []
+    for name, case in cases:
+        results[name] = min(case(config) for _ in range(config.repeat))
+
+        line = f'{name:>24} {results[name]*1e6:>12.3f}'
+        before = baseline['results'].get(name) if baseline else None
+        if before:
+            change = results[name] / before - 1
+            line += f' {before*1e6:>12.3f} {change:>+7.1%}'
+            if change > config.threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    if not config.noSave:
+        run = {
+            'commit': commit,
+            'bDirty': bDirty,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': configKey,
+            'results': results,
+        }
+        with open(config.results, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    return regressions
+
+if __name__ == '__main__':
+    Main()
@@ -1,31 +1,45 @@
-from queue import Queue
-from threading import Thread
-import time
+import asyncio
+import sys
 
-from ..src import Layer, Message
+from ..src import AsyncRunner, Message, Spatial
 from ..src.Log import Log
 
+# Wall-clock seconds per unit of virtual time, pacing scheduled events. Input doesn't wait for a tick.
+TICK_SECONDS = 6.0
+
 PROMPT_DATA = {
     'bResponse': True,
     'text': 'Enter Movement:\n\tu: up,\n\td: down\n\tl: left\n\tr: right'
 }
 
-class Target(Layer.Layer):
-    locX = 0
-    locY = 0
+def CombineMovements(old, new):
+    '''
+        Coalescing reducer: movements for the same tick add up into one, answered with a single prompt.
+    '''
+    (oldX, oldY), (newX, newY) = old.GetData(), new.GetData()
+    return Message.Message('MOVEMENT', dest=new.GetDest(), src=new.GetSrc(), data=(oldX + newX, oldY + newY))
+
+class Target(Spatial.SpatialLayer):
+    messageHandlers = {
+        'MOVEMENT': 'HandleMovement',
+    }
+
+    coalescing = {
+        'MOVEMENT': CombineMovements,
+    }
 
     def __init__(self):
         super().__init__()
-        self.handlers['MOVEMENT'] = self.HandleMovement
+        self.SetPosition(0, 0)
 
     def HandleMovement(self, message):
-        Log.debug(f'Target {self} received movement {message}')
+        Log.debug('Target %s received movement %s', self, message)
 
         deltaX, deltaY = message.GetData()
-        Target.locX += deltaX
-        Target.locY += deltaY
+        x, y = self.GetPosition()
+        self.SetPosition(x + deltaX, y + deltaY)
 
-        Log.debug(f'Location: {(Target.locX, Target.locY)}')
+        Log.debug('Location: %s', self.GetPosition())
 
         # ScheduleMessageFor client
         response = Message.Message(
@@ -35,72 +49,64 @@ class Target(Layer.Layer):
             src=self.GetId(),
         )
 
-        self.ScheduleMessageFor(0, response)
-
-# May need a separate thread within the UI thread to collect user inputs.
-# Can't do this within the main uiThread since we don't want to block any messages while scanning for inputs.
-# May also need a separate display thread to display those messages.
-
-def uiThread(qToUser, qFromUser):
-    while True:
-        while not qToUser.empty():
-            message = qToUser.get()
-            Log.debug(f'UI Thread, ts {message.GetData()}')
-            qToUser.task_done()
-
-            d = message.GetData()
-            if d.get('bResponse', False):
-                print(d.get('text'))
-                i = input('')
-
-                if 'u' == i:
-                    m = (0, 1)
-                elif 'd' == i:
-                    m = (0, -1)
-                elif 'l' == i:
-                    m = (-1, 0)
-                elif 'r' == i:
-                    m = (1, 0)
-
-                movementMessage = Message.Message(
-                    'MOVEMENT',
-                    dest=message.GetSrc(),
-                    data=m,
-                )
-
-                qFromUser.put(movementMessage)
-
-class Client(Layer.Layer):
-    def __init__(self):
-        super().__init__()
-        self.handlers['PROMPT'] = self.PromptResponse
-        self.handlers['WAKEUP'] = self.HandleWakeup
+        self.ScheduleMessageFor(self.GetNow(), response)
 
-        self.qToUser = Queue(maxsize=0)
-        self.qFromUser = Queue(maxsize=0)
+# Movement deltas for each input.
+MOVES = {
+    'u': (0, 1),
+    'd': (0, -1),
+    'l': (-1, 0),
+    'r': (1, 0),
+}
 
-        ui = Thread(target=uiThread, args=(self.qToUser, self.qFromUser))
-        ui.daemon = True
-        ui.start()
+class Client(AsyncRunner.AsyncClient):
+    messageHandlers = {
+        'PROMPT': 'PromptResponse',
+    }
 
-    def HandleWakeup(self, message):
-        # This is triggered by the main thread.
-        # Check the qFromUser queue for any responses that need to be picked up and processed.
-        Log.debug('Client received periodic wakeup')
+    def __init__(self):
+        super().__init__()
 
-        while not self.qFromUser.empty():
-            message = self.qFromUser.get()
-            message.SetSrc(self.GetId())
-            self.ScheduleMessageFor(0, message)
-            self.qFromUser.task_done()
+        # Layer that sent the latest prompt, which movements are sent back to.
+        self.promptSrc = None
 
     def PromptResponse(self, message):
         # Responses should be forwarded to the UI.
-        Log.debug(f'Client {self} received prompt {message}')
-        self.qToUser.put(message)
+        Log.debug('Client %s received prompt %s', self, message)
+        self.promptSrc = message.GetSrc()
+        self.Deliver(message)
+
+    def ParseInput(self, text):
+        m = MOVES.get(text.strip())
+        if m is None or self.promptSrc is None:
+            return None
+
+        return Message.Message(
+            'MOVEMENT',
+            dest=self.promptSrc,
+            data=m,
+        )
 
-if __name__ == "__main__":
-    top = Layer.Layer()
+    def FormatOutput(self, message):
+        return message.GetData().get('text', '') + '\n'
+
+async def ConsoleStreams():
+    '''
+        Return an asyncio (reader, writer) pair for stdin/stdout, so the console is served like any other connection.
+    '''
+    loop = asyncio.get_running_loop()
+
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+async def Main():
+    Log.Configure()
+
+    top = Spatial.SpatialLayer()
     top.SetId('Top')
 
     target = Target()
@@ -121,22 +127,14 @@ if __name__ == "__main__":
 
     target.ScheduleMessage(0, promptMessage)
 
-    wakeupMessage = Message.Message(
-        'WAKEUP',
-        dest=top.GetId(),
-        prop=Message.PROP_ALL,
-    )
+    # Input is handled as soon as it arrives; TICK_SECONDS only paces scheduled events.
+    runner = AsyncRunner.AsyncRunner(top, tickSeconds=TICK_SECONDS)
+    runTask = asyncio.create_task(runner.Run())
 
-    ts = 0
-    while True:
-        wakeupMessage.SetData(ts)
-        top.ScheduleMessage(ts, wakeupMessage)
-        top.Process(ts)
-    
-        # TODO: Need to a way to schedule for a time, ex. schedule for timestamp x.
-        # The issue is that by the time the message is processed, it might be a long time in the past.
-        # Need to implement a timeout mechanism for schedulers and processors, i.e. what if the timestamp has passed already?
-        # For now, just keep reusing the same timestamp.
-        #ts += 1
-
-        time.sleep(6.0)
\ No newline at end of file
+    reader, writer = await ConsoleStreams()
+    await client.Pump(runner, reader, writer)
+    runner.Stop()
+    await runTask
+
+if __name__ == "__main__":
+    asyncio.run(Main())
@@ -0,0 +1,147 @@
+'''
+    Drive a Clock (a root Layer or a World) from an asyncio event loop, so clients can be served on the same loop.
+
+    AsyncRunner steps the clock as virtual time comes due, paced at tickSeconds of wall-clock time per unit
+        (0 runs as fast as possible), and sleeps on the loop in between instead of polling.
+    Input from outside the tree goes through Submit(layer, message): it's scheduled at the current virtual time
+        and wakes the runner, so it's handled right away rather than on the next tick.
+
+    AsyncClient is a Layer that talks to a user or connection:
+        messages for the user are handed over with Deliver(message) and awaited with Receive(),
+        and Pump(runner, reader, writer) serves the client over an asyncio stream pair.
+    Everything runs on one thread; call Submit from other threads through loop.call_soon_threadsafe.
+'''
+
+import asyncio
+
+from . import Layer
+from .Log import Log
+
+class AsyncRunner:
+    def __init__(self, clock, tickSeconds=0.0):
+        self.clock = clock
+        self.tickSeconds = tickSeconds
+
+        # Set to wake Run up early: new input, or Stop().
+        self.wakeup = asyncio.Event()
+        self.bStopped = False
+
+    def Now(self):
+        '''
+            Return the virtual time input is scheduled at: the clock's current time.
+        '''
+        return self.clock.now if self.clock.now is not None else 0
+
+    def Submit(self, layer, message):
+        '''
+            Schedule message on behalf of its destination (see Layer.ScheduleMessageFor) at the current virtual time,
+                and wake the runner so it's handled immediately. Return the message's handle.
+        '''
+        handle = layer.ScheduleMessageFor(self.Now(), message)
+        self.wakeup.set()
+        return handle
+
+    def Stop(self):
+        self.bStopped = True
+        self.wakeup.set()
+
+    async def Run(self, until=None):
+        '''
+            Step the clock as timestamps come due until Stop() is called,
+                or, if until is given, until virtual time reaches it. Return the number of steps taken.
+        '''
+        loop = asyncio.get_running_loop()
+        startWall = loop.time()
+        startTs = self.Now()
+        steps = 0
+
+        self.bStopped = False
+        while not self.bStopped:
+            self.wakeup.clear()
+
+            # Wall-clock seconds until nextTs/until come due.
+            nextTs = self.clock.NextTs()
+            if until is not None and (nextTs is None or nextTs > until):
+                nextTs = None
+            delay = None if nextTs is None else startWall + (nextTs - startTs) * self.tickSeconds - loop.time()
+
+            if delay is not None and delay <= 0:
+                self.clock.Step()
+                steps += 1
+
+                # Let clients see the results of this step before the next one.
+                await asyncio.sleep(0)
+                continue
+
+            if until is not None:
+                untilDelay = startWall + (until - startTs) * self.tickSeconds - loop.time()
+                if untilDelay <= 0:
+                    self.clock.RunUntil(until)
+                    break
+                delay = untilDelay if delay is None else min(delay, untilDelay)
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        return steps
+
+class AsyncClient(Layer.Layer):
+    def __init__(self):
+        super().__init__()
+
+        # Messages waiting for the user.
+        self.toUser = asyncio.Queue()
+
+    def Deliver(self, message):
+        '''
+            Hand message over to the user; call it from handlers.
+        '''
+        self.toUser.put_nowait(message)
+
+    async def Receive(self):
+        '''
+            Wait for and return the next message for the user.
+        '''
+        return await self.toUser.get()
+
+    def ParseInput(self, text):
+        '''
+            Turn a line of user input into a message to submit, or None to ignore it. Override as needed.
+        '''
+        return None
+
+    def FormatOutput(self, message):
+        '''
+            Turn a message for the user into text to send them. Override as needed.
+        '''
+        return f'{message}\n'
+
+    async def Pump(self, runner, reader, writer):
+        '''
+            Serve this client over a stream pair until the reader hits EOF:
+                each line read is turned into a message by ParseInput and submitted through runner,
+                and each message delivered to the client is written out with FormatOutput.
+        '''
+        sender = asyncio.create_task(self.Forward(writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                message = self.ParseInput(line.decode())
+                if message is not None:
+                    message.SetSrc(self.GetId())
+                    runner.Submit(self, message)
+        finally:
+            sender.cancel()
+
+        Log.debug('Client %s disconnected', self)
+
+    async def Forward(self, writer):
+        while True:
+            message = await self.Receive()
+            writer.write(self.FormatOutput(message).encode())
+            await writer.drain()
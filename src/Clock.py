@@ -0,0 +1,96 @@
+'''
+    Virtual clock for running a simulation as fast as the CPU allows, with no wall-clock sleeps.
+
+    Clock is a mixin for anything that can drive a tree of layers through time (the root Layer or a World).
+    It expects the class to provide:
+        NextTs(): Timestamp of the next queued event, or None.
+        Process(ts): Process everything queued at ts.
+        Discard(ts): Drop everything queued at ts without handling it.
+
+    Events can be queued for a timestamp that's already in the past, e.g. a handler scheduling for ts 0 on tick 100.
+    The latePolicy decides what happens to them:
+        LATE_RUN: Process them anyway, in timestamp order, without moving the clock backwards.
+        LATE_DROP: Discard them.
+        LATE_RAISE: Raise PastDueError.
+'''
+
+from .Log import Log
+from .Metrics import Metrics
+
+LATE_RUN    = 'run'
+LATE_DROP   = 'drop'
+LATE_RAISE  = 'raise'
+
+class PastDueError(Exception):
+    pass
+
+class Clock:
+    # No per-instance storage of its own, so slotted subclasses (Layer) stay slotted.
+    __slots__ = ()
+
+    # Current virtual time: the latest timestamp stepped to, or None before the first step.
+    now = None
+
+    latePolicy = LATE_RUN
+
+    def GetNow(self):
+        return self.now
+
+    def Step(self):
+        '''
+            Process the next queued timestamp and advance the clock to it.
+                Return the processed timestamp, or None if nothing is queued.
+        '''
+        ts = self.NextTs()
+        if ts is None:
+            return None
+
+        if self.now is not None and ts < self.now:
+            self.ProcessLate(ts)
+        else:
+            self.now = ts
+            self.Process(ts)
+
+        if Metrics.bEnabled:
+            Metrics.Tick()
+
+        return ts
+
+    def RunUntil(self, ts):
+        '''
+            Process every queued timestamp up to and including ts, in order, then advance the clock to ts.
+                Return the number of steps taken.
+        '''
+        steps = 0
+
+        nextTs = self.NextTs()
+        while nextTs is not None and nextTs <= ts:
+            self.Step()
+            steps += 1
+            nextTs = self.NextTs()
+
+        if self.now is None or self.now < ts:
+            self.now = ts
+
+        return steps
+
+    def RunFor(self, duration):
+        '''
+            Advance the clock by duration from the current time (0 if the clock hasn't started).
+                Return the number of steps taken.
+        '''
+        return self.RunUntil((self.now or 0) + duration)
+
+    def ProcessLate(self, ts):
+        '''
+            Apply the latePolicy to events queued at ts, which is earlier than the time being processed.
+        '''
+        if Log.bDebug:
+            Log.debug('%s has events past due at %s (now %s), policy %s', self, ts, self.now, self.latePolicy)
+
+        if self.latePolicy == LATE_RAISE:
+            raise PastDueError(f'{self} has events past due at {ts} (now {self.now})')
+        elif self.latePolicy == LATE_DROP:
+            self.Discard(ts)
+        else:
+            self.Process(ts)
@@ -0,0 +1,182 @@
+'''
+    Compact binary encoding for the values that pass through the engine: message data, layer state, snapshots.
+
+    Every value starts with a one-byte tag:
+        None, True, False
+        int: zigzag varint
+        float: 8 bytes, big-endian IEEE 754
+        str, bytes: varint length, then the (UTF-8) bytes
+        list, tuple: varint count, then the items
+        dict: varint count, then alternating keys and values
+        Message: type name, dest, src, data and prop, each encoded as a value
+        anything else: varint length, then a pickle of it (so it must be picklable)
+
+    Encode appends to a bytearray; Decode reads from any bytes-like buffer at a position
+        and returns (value, new position), so values can be packed back to back in a stream.
+    Unpickling runs whatever code the data names, so data from anywhere untrusted (e.g. the network, see Remote)
+        must be decoded with bPickle=False, which raises DecodeError on a pickled value instead.
+'''
+
+import pickle
+import struct
+
+from . import Message
+
+TAG_NONE    = 0
+TAG_TRUE    = 1
+TAG_FALSE   = 2
+TAG_INT     = 3
+TAG_FLOAT   = 4
+TAG_STR     = 5
+TAG_BYTES   = 6
+TAG_LIST    = 7
+TAG_TUPLE   = 8
+TAG_DICT    = 9
+TAG_MESSAGE = 10
+TAG_PICKLE  = 11
+
+_float = struct.Struct('>d')
+
+class DecodeError(Exception):
+    pass
+
+def EncodeVarint(n, out):
+    '''
+        Append the non-negative int n as a little-endian base-128 varint.
+    '''
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def DecodeVarint(buf, pos):
+    n = 0
+    shift = 0
+    while True:
+        try:
+            b = buf[pos]
+        except IndexError:
+            raise DecodeError('Truncated varint') from None
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def Encode(value, out):
+    '''
+        Append the encoding of value to the bytearray out.
+    '''
+    t = type(value)
+
+    if value is None:
+        out.append(TAG_NONE)
+    elif t is bool:
+        out.append(TAG_TRUE if value else TAG_FALSE)
+    elif t is int:
+        out.append(TAG_INT)
+        EncodeVarint(value << 1 if value >= 0 else (-value << 1) - 1, out)
+    elif t is float:
+        out.append(TAG_FLOAT)
+        out += _float.pack(value)
+    elif t is str:
+        data = value.encode()
+        out.append(TAG_STR)
+        EncodeVarint(len(data), out)
+        out += data
+    elif t is bytes:
+        out.append(TAG_BYTES)
+        EncodeVarint(len(value), out)
+        out += value
+    elif t is list or t is tuple:
+        out.append(TAG_LIST if t is list else TAG_TUPLE)
+        EncodeVarint(len(value), out)
+        for item in value:
+            Encode(item, out)
+    elif t is dict:
+        out.append(TAG_DICT)
+        EncodeVarint(len(value), out)
+        for k, v in value.items():
+            Encode(k, out)
+            Encode(v, out)
+    elif isinstance(value, Message._MessageBase):
+        out.append(TAG_MESSAGE)
+        Encode(value.GetType(), out)
+        Encode(value.dest, out)
+        Encode(value.GetSrc(), out)
+        Encode(value.GetData(), out)
+        Encode(value.prop, out)
+    else:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        out.append(TAG_PICKLE)
+        EncodeVarint(len(data), out)
+        out += data
+
+def Decode(buf, pos=0, bPickle=True):
+    '''
+        Decode the value starting at buf[pos]. Return (value, position just past it).
+            With bPickle False, a pickled value anywhere in it raises DecodeError.
+    '''
+    try:
+        tag = buf[pos]
+    except IndexError:
+        raise DecodeError('Truncated value') from None
+    pos += 1
+
+    if tag == TAG_NONE:
+        return None, pos
+    elif tag == TAG_TRUE:
+        return True, pos
+    elif tag == TAG_FALSE:
+        return False, pos
+    elif tag == TAG_INT:
+        n, pos = DecodeVarint(buf, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    elif tag == TAG_FLOAT:
+        return _float.unpack_from(buf, pos)[0], pos + 8
+    elif tag == TAG_STR or tag == TAG_BYTES or tag == TAG_PICKLE:
+        n, pos = DecodeVarint(buf, pos)
+        data = bytes(buf[pos:pos + n])
+        if len(data) != n:
+            raise DecodeError('Truncated value')
+        if tag == TAG_STR:
+            return data.decode(), pos + n
+        elif tag == TAG_BYTES:
+            return data, pos + n
+        elif not bPickle:
+            raise DecodeError('Pickled value where only plain values are allowed')
+        return pickle.loads(data), pos + n
+    elif tag == TAG_LIST or tag == TAG_TUPLE:
+        n, pos = DecodeVarint(buf, pos)
+        items = []
+        for _ in range(n):
+            item, pos = Decode(buf, pos, bPickle)
+            items.append(item)
+        return (items if tag == TAG_LIST else tuple(items)), pos
+    elif tag == TAG_DICT:
+        n, pos = DecodeVarint(buf, pos)
+        d = {}
+        for _ in range(n):
+            k, pos = Decode(buf, pos, bPickle)
+            d[k], pos = Decode(buf, pos, bPickle)
+        return d, pos
+    elif tag == TAG_MESSAGE:
+        type, pos = Decode(buf, pos, bPickle)
+        dest, pos = Decode(buf, pos, bPickle)
+        src, pos = Decode(buf, pos, bPickle)
+        data, pos = Decode(buf, pos, bPickle)
+        prop, pos = Decode(buf, pos, bPickle)
+        return Message.Message(type, dest, src=src, data=data, prop=prop), pos
+
+    raise DecodeError(f'Unknown tag {tag}')
+
+def Dumps(value):
+    out = bytearray()
+    Encode(value, out)
+    return bytes(out)
+
+def Loads(data, bPickle=True):
+    value, pos = Decode(data, 0, bPickle)
+    if pos != len(data):
+        raise DecodeError(f'{len(data) - pos} trailing byte(s)')
+    return value
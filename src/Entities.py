@@ -0,0 +1,238 @@
+'''
+    Bulk entities: one layer standing for many homogeneous entities, with their state in NumPy columns
+        instead of a Layer (and scheduler, and handler call per message) each.
+
+    An EntityLayer registers with its parent like any layer. Its entities have no layers of their own:
+        entity n is addressed as '<layer id>.<n>' (see GetEntityId), and messages for it are routed to and queued in
+        the EntityLayer (see Layer.bHoldsSubIds), so ScheduleMessage, ScheduleMessageFor and ScheduleMany all reach it.
+    Each tick, the messages of each type for its entities are handled together, in one call to the type's batch handler,
+        named in batchHandlers as handlers are in messageHandlers: handler(indices, messages), with the entities' indices
+        as an int array and their messages in the same order. Work on the columns with the indices, e.g.
+            self.columns['hp'][indices] -= np.fromiter((m.GetData() for m in messages), float, len(messages))
+        A broadcast that propagates down to the layer (or is sent to it with PROP_LT/PROP_LTE) gets a call of its own,
+        with every live entity. Messages addressed to the layer itself also run its messageHandlers as usual.
+        Messages for an entity that propagate up (PROP_GTE, ...) go on to the layer, and beyond, as from any sub-layer.
+        Any others of a type without a batch handler have nothing to run them, and are logged as a warning.
+
+    State is in columns: NumPy arrays with one value per entity slot, with dtypes from the class's columnTypes table.
+        Spawn adds entities, reusing the slots of dead ones, and Kill removes them. Messages for dead entities are dropped,
+        but ones still queued for a slot when it's reused go to its new entity.
+    Layers attached to a World can't hold entities (the World dispatches messages straight to their layers).
+
+    NumPy is optional: only EntityLayer needs it, and creating one without it raises ImportError.
+'''
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import Layer, Message
+from .Journal import Journal
+from .Log import Log
+from .Metrics import Metrics
+
+class EntityLayer(Layer.Layer):
+    bHoldsSubIds = True
+    bCollectsMessages = True
+
+    # Map column name -> NumPy dtype of the entities' state, e.g. {'x': 'f8', 'hp': 'i4'}.
+    # Merged with the base classes' tables like messageHandlers.
+    columnTypes = {}
+
+    # Map message type -> name of the method handling the messages of that type for many entities at once.
+    batchHandlers = {}
+
+    # Map column name -> dtype and type id -> batch handler function, built from columnTypes and batchHandlers.
+    classColumnTypes = {}
+    classBatchDispatch = {}
+
+    # Entity slots a new layer starts with; the columns double in size whenever they're full.
+    initialCapacity = 16
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.BuildClassBatchTables()
+
+    @classmethod
+    def BuildClassBatchTables(cls):
+        '''
+            Rebuild the class's column and batch handler tables from those of it and its bases.
+        '''
+        columnTypes = {}
+        handlers = {}
+        for klass in reversed(cls.__mro__):
+            columnTypes.update(klass.__dict__.get('columnTypes', {}))
+            handlers.update(klass.__dict__.get('batchHandlers', {}))
+        cls.classColumnTypes = columnTypes
+        cls.classBatchDispatch = {Message.TypeId(type): getattr(cls, name) for type, name in handlers.items()}
+
+    def __init__(self):
+        if np is None:
+            raise ImportError('EntityLayer needs NumPy')
+        super().__init__()
+
+        # Map column name -> array of the entities' values, by slot.
+        self.columns = {name: np.zeros(self.initialCapacity, dtype) for name, dtype in self.classColumnTypes.items()}
+
+        # Which slots hold a live entity.
+        self.alive = np.zeros(self.initialCapacity, dtype=bool)
+
+        # Slots used so far (live or dead), and the dead ones below that, to reuse.
+        self.size = 0
+        self.free = []
+
+        # Map type id -> (slots, messages) for the entities, and the broadcasts to all of them,
+        # collected while the queue is drained (see RunCollected).
+        self.batches = {}
+        self.broadcasts = []
+
+    def GetEntityCount(self):
+        return self.size - len(self.free)
+
+    def GetEntityId(self, index):
+        return f'{self.id}.{index}'
+
+    def GetEntityIndex(self, dest):
+        '''
+            Return the slot of the entity with id dest, or None if it isn't a live entity of this layer.
+        '''
+        prefix = len(self.id) + 1
+        if not dest.startswith(self.id) or dest[prefix - 1:prefix] != '.':
+            return None
+        # ASCII digits only: isdigit() also takes e.g. '²', which int() rejects, and int() takes other scripts' digits.
+        sub = dest[prefix:]
+        if not sub.isascii() or not sub.isdecimal():
+            return None
+        index = int(sub)
+        return index if index < self.size and self.alive[index] else None
+
+    def GetIndices(self):
+        '''
+            Return the slots of the live entities, as an int array.
+        '''
+        return np.flatnonzero(self.alive[:self.size])
+
+    def Spawn(self, count=1, **values):
+        '''
+            Add count entities, with their columns set from values (a scalar or one value per entity) or else zero.
+                Return their slots, as an int array.
+        '''
+        reused = min(count, len(self.free))
+        indices = np.empty(count, dtype=np.intp)
+        if reused:
+            indices[:reused] = self.free[-reused:]
+            del self.free[-reused:]
+        indices[reused:] = np.arange(self.size, self.size + count - reused)
+        self.size += count - reused
+        if self.size > len(self.alive):
+            self.Grow(self.size)
+
+        self.alive[indices] = True
+        for name, column in self.columns.items():
+            column[indices] = values.get(name, 0)
+        self.MarkDirty()
+        return indices
+
+    def Kill(self, indices):
+        '''
+            Remove the entities in the given slots (an int, or an array or list of them). Dead ones are ignored.
+        '''
+        indices = np.unique(np.atleast_1d(np.asarray(indices, dtype=np.intp)))
+        indices = indices[(indices < self.size) & (indices >= 0)]
+        indices = indices[self.alive[indices]]
+        self.alive[indices] = False
+        self.free.extend(indices.tolist())
+        self.MarkDirty()
+
+    def Grow(self, size):
+        '''
+            Make room for at least size slots, doubling the capacity as often as needed.
+        '''
+        capacity = max(len(self.alive), 1)
+        while capacity < size:
+            capacity *= 2
+        self.alive = self.Resized(self.alive, capacity)
+        self.columns = {name: self.Resized(column, capacity) for name, column in self.columns.items()}
+
+    @staticmethod
+    def Resized(array, capacity):
+        resized = np.zeros(capacity, array.dtype)
+        resized[:len(array)] = array
+        return resized
+
+    def GetMessageTypeIds(self):
+        return super().GetMessageTypeIds().union(self.classBatchDispatch)
+
+    def HandleBatch(self, typeId, indices, messages):
+        '''
+            Run the batch handler for a type on behalf of the entities in indices.
+        '''
+        handler = self.classBatchDispatch[typeId]
+        if Journal.bEnabled:
+            Journal.HandleBatch(self, typeId, len(messages), handler, self, indices, messages)
+        elif Metrics.bEnabled:
+            Metrics.HandleBatch(self, typeId, len(messages), handler, self, indices, messages)
+        else:
+            handler(self, indices, messages)
+
+    def CollectMessage(self, ts, message):
+        # Collect the messages for the entities by type, and the broadcasts to all of them, in order.
+        typeId = message.GetTypeId()
+        if message.dest == self.id:
+            if typeId in self.classBatchDispatch and message.PropTargetsLower():
+                self.broadcasts.append(message)
+            return False
+
+        index = self.GetEntityIndex(message.dest)
+        if index is None:
+            # Messages for dead entities are dropped.
+            return True
+
+        if typeId in self.classBatchDispatch:
+            batch = self.batches.get(typeId)
+            if batch is None:
+                batch = self.batches[typeId] = ([], [])
+            batch[0].append(index)
+            batch[1].append(message)
+        elif not message.PropTargetsHigher():
+            Log.warning('EntityLayer %s has no batch handler for %s, sent to entity %s', self, message.GetType(), message.dest)
+
+        # Copies propagating up from an entity reach this layer, its parent, as they would from any sub-layer.
+        if message.PropTargetsHigher():
+            self.AddMessage(ts, message.HigherEqCopy(newDest=self.id))
+        return True
+
+    def RunCollected(self, ts):
+        # Run each type's batch handler once for the messages collected, then each broadcast's.
+        batches = self.batches
+        broadcasts = self.broadcasts
+        self.batches = {}
+        self.broadcasts = []
+
+        for typeId, (indices, messages) in batches.items():
+            self.HandleBatch(typeId, np.array(indices, dtype=np.intp), messages)
+
+        for m in broadcasts:
+            indices = self.GetIndices()
+            if len(indices):
+                self.HandleBatch(m.GetTypeId(), indices, [m] * len(indices))
+
+    def SnapshotState(self):
+        return {
+            'size': self.size,
+            'free': self.free,
+            'alive': self.alive[:self.size].tobytes(),
+            'columns': {name: column[:self.size].tobytes() for name, column in self.columns.items()},
+        }
+
+    def RestoreState(self, state):
+        self.Grow(state['size'])
+        self.size = state['size']
+        self.free = list(state['free'])
+        self.alive[:self.size] = np.frombuffer(state['alive'], dtype=bool)
+        for name, data in state['columns'].items():
+            if name in self.columns:
+                self.columns[name][:self.size] = np.frombuffer(data, dtype=self.classColumnTypes[name])
+
+EntityLayer.BuildClassBatchTables()
@@ -0,0 +1,54 @@
+'''
+    A Handle refers to one scheduled message, as returned by Layer.ScheduleMessage and ScheduleMessageFor.
+    It can cancel the message or move it to another timestamp while it's still pending.
+
+    Cancelling is lazy (the message is skipped when its timestamp comes up), so it costs O(1) plus O(log n)
+        when the timestamp is left empty. Notifications posted to ancestors for a timestamp that no longer has
+        any live messages are cancelled along with it.
+'''
+
+class Handle:
+    __slots__ = ('layer', 'ts', 'message', 'entry', 'bCancelled')
+
+    def __init__(self, layer, ts, message, entry=None):
+        # Layer whose queue holds the message.
+        self.layer = layer
+        self.ts = ts
+        self.message = message
+
+        # The World's queue entry, if the layer was attached to a World when the message was queued.
+        self.entry = entry
+
+        self.bCancelled = False
+
+    def Cancel(self):
+        '''
+            Stop the message from being handled.
+                Return True if it was still pending, False if it had already run or been cancelled.
+        '''
+        if self.bCancelled:
+            return False
+
+        self.bCancelled = self.layer.CancelMessage(self)
+        return self.bCancelled
+
+    def Reschedule(self, ts):
+        '''
+            Cancel the message if it's still pending, and schedule it again at ts. Return this handle.
+                If it can't be scheduled again (see Layer.ScheduleMessage), the handle is left dead, as if cancelled.
+        '''
+        self.Cancel()
+
+        handle = self.layer.ScheduleMessage(ts, self.message)
+        if handle is None:
+            self.bCancelled = True
+            return self
+
+        self.layer = handle.layer
+        self.ts = ts
+        self.entry = handle.entry
+        self.bCancelled = False
+        return self
+
+    def __str__(self):
+        return f'Handle({self.message.GetType()} in {self.layer} at {self.ts})'
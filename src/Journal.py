@@ -0,0 +1,318 @@
+'''
+    Record and replay: an append-only journal of what enters a Layer tree, which Replay feeds back through a fresh one.
+
+    Nothing is recorded until Journal.Start(...) is called. Like Metrics, the engine guards each recording site
+        with "if Journal.bEnabled:", so a stopped journal costs one attribute check per site.
+
+    Entries, in the order they happened:
+        KIND_SCHEDULE: ScheduleMessage(ts, message) called on a layer from outside the engine.
+        KIND_ADD: AddMessage(ts, message), likewise.
+        KIND_MANY: ScheduleMany(entries).
+        KIND_PROCESS: Process(ts) on a layer, usually the root stepping its clock, with the clock's time.
+        KIND_DISCARD: Discard(ts), likewise.
+        KIND_CANCEL: A Handle cancelled from outside the engine (Cancel, or Reschedule before scheduling again),
+            with the message's position in the layer's queue at ts, as replaying the inputs queues it there again.
+        KIND_HANDLED: A handler ran for a message (with bRecordHandlers), for Replay to verify against.
+    Calls the engine makes itself, and anything handlers schedule, aren't inputs: replaying the inputs makes them again.
+        Inputs made from inside a handler are replayed by that handler, so they're never recorded either.
+
+    The file is MAGIC, a compression flag byte, then the entries (zlib-compressed as one stream if the flag is set),
+        each a varint length and a Codec encoding of (kind, layer id, ts, value).
+        Writes are buffered in memory and flushed every bufferSize bytes, and on Stop.
+
+    Replay builds nothing itself: give it a fresh tree built the same way as the recorded one, so the ids match.
+        It runs the inputs back to back, as fast as the engine goes, and with bVerify compares the handler calls
+        it sees with the recorded ones.
+    Trees attached to a World can't be replayed: the calls into their layers are recorded,
+        but the World's own Process and Discard aren't, and its queue bypasses the layers.
+'''
+
+import time
+import zlib
+
+from . import Codec, Handle, Message
+from .Metrics import Metrics
+
+MAGIC = b'LOJrnl\x01'
+
+KIND_SCHEDULE   = 's'
+KIND_ADD        = 'a'
+KIND_MANY       = 'm'
+KIND_PROCESS    = 'p'
+KIND_DISCARD    = 'd'
+KIND_CANCEL     = 'c'
+KIND_HANDLED    = 'h'
+
+class JournalError(Exception):
+    pass
+
+class _Journal:
+    def __init__(self):
+        self.bEnabled = False
+        self.bRecordHandlers = False
+
+        # Depth of engine calls in progress; only calls made at depth 0 are inputs.
+        self.depth = 0
+
+        # Where entries go: a file (with its compressor and buffer), or a list while Replay verifies.
+        self.file = None
+        self.bOwnFile = False
+        self.compressor = None
+        self.buffer = bytearray()
+        self.bufferSize = 1 << 16
+        self.captured = None
+
+    def Start(self, file, bCompress=True, bufferSize=1 << 16, bRecordHandlers=True):
+        '''
+            Start recording to file, a path or a binary file object. Handler calls are recorded too with bRecordHandlers,
+                so Replay can verify them.
+        '''
+        if self.bEnabled:
+            raise JournalError('The journal is already recording')
+
+        if isinstance(file, str):
+            self.file = open(file, 'wb')
+            self.bOwnFile = True
+        else:
+            self.file = file
+            self.bOwnFile = False
+
+        self.file.write(MAGIC + (b'\x01' if bCompress else b'\x00'))
+        self.compressor = zlib.compressobj() if bCompress else None
+        self.buffer = bytearray()
+        self.bufferSize = bufferSize
+        self.bRecordHandlers = bRecordHandlers
+        self.depth = 0
+        self.bEnabled = True
+
+    def Stop(self):
+        '''
+            Stop recording, writing out what's buffered (and closing the file if Start opened it).
+        '''
+        if self.file is not None:
+            self.Flush()
+            if self.compressor is not None:
+                self.file.write(self.compressor.flush())
+            if self.bOwnFile:
+                self.file.close()
+            else:
+                self.file.flush()
+
+        self.file = None
+        self.compressor = None
+        self.captured = None
+        self.bEnabled = False
+
+    def Flush(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.file.write(self.compressor.compress(data) if self.compressor is not None else data)
+
+    def Write(self, kind, layer, ts, value):
+        entry = bytearray()
+        Codec.Encode((kind, layer.id, ts, value), entry)
+        Codec.EncodeVarint(len(entry), self.buffer)
+        self.buffer += entry
+        if len(self.buffer) >= self.bufferSize:
+            self.Flush()
+
+    def Input(self, kind, layer, ts, value, call, *args):
+        '''
+            Record an input to layer, then make it with call(*args). Return what call returns.
+        '''
+        if self.file is not None:
+            self.Write(kind, layer, ts, value)
+
+        self.depth += 1
+        try:
+            return call(*args)
+        finally:
+            self.depth -= 1
+
+    def ScheduleMessage(self, layer, ts, message):
+        return self.Input(KIND_SCHEDULE, layer, ts, message, layer.ScheduleMessage, ts, message)
+
+    def AddMessage(self, layer, ts, message):
+        return self.Input(KIND_ADD, layer, ts, message, layer.AddMessage, ts, message)
+
+    def ScheduleMany(self, layer, entries):
+        entries = list(entries)
+        return self.Input(KIND_MANY, layer, None, entries, layer.ScheduleMany, entries)
+
+    def Process(self, layer, ts):
+        # The clock's time goes with it: handlers may read it, and Replay has no clock to step.
+        return self.Input(KIND_PROCESS, layer, ts, layer.GetNow(), layer.Process, ts)
+
+    def Discard(self, layer, ts):
+        return self.Input(KIND_DISCARD, layer, ts, None, layer.Discard, ts)
+
+    def CancelMessage(self, layer, handle):
+        # The message is found by its place in the queue; None if it isn't there to cancel.
+        q = layer.scheduler.Get(handle.ts) if handle.entry is None else None
+        index = next((i for i, e in enumerate(q) if e is handle.message), None) if q else None
+        return self.Input(KIND_CANCEL, layer, handle.ts, index, layer.CancelMessage, handle)
+
+    def Handle(self, layer, message, handler, *args):
+        '''
+            Run handler(*args, message) on behalf of layer, recording the call (see Metrics.Handle).
+        '''
+        if self.captured is not None:
+            self.captured.append((layer.id, message.GetType()))
+        elif self.bRecordHandlers and self.file is not None:
+            self.Write(KIND_HANDLED, layer, None, message.GetType())
+
+        self.depth += 1
+        try:
+            if Metrics.bEnabled:
+                Metrics.Handle(layer, message, handler, *args)
+            else:
+                handler(*args, message)
+        finally:
+            self.depth -= 1
+
+    def HandleBatch(self, layer, typeId, count, handler, *args):
+        '''
+            Run handler(*args) on behalf of layer, for count messages of a type at once, recording it as one call.
+        '''
+        if self.captured is not None:
+            self.captured.append((layer.id, Message.TypeName(typeId)))
+        elif self.bRecordHandlers and self.file is not None:
+            self.Write(KIND_HANDLED, layer, None, Message.TypeName(typeId))
+
+        self.depth += 1
+        try:
+            if Metrics.bEnabled:
+                Metrics.HandleBatch(layer, typeId, count, handler, *args)
+            else:
+                handler(*args)
+        finally:
+            self.depth -= 1
+
+Journal = _Journal()
+
+def Read(f):
+    '''
+        Generator over a journal in the binary file object f: yield each (kind, layer id, ts, value) entry.
+    '''
+    header = f.read(len(MAGIC) + 1)
+    if header[:len(MAGIC)] != MAGIC or len(header) != len(MAGIC) + 1:
+        raise JournalError('Not a journal, or an unsupported version')
+
+    decompressor = zlib.decompressobj() if header[-1] else None
+    buf = bytearray()
+    pos = 0
+    bEnd = False
+    while True:
+        # Parse whole entries out of what's been read so far, then read more.
+        while True:
+            try:
+                n, start = Codec.DecodeVarint(buf, pos)
+            except Codec.DecodeError:
+                break
+            if start + n > len(buf):
+                break
+            yield Codec.Loads(bytes(buf[start:start + n]))
+            pos = start + n
+
+        if bEnd:
+            if pos != len(buf):
+                raise JournalError('Truncated journal')
+            return
+
+        del buf[:pos]
+        pos = 0
+        chunk = f.read(1 << 16)
+        if not chunk:
+            bEnd = True
+            if decompressor is not None:
+                buf += decompressor.flush()
+        else:
+            buf += decompressor.decompress(chunk) if decompressor is not None else chunk
+
+class ReplayResult:
+    def __init__(self):
+        self.inputs = 0
+        self.seconds = 0.0
+
+        # With bVerify: the recorded handler calls and the replayed ones, as (layer id, message type) pairs,
+        # and the index of the first difference (None if they match).
+        self.expected = []
+        self.actual = []
+        self.mismatch = None
+
+    def __str__(self):
+        text = f'{self.inputs} input(s) in {self.seconds:.3f}s'
+        if self.mismatch is not None:
+            expected = self.expected[self.mismatch] if self.mismatch < len(self.expected) else None
+            actual = self.actual[self.mismatch] if self.mismatch < len(self.actual) else None
+            text += f'; handler call {self.mismatch} differs: expected {expected}, got {actual}'
+        return text
+
+def Replay(f, root, bVerify=False):
+    '''
+        Feed the journal in the binary file object f (or at a path) through the tree under root, and return a ReplayResult.
+            With bVerify, also compare the handler calls made with the recorded ones.
+    '''
+    if Journal.bEnabled:
+        raise JournalError('Can\'t replay while the journal is recording')
+
+    if isinstance(f, str):
+        with open(f, 'rb') as file:
+            return Replay(file, root, bVerify)
+
+    result = ReplayResult()
+    if bVerify:
+        # Capture the handler calls instead of writing them anywhere.
+        Journal.captured = result.actual
+        Journal.bEnabled = True
+
+    layers = {root.id: root}
+    start = time.perf_counter()
+    try:
+        for kind, layerId, ts, value in Read(f):
+            if kind == KIND_HANDLED:
+                result.expected.append((layerId, value))
+                continue
+
+            layer = layers.get(layerId)
+            if layer is None:
+                layer = layers[layerId] = root.FindLayer(layerId)
+                if layer is None:
+                    raise JournalError(f'Replay found no layer {layerId}')
+
+            Journal.depth = 1
+            if kind == KIND_SCHEDULE:
+                layer.ScheduleMessage(ts, value)
+            elif kind == KIND_ADD:
+                layer.AddMessage(ts, value)
+            elif kind == KIND_MANY:
+                layer.ScheduleMany(value)
+            elif kind == KIND_PROCESS:
+                top = layer
+                while top.parents:
+                    top = top.parents[0]
+                top.now = value
+                layer.Process(ts)
+            elif kind == KIND_DISCARD:
+                layer.Discard(ts)
+            elif kind == KIND_CANCEL:
+                q = layer.scheduler.Get(ts)
+                if value is not None and q is not None and value < len(q):
+                    Handle.Handle(layer, ts, q[value]).Cancel()
+            else:
+                raise JournalError(f'Unknown journal entry {kind}')
+            Journal.depth = 0
+            result.inputs += 1
+    finally:
+        result.seconds = time.perf_counter() - start
+        Journal.depth = 0
+        if bVerify:
+            Journal.captured = None
+            Journal.bEnabled = False
+
+    if bVerify:
+        result.mismatch = next((i for i, (e, a) in enumerate(zip(result.expected, result.actual)) if e != a), None)
+        if result.mismatch is None and len(result.expected) != len(result.actual):
+            result.mismatch = min(len(result.expected), len(result.actual))
+
+    return result
@@ -2,12 +2,111 @@
     The Layer class is an abstraction of basically any object ("Item", to avoid confusion with OOO coding terminology).
     It can be owned by parent Layers and own a collection of sub-Layers.
     At its heart, its job is to handle incoming messages by either processing them or routing them to another layer.
+
+    The top-level Layer of a tree is also its Clock: use Step/RunUntil/RunFor on it to advance virtual time.
 '''
 
-from . import Message, Scheduler
+from . import Clock, Handle, Message, Scheduler, SchedulingList, Subscriptions
+from .Journal import Journal
 from .Log import Log
+from .Metrics import Metrics
+
+class _EmptyMap(dict):
+    '''
+        Read-only empty dict, shared by every layer that hasn't needed its own yet (see Layer.__init__).
+    '''
+    def _ReadOnly(self, *args, **kwargs):
+        raise TypeError('The shared empty map is read-only; give the layer its own dict first')
+
+    __setitem__ = setdefault = update = _ReadOnly
+
+    def __reduce__(self):
+        # Stay the shared instance when layers are pickled (see Shards).
+        return 'EMPTY_MAP'
+
+EMPTY_MAP = _EmptyMap()
+
+class _Uncacheable:
+    '''
+        Cached in place of a layer's ancestors when they're too many to cache, or cyclic (see Layer.GetAncestors).
+    '''
+    def __reduce__(self):
+        return 'UNCACHEABLE'
+
+UNCACHEABLE = _Uncacheable()
+
+class Layer(Clock.Clock):
+    # Layers are stored in slots rather than a __dict__, since trees can hold millions of them.
+    # Subclasses that add no attributes can declare __slots__ = () to stay as small; others work as usual.
+    __slots__ = (
+        'id', 'idCntr', 'scheduler', 'instanceHandlers', 'dispatch', 'registrations', 'subLayerIndex',
+        'parents', 'notifications', 'world', 'bDirty', 'bDirtyBelow', 'now', 'latePolicy', 'subscriptions',
+        'ancestors',
+    )
+
+    # Drive Process with nested calls rather than an explicit stack; see Process.
+    bRecursiveProcessing = False
+
+    # Factory for the ordering backend of each layer's scheduler (see SchedulingList).
+    # Layers whose events are mostly on dense integer ticks can use SchedulingList.WheelBackend.
+    schedulerBackend = SchedulingList.HeapBackend
+
+    # A proxy layer stands in for parts of the tree that live elsewhere (see Shards.ShardPort):
+    # routing that can't find a destination below or above it hands the message to the proxy instead.
+    bProxy = False
+
+    # A layer holding sub-ids stands for ids below its own that have no layers of their own (see Entities.EntityLayer):
+    # routing to one of them stops at this layer and queues the message here, with its dest unchanged.
+    bHoldsSubIds = False
+
+    # A collecting layer sees each message ProcessSteps takes from its queue first (see CollectMessage),
+    # and handles the ones it took once the queue is drained (see RunCollected).
+    bCollectsMessages = False
+
+    # Layers deeper than this don't cache their ancestors (see GetAncestors), as each cache holds all of them.
+    maxCachedAncestors = 64
+
+    # Map message type -> name of the method handling it, shared by every instance of the class.
+    # Subclasses only list their own types; the tables of their base classes are merged in (see __init_subclass__).
+    messageHandlers = {
+        Message.TYPE_NOTIFICATION: 'OnNotification',
+    }
+
+    # Map message type id -> handler function, built from messageHandlers when the class is created.
+    classDispatch = {}
+
+    # Map message type -> coalescing policy for messages of that type queued in this class's layers (see Scheduler),
+    # e.g. {'MOVE': Scheduler.COALESCE_LAST}. Merged with the base classes' tables like messageHandlers.
+    coalescing = {}
+
+    # Map message type id -> coalescing policy, built from coalescing; None if there's none.
+    classCoalescing = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.BuildClassDispatchTable()
+        cls.BuildClassCoalescingTable()
+
+    @classmethod
+    def BuildClassDispatchTable(cls):
+        '''
+            Rebuild the class's type id -> handler function table from the messageHandlers of it and its bases.
+        '''
+        handlers = {}
+        for klass in reversed(cls.__mro__):
+            handlers.update(klass.__dict__.get('messageHandlers', {}))
+        cls.classDispatch = {Message.TypeId(type): getattr(cls, name) for type, name in handlers.items()}
+
+    @classmethod
+    def BuildClassCoalescingTable(cls):
+        '''
+            Rebuild the class's type id -> coalescing policy table from the coalescing tables of it and its bases.
+        '''
+        policies = {}
+        for klass in reversed(cls.__mro__):
+            policies.update(klass.__dict__.get('coalescing', {}))
+        cls.classCoalescing = {Message.TypeId(type): policy for type, policy in policies.items()} or None
 
-class Layer:
     def __init__(self):
         # Id holds the unique identifier string for this instance.
         # By default it's None. It won't be assigned a value until this Item is registered to a parent.
@@ -17,19 +116,88 @@ class Layer:
         self.idCntr = 0
 
         # Tracks upcoming events that this layer needs to know about.
-        self.scheduler = Scheduler.Scheduler()
+        # Layers share an empty one until they queue something (see AddMessage).
+        self.scheduler = Scheduler.EMPTY
+
+        # Map message type -> handlers added to this instance only, on top of messageHandlers.
+        # None until first used (see handlers).
+        self.instanceHandlers = None
+
+        # Map message type id -> bound handler, built when the instance has handlers of its own (see BuildDispatchTable).
+        # None means the class's table is used as is.
+        self.dispatch = None
 
-        # Map message type -> handlers this layer will use for its own processing.
-        self.handlers = {
-            Message.TYPE_NOTIFICATION: [self.OnNotification]
-        }
+        # Map message type id -> sub layers registered to process them.
+        # This, subLayerIndex and notifications are the shared EMPTY_MAP until first written.
+        self.registrations = EMPTY_MAP
 
-        # Map message type -> sub layers registered to process them.
-        self.registrations = {}
+        # Map sub layer id -> sub layer, used to route messages toward their destination.
+        # Kept in sync by RegisterSubLayer.
+        self.subLayerIndex = EMPTY_MAP
 
         # Layers that list this one as a sub-layer.
         self.parents = []
 
+        # Map id -> layer of every layer above this one, cached by GetAncestors until the layers above change.
+        self.ancestors = None
+
+        # Map ts -> the notification this layer posted to its parents for ts, while it's pending.
+        self.notifications = EMPTY_MAP
+
+        # Topics this layer and the layers below it want, for message types filtered by topic (see Subscribe).
+        # None until first needed.
+        self.subscriptions = None
+
+        # Optional World engine driving this layer's tree from a single global queue.
+        # While set, messages for this layer are queued in the World instead of this layer's scheduler.
+        self.world = None
+
+        # Incremental snapshots (see Snapshot) only write layers whose record changed since the last one.
+        # bDirty: this layer's record changed. bDirtyBelow: some layer below it did.
+        self.bDirty = True
+        self.bDirtyBelow = False
+
+        # Clock state, used when this layer is the root of its tree (see Clock).
+        # These are slots, so they're set here: subclasses change latePolicy after calling this, not on the class.
+        self.now = None
+        self.latePolicy = Clock.LATE_RUN
+
+    def __getstate__(self):
+        '''
+            Layers are pickled to move them between processes (see Shards),
+                with their maps keyed by message type id keyed by type name (see Message.ByTypeName).
+        '''
+        state = dict(getattr(self, '__dict__', ()))
+        for klass in type(self).__mro__:
+            slots = klass.__dict__.get('__slots__', ())
+            for name in (slots,) if isinstance(slots, str) else slots:
+                if name not in ('__dict__', '__weakref__') and hasattr(self, name):
+                    state[name] = getattr(self, name)
+
+        for name in ('dispatch', 'registrations'):
+            if state.get(name):
+                state[name] = Message.ByTypeName(state[name])
+        return state
+
+    def __setstate__(self, state):
+        for name in ('dispatch', 'registrations'):
+            if state.get(name):
+                state[name] = Message.ByTypeId(state[name])
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def handlers(self):
+        '''
+            Map message type -> handler for this instance only, e.g. self.handlers['TYPE'] = self.Method.
+                Prefer messageHandlers on the class, which costs nothing per instance.
+                Each access drops the dispatch table, which is rebuilt with the changes when the next message comes.
+        '''
+        if self.instanceHandlers is None:
+            self.instanceHandlers = {}
+        self.dispatch = None
+        return self.instanceHandlers
+
     def GetId(self):
         return self.id
 
@@ -39,88 +207,482 @@ class Layer:
     def OnNotification(self):
         pass
 
+    def GetNow(self):
+        '''
+            Return the current virtual time of this layer's tree (the World's clock if attached, else the root layer's).
+        '''
+        if self.world is not None:
+            return self.world.now
+
+        layer = self
+        while layer.parents:
+            layer = layer.parents[0]
+        return layer.now
+
+    def NextTs(self):
+        '''
+            Return the timestamp of the next queued event, or None if nothing is queued.
+        '''
+        if self.world is not None:
+            return self.world.NextTs()
+
+        s = self.scheduler.Peek()
+        return s[0] if s else None
+
     def AddMessage(self, ts, message):
         '''
             Simple message adding routine.
                 Use ScheduleMessage if you want the proper upper/lower layers to schedule notifications.
         '''
-        Log.debug(f'Layer {self} added {message.GetType()} w/dest {message.GetDest()}')
-        self.scheduler.Add(ts, message)
+        if Journal.bEnabled and not Journal.depth:
+            return Journal.AddMessage(self, ts, message)
+
+        if Log.bDebug:
+            Log.debug('Layer %s added %s w/dest %s', self, message.GetType(), message.GetDest())
+        if self.world is not None:
+            self.world.Add(ts, self, message)
+        else:
+            if self.scheduler is Scheduler.EMPTY:
+                self.scheduler = self.NewScheduler()
+            self.scheduler.Add(ts, message)
+            if not self.bDirty:
+                self.MarkDirty()
+
+    def NewScheduler(self):
+        return Scheduler.Scheduler(self.schedulerBackend(), self.classCoalescing)
+
+    def MarkDirty(self):
+        '''
+            Flag this layer for the next incremental snapshot, and its ancestors as having a dirty layer below.
+                Queue changes are tracked automatically; call this when a handler changes state outside its own layer.
+        '''
+        self.bDirty = True
+        stack = list(self.parents)
+        while stack:
+            layer = stack.pop()
+            if not layer.bDirtyBelow:
+                layer.bDirtyBelow = True
+                stack.extend(layer.parents)
+
+    def SnapshotState(self):
+        '''
+            Return this layer's own state for a snapshot (see Snapshot), as a value Codec can encode.
+                Layers are recreated with no constructor arguments on restore, so anything else they need goes here.
+        '''
+        return None
+
+    def RestoreState(self, state):
+        '''
+            Restore what SnapshotState returned.
+        '''
+        pass
 
     def ScheduleMessage(self, ts, message):
         '''
             Add a message into the scheduler at the provided timestamp (ts),
                 then register notification triggers with parents if not already registered.
+                Return a Handle for cancelling or rescheduling it, or None if it couldn't be routed.
 
             It's expected that the destination is the current layer or a sublayer.
 
             If you want to schedule on behalf of another layer, including higher ones or ones in parallel braches,
                 use ScheduleMessageFor(...).   
         '''
-        type = message.GetType()
+        if Journal.bEnabled and not Journal.depth:
+            return Journal.ScheduleMessage(self, ts, message)
 
         # Notifications should be scheduled in the current layer directly
+        bNotification = message.GetTypeId() == Message.TYPEID_NOTIFICATION
         dest = message.GetDest()
 
-        if (type == Message.TYPE_NOTIFICATION) or (dest == self.id):
-            e = self.scheduler.Get(ts)
-            self.AddMessage(ts, message)
+        # Walk the layers with an explicit stack so deep trees don't recurse.
+        handle = None
+        stack = [self]
+        while stack:
+            layer = stack.pop()
+            if Metrics.bEnabled:
+                Metrics.Hop(layer, message)
 
-            # Create a notification to higher layers that can trigger processing in this layer at the appropriate time.
-            # If events were already scheduled for the target ts, assume this has already been done previously.
-            if not e:
-                notification = Message.Notification(self.id)
+            if bNotification or dest == layer.id:
+                bQueue = True
 
-                for parent in self.parents:
-                    parent.ScheduleMessage(ts, notification)
+            elif Message.IsSubIdOrEqual(dest, layer.id):
+                # Pass the message down to the sublayer on the path to its destination.
+                subLayer = layer.GetSubLayerToward(dest)
+                if subLayer is not None:
+                    stack.append(subLayer)
+                bQueue = subLayer is None and (layer.bProxy or layer.bHoldsSubIds)
 
-        elif message.DestIsSubLayerOrEqualTo(self):
-            # Pass the message down to sublayers on the path to its destination.
-            for subLayer in self.GetSubLayers():
-                if message.DestIsSubLayerOrEqualTo(subLayer):
-                    subLayer.ScheduleMessage(ts, message)
+            else:
+                bQueue = layer.bProxy
+                if not bQueue:
+                    # Jump straight to the lowest ancestor the destination is under, if it's known.
+                    ancestor = layer.FindAncestorToward(dest)
+                    if ancestor is not None:
+                        stack.append(ancestor)
+                    else:
+                        stack.extend(reversed(layer.parents))
 
-        else:
-            for parent in self.parents:
-                parent.ScheduleMessage(ts, message)
+            if not bQueue:
+                continue
+
+            h = layer.QueueMessage(ts, message)
+            if handle is None:
+                handle = h
+
+        return handle
+
+    def QueueMessage(self, ts, message):
+        '''
+            Queue message in this layer at ts, notifying the ancestors if ts is new here. Return a Handle for it.
+        '''
+        if self.world is not None and message.GetTypeId() != Message.TYPEID_NOTIFICATION:
+            # The World dispatches directly to this layer, so no notifications are needed.
+            return Handle.Handle(self, ts, message, self.world.Add(ts, self, message))
+
+        e = self.scheduler.Get(ts)
+        self.AddMessage(ts, message)
+
+        # If events were already scheduled for the target ts, assume the notifications have already been posted.
+        if not e:
+            self.PostNotifications(ts)
+
+        return Handle.Handle(self, ts, message)
+
+    def PostNotifications(self, ts):
+        '''
+            Create a notification to higher layers that can trigger processing in this layer at ts,
+                and likewise up through every ancestor that had nothing queued at ts yet.
+        '''
+        stack = [self]
+        while stack:
+            layer = stack.pop()
+            if not layer.parents:
+                continue
+
+            # Remember the notification so it can be cancelled if ts is emptied (see CancelNotifications).
+            if layer.notifications is EMPTY_MAP:
+                layer.notifications = {}
+            notification = layer.notifications[ts] = Message.Notification(layer.id)
+            if Metrics.bEnabled:
+                Metrics.Notified(layer)
+            for parent in reversed(layer.parents):
+                e = parent.scheduler.Get(ts)
+                parent.AddMessage(ts, notification)
+                if not e:
+                    stack.append(parent)
+
+    def CancelMessage(self, handle):
+        '''
+            Cancel the message a Handle refers to (see Handle.Cancel). Return True if it was still pending.
+        '''
+        if Journal.bEnabled and not Journal.depth:
+            return Journal.CancelMessage(self, handle)
+
+        if handle.entry is not None:
+            return self.world.Cancel(handle.entry)
+
+        ts = handle.ts
+        if not self.scheduler.Cancel(ts, handle.message):
+            return False
+
+        if Log.bDebug:
+            Log.debug('Layer %s cancelled %s at %s', self, handle.message.GetType(), ts)
+        self.MarkDirty()
+
+        if self.scheduler.Get(ts) is None:
+            self.CancelNotifications(ts)
+        return True
+
+    def CancelNotifications(self, ts):
+        '''
+            ts no longer has any live messages in this layer: cancel the notifications it posted for ts,
+                and those of any ancestor that's left with nothing at ts as a result.
+        '''
+        stack = [self]
+        while stack:
+            layer = stack.pop()
+            notification = layer.notifications.pop(ts, None)
+            if notification is None:
+                continue
+
+            for parent in layer.parents:
+                if parent.scheduler.Cancel(ts, notification):
+                    parent.MarkDirty()
+                    if parent.scheduler.Get(ts) is None:
+                        stack.append(parent)
 
     def ScheduleMessageFor(self, ts, message):
         '''
             Schedule a message on behalf of the destination layer.
-                Return True if successful.
+                Return a Handle for it if successful, else False.
         '''
         # Navigate to the proper destination then run normal scheduling.
         dest = message.GetDest()
 
-        Log.debug(f'Layer {self} scheduling {message.GetType()} for {dest}')
-
-        if dest == self.id:
-            self.ScheduleMessage(ts, message)
-            return True
+        if Log.bDebug:
+            Log.debug('Layer %s scheduling %s for %s', self, message.GetType(), dest)
 
-        elif message.DestIsSubLayerOrEqualTo(self):
-            for subLayer in self.GetSubLayers():
-                if message.DestIsSubLayerOrEqualTo(subLayer):
-                    if subLayer.ScheduleMessageFor(ts, message):
-                        return True
+        layer = self.FindLayer(dest)
+        if layer is None:
             return False
 
-        else:
-            for parent in self.parents:
-                if parent.ScheduleMessageFor(ts, message):
-                    return True
-            return False
+        return layer.ScheduleMessage(ts, message)
+
+    def FindLayer(self, dest):
+        '''
+            Return the layer with id dest, searching down from this layer and up through its parents, or None.
+                For an id held by a layer (see bHoldsSubIds), or stood in for by a proxy, return that layer.
+                Searches up start from the lowest ancestor the destination is under (see FindAncestorToward).
+        '''
+        bBelow = Message.IsSubIdOrEqual(dest, self.id)
+        layer = self if bBelow else self.FindAncestorToward(dest)
+        if layer is not None:
+            while dest != layer.id:
+                subLayer = layer.GetSubLayerToward(dest)
+                if subLayer is None:
+                    if layer.bProxy or layer.bHoldsSubIds:
+                        return layer
+                    # dest doesn't exist, unless a proxy above stands in for it.
+                    if bBelow or not any(ancestor.bProxy for ancestor in self.ancestors.values()):
+                        return None
+                    break
+                layer = subLayer
+            else:
+                return layer
+
+        # Depth-first search with an explicit stack: down toward dest where possible, otherwise up through each parent.
+        stack = [self]
+        seen = set()
+        while stack:
+            layer = stack.pop()
+            if id(layer) in seen:
+                continue
+            seen.add(id(layer))
+
+            if dest == layer.id:
+                return layer
+
+            elif Message.IsSubIdOrEqual(dest, layer.id):
+                subLayer = layer.GetSubLayerToward(dest)
+                if subLayer is not None:
+                    stack.append(subLayer)
+                elif layer.bProxy or layer.bHoldsSubIds:
+                    return layer
+
+            elif layer.bProxy:
+                return layer
+
+            else:
+                stack.extend(reversed(layer.parents))
+
+        return None
+
+    def ScheduleMany(self, entries):
+        '''
+            Schedule an iterable of (ts, message) pairs, each on behalf of its destination layer (as ScheduleMessageFor).
+                Messages are grouped by destination layer and added to each scheduler in bulk,
+                and every layer posts at most one notification per new timestamp to each parent.
+                Return the number of messages scheduled; ones whose destination can't be found are skipped.
+        '''
+        if Journal.bEnabled and not Journal.depth:
+            return Journal.ScheduleMany(self, entries)
+
+        # Group the messages by destination layer, keeping their order.
+        found = {}
+        byLayer = {}
+        count = 0
+        for ts, message in entries:
+            dest = message.GetDest()
+            layer = found.get(dest)
+            if layer is None:
+                layer = found[dest] = self.FindLayer(dest)
+                if layer is None:
+                    Log.warning('ScheduleMany found no layer %s', dest)
+                    continue
+
+            if layer.bProxy:
+                # Stand-ins take messages one at a time.
+                layer.ScheduleMessage(ts, message)
+                count += 1
+                continue
+
+            byLayer.setdefault(layer, []).append((ts, message))
+            count += 1
+
+        # Add each layer's batch, then pass one notification per new timestamp up to its parents, batched the same way.
+        while byLayer:
+            layer, layerEntries = byLayer.popitem()
+
+            if layer.world is not None:
+                layer.world.AddMany((ts, layer, message) for ts, message in layerEntries)
+                continue
+
+            if layer.scheduler is Scheduler.EMPTY:
+                layer.scheduler = layer.NewScheduler()
+            newTs = layer.scheduler.AddMany(layerEntries)
+            layer.MarkDirty()
+            if newTs and layer.parents:
+                if layer.notifications is EMPTY_MAP:
+                    layer.notifications = {}
+                notification = Message.Notification(layer.id)
+                for ts in newTs:
+                    layer.notifications[ts] = notification
+                if Metrics.bEnabled:
+                    Metrics.Notified(layer, len(newTs))
+                for parent in layer.parents:
+                    byLayer.setdefault(parent, []).extend((ts, notification) for ts in newTs)
+
+        return count
 
     def AddParent(self, parentLayer):
         if parentLayer not in self.parents:
             self.parents.append(parentLayer)
+            self.ForgetAncestors()
+            self.MarkDirty()
+
+    def GetAncestors(self):
+        '''
+            Return a map id -> layer of every layer above this one, through any of its parents, or None if it's too deep
+                to cache (see maxCachedAncestors) or below a cycle. The answer is cached either way,
+                and dropped when the layers above change. The map stops at proxy layers,
+                which stand in for whatever is above them.
+        '''
+        ancestors = self.ancestors
+        if ancestors is not None:
+            return None if ancestors is UNCACHEABLE else ancestors
+
+        # Fill in the caches top-down, so a layer only has one once all of its parents do (see ForgetAncestors).
+        # path is the chain of layers waiting for their parents, each a parent of the one before.
+        stack = [self]
+        path = []
+        onPath = set()
+        while stack:
+            layer = stack[-1]
+            if layer.ancestors is not None:
+                # Filled in through another of its sub-layers.
+                stack.pop()
+                continue
+
+            missing = [parent for parent in layer.parents if parent.ancestors is None]
+            if missing:
+                # Give up as soon as the chain above this layer is longer than a cache holds, or loops back on itself.
+                path.append(layer)
+                onPath.add(id(layer))
+                if len(path) > self.maxCachedAncestors or any(id(parent) in onPath for parent in missing):
+                    self.ancestors = UNCACHEABLE
+                    return None
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+            if path and path[-1] is layer:
+                path.pop()
+                onPath.discard(id(layer))
+
+            ancestors = {}
+            for parent in reversed(layer.parents):
+                if not parent.bProxy:
+                    if parent.ancestors is UNCACHEABLE:
+                        ancestors = UNCACHEABLE
+                        break
+                    ancestors.update(parent.ancestors)
+                ancestors[parent.id] = parent
+
+            if ancestors is not UNCACHEABLE and len(ancestors) > self.maxCachedAncestors:
+                ancestors = UNCACHEABLE
+            layer.ancestors = ancestors
+
+        ancestors = self.ancestors
+        return None if ancestors is UNCACHEABLE else ancestors
+
+    def ForgetAncestors(self):
+        '''
+            Drop the cached ancestors of this layer and every layer below it, after the layers above them changed.
+                Call this after changing parents directly rather than through AddParent/UnregisterSubLayer.
+        '''
+        # A layer without a cache has none below it either, so the walk stops there.
+        stack = [self]
+        while stack:
+            layer = stack.pop()
+            if layer.ancestors is not None:
+                layer.ancestors = None
+                stack.extend(layer.GetSubLayers())
+
+    def IsAncestorOf(self, layer):
+        '''
+            True if this layer is above layer, through any of its parents.
+        '''
+        ancestors = layer.GetAncestors()
+        if ancestors is not None:
+            if ancestors.get(self.id) is self:
+                return True
+            # The cache stops at proxies, so only a cache without any is the whole answer.
+            if not any(ancestor.bProxy for ancestor in ancestors.values()):
+                return False
+
+        stack = list(layer.parents)
+        seen = set()
+        while stack:
+            parent = stack.pop()
+            if parent is self:
+                return True
+            if id(parent) not in seen:
+                seen.add(id(parent))
+                stack.extend(parent.parents)
+        return False
+
+    def FindAncestorToward(self, dest):
+        '''
+            Return the lowest ancestor of this layer that is the dest id or has it below it (by id), or None if none is known.
+        '''
+        ancestors = self.GetAncestors()
+        if not ancestors:
+            return None
+
+        ancestor = ancestors.get(dest)
+        end = len(dest)
+        while ancestor is None:
+            end = dest.rfind('.', 0, end)
+            if end < 0:
+                return None
+            ancestor = ancestors.get(dest[:end])
+        return ancestor
 
     def GetMessageTypes(self):
         '''
             Returns a set of message types handled by this sub-layer instance.
                 This is per-instance and includes any types registered to this particular instance.
         '''
-        return set(self.handlers.keys()).union(set(self.registrations.keys()))
+        return {Message.TypeName(type) for type in self.GetMessageTypeIds()}
+
+    def GetMessageTypeIds(self):
+        '''
+            GetMessageTypes, as interned type ids.
+        '''
+        return set(self.GetDispatchTable()).union(self.registrations)
+
+    def BuildDispatchTable(self):
+        '''
+            Rebuild the type id -> handler table from messageHandlers and this instance's handlers, and return it.
+                This runs whenever the layer is registered, and again after handlers is used.
+        '''
+        if self.instanceHandlers is None:
+            self.dispatch = None
+            return self.classDispatch
+
+        dispatch = {type: handler.__get__(self) for type, handler in self.classDispatch.items()}
+        dispatch.update((Message.TypeId(type), handler) for type, handler in self.instanceHandlers.items())
+        self.dispatch = dispatch
+        return dispatch
+
+    def GetDispatchTable(self):
+        '''
+            Return the type id -> handler table: bound handlers if this instance has its own, else the class's functions.
+        '''
+        if self.dispatch is None:
+            return self.BuildDispatchTable()
+        return self.dispatch
 
     def NewChildId(self):
         '''
@@ -142,14 +704,76 @@ class Layer:
         if existingId is None:
             childId = self.NewChildId()
             subLayer.SetId(childId)
-        elif existingId not in self.registrations.values():
+        elif self.subLayerIndex.get(existingId, subLayer) is subLayer:
             childId = existingId
 
         return childId
 
     def GetSubLayers(self):
         # All layers are expected to register for notifications.
-        return self.registrations.get(Message.TYPE_NOTIFICATION, [])
+        return self.registrations.get(Message.TYPEID_NOTIFICATION, ())
+
+    def GetSubLayerToward(self, dest):
+        '''
+            Return the sub-layer on the path to the dest id, or None if there isn't one.
+                Ids are compared segment by segment ('0.1' is not on the path to '0.10'),
+                so this costs one dict lookup per id segment below this layer instead of a scan over all sub-layers.
+        '''
+        prefix = f'{self.id}.'
+        if not dest.startswith(prefix):
+            return None
+
+        # Sub-layer ids usually add a single segment, but check each deeper prefix in case they were named explicitly.
+        end = len(prefix)
+        while True:
+            end = dest.find('.', end)
+            subLayer = self.subLayerIndex.get(dest if end < 0 else dest[:end])
+            if subLayer is not None or end < 0:
+                return subLayer
+            end += 1
+
+    def ReplaceSubLayer(self, old, new):
+        '''
+            Put new in old's place among this layer's sub-layers, keeping its registrations (e.g. to swap in a stand-in).
+        '''
+        self.subLayerIndex[old.id] = new
+        for type, layers in self.registrations.items():
+            if old in layers:
+                self.registrations[type] = {(new if layer is old else layer): None for layer in layers}
+        if self.subscriptions is not None:
+            for topicFilter in self.subscriptions.filters.values():
+                topicFilter.Replace(old, new)
+        self.MarkDirty()
+
+    def GetSubtreesAt(self, depth):
+        '''
+            Return the layers depth levels below this one, checking that each heads a self-contained subtree:
+                it has exactly one parent, and nothing below it has a parent outside it. Raise ValueError if not.
+        '''
+        level = [self]
+        for _ in range(depth):
+            seen = set()
+            nextLevel = []
+            for layer in level:
+                for sub in layer.GetSubLayers():
+                    if id(sub) not in seen:
+                        seen.add(id(sub))
+                        nextLevel.append(sub)
+            level = nextLevel
+
+        for subtree in level:
+            if len(subtree.parents) != 1:
+                raise ValueError(f'Subtree root {subtree} must have exactly one parent')
+
+            stack = list(subtree.GetSubLayers())
+            while stack:
+                layer = stack.pop()
+                for parent in layer.parents:
+                    if not Message.IsSubIdOrEqual(parent.id, subtree.id):
+                        raise ValueError(f'{layer} in subtree {subtree} has a parent ({parent}) outside it')
+                stack.extend(layer.GetSubLayers())
+
+        return level
 
     def RegisterSubLayer(self, subLayer):
         '''
@@ -162,86 +786,523 @@ class Layer:
             Log.warning('Failed to register subLayer; ID creation failed')
             return None
 
-        types = self.GetMessageTypes()
-        subTypes = subLayer.GetMessageTypes() 
+        self.PropagateTypes(self.UpdateRegistration(subLayer))
+        subLayer.AddParent(self)
 
-        for type in subTypes:
-            typeRegistrations = self.registrations.setdefault(type, [])
-            if subLayer not in typeRegistrations:
-                typeRegistrations.append(subLayer)
-                Log.debug(f'Layer {self} registered message type {type} to subLayer {subLayer}')    
+        if self.world is not None and subLayer.world is not self.world:
+            self.world.Attach(subLayer)
 
-        newTypes = subTypes - types
+        return id
 
-        if newTypes:
-            # Propagate any new registrations to this layers's parents.
-            for parent in self.parents:
-                parent.RegisterSubLayer(self)
+    def RegisterSubLayers(self, subLayers):
+        '''
+            Register many sub-layers at once (see BuildTree). Return their names, with None for any that failed.
+        '''
+        return self.BuildTree([(subLayer, ()) for subLayer in subLayers])
 
-        subLayer.AddParent(self)
-        return id
+    def BuildTree(self, subtrees):
+        '''
+            Register a whole hierarchy below this layer in one pass, and return the names of its top layers
+                (None for any that failed, as RegisterSubLayer).
+                subtrees is a list of (layer, subtrees) pairs, nested the same way, e.g.
+                    top.BuildTree([(planet, [(city, []), (city2, [])]), (planet2, [])])
+
+            Each layer is named top-down, then registered with its parent bottom-up, once its own types are complete,
+                so every layer's types are collected once and only this layer's new ones are passed further up.
+        '''
+        before = self.GetMessageTypeIds()
+
+        # Name and link every layer top-down, in breadth-first order.
+        links = []
+        ids = []
+        level = [(self, subtree) for subtree in subtrees]
+        while level:
+            nextLevel = []
+            for parent, (subLayer, subSubtrees) in level:
+                id = parent.SetChildId(subLayer)
+                if parent is self:
+                    ids.append(id)
+                if id is None:
+                    Log.warning('Failed to register subLayer; ID creation failed')
+                    continue
+
+                links.append((parent, subLayer))
+                nextLevel.extend((subLayer, subtree) for subtree in subSubtrees)
+            level = nextLevel
+
+        # Register bottom-up, each parent's sub-layers in one batch: a layer's types are complete once everything below it is.
+        groups = {}
+        for parent, subLayer in links:
+            groups.setdefault(parent, []).append(subLayer)
+
+        for parent, subLayers in reversed(groups.items()):
+            parent.UpdateRegistrations(subLayers)
+            for subLayer in subLayers:
+                subLayer.AddParent(parent)
+
+        self.PropagateTypes(self.GetMessageTypeIds() - before)
+
+        if self.world is not None:
+            for parent, subLayer in links:
+                if parent is self and subLayer.world is not self.world:
+                    self.world.Attach(subLayer)
+
+        return ids
+
+    def UpdateRegistration(self, subLayer):
+        '''
+            Record the message types an (already named) sub-layer handles.
+                Return the set of types this layer didn't handle before, which its parents need to hear about.
+        '''
+        return self.UpdateRegistrations([subLayer])
+
+    def UpdateRegistrations(self, subLayers):
+        '''
+            UpdateRegistration for a list of sub-layers at once.
+        '''
+        if self.subLayerIndex is EMPTY_MAP:
+            self.subLayerIndex = {}
+
+        byType = {}
+        for subLayer in subLayers:
+            self.subLayerIndex[subLayer.GetId()] = subLayer
+            subLayer.BuildDispatchTable()
+            for type in subLayer.GetMessageTypeIds():
+                byType.setdefault(type, []).append(subLayer)
+
+        self.MarkDirty()
+        return self.AddRegistrations(byType)
+
+    def AddRegistrations(self, byType):
+        '''
+            Register sub-layers for message types, given a map of type id -> sub-layers.
+                Return the set of types this layer didn't handle before.
+        '''
+        if self.registrations is EMPTY_MAP:
+            self.registrations = {}
+
+        # registrations[type] is an ordered set of sub-layers (a dict with None values), never left empty,
+        # so a type is handled here exactly when it has a handler or an entry.
+        dispatch = self.GetDispatchTable()
+        newTypes = set()
+        for type, subLayers in byType.items():
+            typeRegistrations = self.registrations.get(type)
+            if typeRegistrations is None:
+                typeRegistrations = self.registrations[type] = {}
+                if type not in dispatch:
+                    newTypes.add(type)
+
+            # Sub-layers already registered keep their place.
+            typeRegistrations.update(dict.fromkeys(subLayers))
+            if Log.bDebug:
+                Log.debug('Layer %s registered message type %s to %d subLayer(s)', self, Message.TypeName(type), len(subLayers))
+
+            # Sub-layers that filter the type by topic change what this layer wants; parents that already have it need to know.
+            for subLayer in subLayers:
+                topics = subLayer.GetTopics(type) if subLayer.subscriptions is not None else None
+                if topics is None and self.subscriptions is None:
+                    continue
+                change = self.UpdateSubLayerTopics(subLayer, type, (True, (), ()) if topics is None else (False, topics, ()))
+                if change is not None and type not in newTypes:
+                    self.PropagateTopics(type, change)
+
+        return newTypes
+
+    def PropagateTypes(self, types):
+        '''
+            This layer started handling the type ids in types: register it for them with its parents,
+                and so on up for whichever are new to each of them.
+        '''
+        stack = [(self, types)] if types else []
+        while stack:
+            layer, layerTypes = stack.pop()
+            for parent in reversed(layer.parents):
+                newTypes = parent.AddRegistrations({type: (layer,) for type in layerTypes})
+                parent.MarkDirty()
+                if newTypes:
+                    stack.append((parent, newTypes))
+
+    def UnregisterSubLayer(self, subLayer):
+        '''
+            Remove a sub-layer (and so everything below it) from this layer, undoing RegisterSubLayer.
+                Types no longer handled here are unregistered from the parents as well, and so on up.
+                The notifications it posted here are cancelled; its own queue and id are left as they are,
+                so it can run as a tree of its own, or be registered elsewhere (clear its id first to be renamed).
+                Return True if it was registered here.
+        '''
+        if self not in subLayer.parents:
+            return False
+
+        if self.subLayerIndex.get(subLayer.id) is subLayer:
+            del self.subLayerIndex[subLayer.id]
+        subLayer.parents.remove(self)
+        subLayer.ForgetAncestors()
+
+        for ts, notification in list(subLayer.notifications.items()):
+            if self.scheduler.Cancel(ts, notification) and self.scheduler.Get(ts) is None:
+                self.CancelNotifications(ts)
+            if not subLayer.parents:
+                del subLayer.notifications[ts]
+
+        # Drop subLayer from each of this layer's types, then drop types left with nothing from the parents, and so on up.
+        stack = [(self, subLayer, [type for type, layers in self.registrations.items() if subLayer in layers])]
+        while stack:
+            layer, sub, types = stack.pop()
+            goneTypes = []
+            for type in types:
+                typeRegistrations = layer.registrations.get(type)
+                if typeRegistrations is None or sub not in typeRegistrations:
+                    continue
+
+                del typeRegistrations[sub]
+                change = layer.RemoveSubLayerTopics(sub, type)
+                if not typeRegistrations:
+                    del layer.registrations[type]
+                    if type not in layer.GetDispatchTable():
+                        goneTypes.append(type)
+                        if layer.subscriptions is not None:
+                            layer.subscriptions.filters.pop(type, None)
+                        continue
+
+                if change is not None:
+                    layer.PropagateTopics(type, change)
+            layer.MarkDirty()
+
+            if goneTypes:
+                for parent in layer.parents:
+                    stack.append((parent, layer, goneTypes))
+
+        subLayer.MarkDirty()
+        return True
+
+    def Subscribe(self, type, topics=None, predicate=None):
+        '''
+            Handle messages of a type only if their topic (see Message.GetTopic) is in topics,
+                and predicate(message) returns True; None for either accepts everything.
+                Call again to change the subscription.
+
+            Messages of the type propagating down the tree (PROP_LT, PROP_ALL, ...) are then only copied toward
+                this layer if its topics, or those of a layer below it, include theirs (see Subscriptions).
+                A predicate is only checked here, so to its parents this layer still wants every topic.
+        '''
+        typeId = Message.TypeId(type)
+        if self.subscriptions is None:
+            self.subscriptions = Subscriptions.Subscriptions()
+
+        topicFilter = self.subscriptions.filters.get(typeId)
+        if topicFilter is None:
+            topicFilter = self.AddTopicFilter(typeId)
+        self.subscriptions.own[typeId] = Subscriptions.Subscription(topics, predicate)
+        self.UpdateOwnTopics(typeId, topicFilter)
+
+    def Unsubscribe(self, type):
+        '''
+            Handle every message of a type again, undoing Subscribe.
+        '''
+        typeId = Message.TypeId(type)
+        if self.subscriptions is None or self.subscriptions.own.pop(typeId, None) is None:
+            return
+
+        topicFilter = self.subscriptions.filters.get(typeId)
+        if topicFilter is not None:
+            self.UpdateOwnTopics(typeId, topicFilter)
+
+    def GetTopics(self, type):
+        '''
+            Return the topics of messages of a type id that this layer or any layer below it wants,
+                as a frozenset, or None if every topic is wanted.
+        '''
+        topicFilter = self.subscriptions.filters.get(type) if self.subscriptions is not None else None
+        if topicFilter is None or topicFilter.IsAll():
+            return None
+        return topicFilter.Topics()
+
+    def GetOwnTopics(self, type):
+        '''
+            Return the topics of a type id that this layer's own handler wants: None for all, empty if it has no handler.
+        '''
+        if type not in self.GetDispatchTable():
+            return frozenset()
+        subscription = self.subscriptions.own.get(type) if self.subscriptions is not None else None
+        return None if subscription is None else subscription.topics
+
+    def AddTopicFilter(self, type):
+        if self.subscriptions is None:
+            self.subscriptions = Subscriptions.Subscriptions()
+        topicFilter = self.subscriptions.filters[type] = Subscriptions.TopicFilter(self.GetOwnTopics(type), self.registrations.get(type, ()))
+        return topicFilter
+
+    def UpdateOwnTopics(self, type, topicFilter):
+        change = topicFilter.SetOwn(self.GetOwnTopics(type))
+        if topicFilter.IsRedundant():
+            del self.subscriptions.filters[type]
+        if change is not None:
+            self.PropagateTopics(type, change)
+
+    def UpdateSubLayerTopics(self, subLayer, type, change):
+        '''
+            Record a change in the topics of a type id that subLayer wants (see Subscriptions.TopicFilter.Update).
+                Return the resulting change in what this layer wants, or None.
+        '''
+        topicFilter = self.subscriptions.filters.get(type) if self.subscriptions is not None else None
+        if topicFilter is None:
+            # Without a filter every sub-layer wants every topic.
+            if change[0]:
+                return None
+            topicFilter = self.AddTopicFilter(type)
+
+        layerChange = topicFilter.Update(subLayer, *change)
+        if topicFilter.IsRedundant():
+            del self.subscriptions.filters[type]
+        return layerChange
+
+    def RemoveSubLayerTopics(self, subLayer, type):
+        '''
+            Forget what an unregistered subLayer wanted of a type id. Return the resulting change in what this layer wants, or None.
+        '''
+        topicFilter = self.subscriptions.filters.get(type) if self.subscriptions is not None else None
+        if topicFilter is None:
+            return None
+
+        layerChange = topicFilter.Remove(subLayer)
+        if topicFilter.IsRedundant():
+            del self.subscriptions.filters[type]
+        return layerChange
+
+    def PropagateTopics(self, type, change):
+        '''
+            What this layer wants of a type id changed: pass the change to its parents, and so on up while it changes theirs.
+        '''
+        stack = [(self, change)]
+        while stack:
+            layer, layerChange = stack.pop()
+            for parent in layer.parents:
+                if layer in parent.registrations.get(type, ()):
+                    parentChange = parent.UpdateSubLayerTopics(layer, type, layerChange)
+                    if parentChange is not None:
+                        stack.append((parent, parentChange))
 
     def HandleMessage(self, message):
         '''
             Process the message within this layer if it has a handler.
         '''
-        handler = self.handlers.get(message.GetType())
+        if self.dispatch is None and self.instanceHandlers is None:
+            # Class handlers are plain functions, shared by every instance.
+            handler = self.classDispatch.get(message.GetTypeId())
+            if handler:
+                if Journal.bEnabled:
+                    Journal.Handle(self, message, handler, self)
+                elif Metrics.bEnabled:
+                    Metrics.Handle(self, message, handler, self)
+                else:
+                    handler(self, message)
+            return
+
+        handler = self.GetDispatchTable().get(message.GetTypeId())
         if handler:
-            handler(message)
+            if Journal.bEnabled:
+                Journal.Handle(self, message, handler)
+            elif Metrics.bEnabled:
+                Metrics.Handle(self, message, handler)
+            else:
+                handler(message)
 
-    def NotifyLowerLayers(self, ts, message):
+    def DispatchSteps(self, ts, message):
         '''
-            Process notifications to trigger lower layers if they're viable destinations.
+            Generator that runs a (non-notification) message addressed to this layer:
+                handle it here, then yield a (layer, copy) pair for each sub-layer/parent it propagates to,
+                depending on its prop. The caller must run each copy in its layer before resuming.
         '''
-        layers = self.GetSubLayers()
-        for layer in layers:
-            if message.DestIsSubLayerOrEqualTo(layer):
-                layer.Process(ts)
+        if message.PropTargetsEqual() and (self.subscriptions is None or self.subscriptions.Accepts(message)):
+            self.HandleMessage(message)
+
+        if message.PropTargetsLower():
+            for subLayer in self.GetLowerTargets(message):
+                if Metrics.bEnabled:
+                    Metrics.Copied(self, message)
+                yield subLayer, message.LowerEqCopy(newDest=subLayer.GetId())
+
+        if message.PropTargetsHigher():
+            for parent in self.parents:
+                if Metrics.bEnabled:
+                    Metrics.Copied(self, message)
+                yield parent, message.HigherEqCopy(newDest=parent.GetId())
+
+    def GetLowerTargets(self, message):
+        '''
+            Return the sub-layers a message propagating down from this layer is copied to (see DispatchSteps).
+        '''
+        subLayers = self.registrations.get(message.GetTypeId(), ())
+        if self.subscriptions is not None:
+            # Only the sub-layers wanting the message's topic, if the type is filtered here.
+            topicFilter = self.subscriptions.filters.get(message.GetTypeId())
+            if topicFilter is not None:
+                subLayers = topicFilter.Targets(message.GetTopic())
+        return subLayers
+
+    def DispatchMessage(self, ts, message):
+        '''
+            Run a message addressed to this layer, and its propagated copies, immediately (used by the World).
+        '''
+        stack = [self.DispatchSteps(ts, message)]
+        while stack:
+            step = next(stack[-1], None)
+            if step is None:
+                stack.pop()
+            else:
+                layer, copy = step
+                stack.append(layer.DispatchSteps(ts, copy))
+
+    def GetNotifiedLayer(self, notification):
+        '''
+            Return the sub-layer a notification was posted by, or None.
+        '''
+        # Notifications are addressed to the sub-layer that posted them, which may have been named by another parent.
+        dest = notification.GetDest()
+        return self.subLayerIndex.get(dest) or self.GetSubLayerToward(dest)
 
     def Process(self, ts):
         '''
             Process the message queue.
 
             Either hand it off to the appropriate handler or pass it on to the appropriate upper/lower layer.
+            If this layer is attached to a World, the World processes ts for the whole tree instead.
+
+            Each layer's share of the work is done by its ProcessSteps. By default they're driven from an explicit stack,
+                so arbitrarily deep trees run in constant Python stack space.
+                Set bRecursiveProcessing to nest Process calls instead (the original engine, kept for comparison).
+        '''
+        if self.world is not None:
+            return self.world.Process(ts)
+
+        if Journal.bEnabled and not Journal.depth:
+            return Journal.Process(self, ts)
+
+        if self.bRecursiveProcessing:
+            for layer in self.ProcessSteps(ts):
+                layer.Process(ts)
+            return None
+
+        stack = [self.ProcessSteps(ts)]
+        while stack:
+            layer = next(stack[-1], None)
+            if layer is None:
+                stack.pop()
+            else:
+                stack.append(layer.ProcessSteps(ts))
+
+    def ProcessSteps(self, ts):
+        '''
+            Generator that processes this layer's queue for ts.
+                Whenever a lower/upper layer needs to process ts (it was notified, or a message propagated to it),
+                yield it; the caller must process it fully before resuming this generator.
         '''
         # Grab a reference for the scheduler's queue, but don't pop it until the end.
         # While processing messages, some new messages may be generated and need queueing.
         s = self.scheduler.Peek()
         if not s:
-            Log.debug(f'No queued messages for Layer {self}')
-            return None
+            if Log.bDebug:
+                Log.debug('No queued messages for Layer %s', self)
+            return
 
-        qTs, q = s
+        # Older timestamps must have been missed; deal with them before ts according to the late policy.
+        while s and s[0] < ts:
+            self.ProcessLate(s[0])
+            s = self.scheduler.Peek()
 
-        Log.debug(f'Processing Layer {self}: {len(q)} queued message(s)')
+        if not s or s[0] != ts:
+            return
 
-        if ts != qTs:
-            return None
+        qTs, q = s
+        if not self.bDirty:
+            self.MarkDirty()
+
+        if Log.bDebug:
+            Log.debug('Processing Layer %s: %d queued message(s)', self, len(q))
 
         # While there are messages to handle, run the current layer handling and then pass it down to any lower layers.
+        scheduler = self.scheduler
+        bCollects = self.bCollectsMessages
         while q:
-            m = q.pop()
+            while q:
+                m = q.pop()
+
+                if scheduler.cancelled and scheduler.IsCancelled(ts, m):
+                    continue
 
-            type = m.GetType()
-            if type == Message.TYPE_NOTIFICATION:
-                self.NotifyLowerLayers(ts, m)
+                if m.GetTypeId() == Message.TYPEID_NOTIFICATION:
+                    layer = self.GetNotifiedLayer(m)
+                    if layer is not None:
+                        yield layer
 
-            elif m.dest == self.id:
-                if m.PropTargetsEqual():
-                    self.HandleMessage(m)
+                elif bCollects and self.CollectMessage(ts, m):
+                    pass
 
-                if m.PropTargetsLower():
-                    for subLayer in self.registrations.get(type, []):
-                        subLayer.AddMessage(ts, m.LowerEqCopy(newDest=subLayer.GetId()))
-                        subLayer.Process(ts)
+                elif m.dest == self.id:
+                    for layer, copy in self.DispatchSteps(ts, m):
+                        layer.AddMessage(ts, copy)
+                        yield layer
 
-                if m.PropTargetsHigher():
-                    for parent in self.parents:
-                        parent.AddMessage(ts, m.HigherEqCopy(newDest=parent.GetId()))
-                        parent.Process(ts)
+            # Whatever this queues for ts goes round again.
+            if bCollects:
+                self.RunCollected(ts)
 
-        # The queue for this ts is now empty. Pop it to remove it from the scheduler.
-        self.scheduler.Pop()
+        # The queue for this ts is now empty. Pop it to remove it from the scheduler,
+        # unless a re-entrant Process call (e.g. a message propagating back up to this layer) already did.
+        s = scheduler.Peek()
+        if s and s[1] is q:
+            scheduler.Pop()
+            self.notifications.pop(ts, None)
+
+    def CollectMessage(self, ts, message):
+        '''
+            For layers with bCollectsMessages: called by ProcessSteps with each message (other than notifications)
+                it takes from the queue for ts. Return True to take the message over, or False to dispatch it as usual.
+        '''
+        return False
+
+    def RunCollected(self, ts):
+        '''
+            For layers with bCollectsMessages: called by ProcessSteps whenever the queue for ts is drained,
+                to handle the messages CollectMessage took.
+        '''
+        pass
+
+    def Discard(self, ts):
+        '''
+            Drop the messages queued at ts in this layer without handling them,
+                along with the ones queued in the lower layers it was notified about.
+        '''
+        if self.world is not None:
+            return self.world.Discard(ts)
+
+        if Journal.bEnabled and not Journal.depth:
+            return Journal.Discard(self, ts)
+
+        stack = [self]
+        while stack:
+            layer = stack.pop()
+
+            s = layer.scheduler.Peek()
+            if not s or s[0] != ts:
+                continue
+
+            _ts, q = layer.scheduler.Pop()
+            layer.notifications.pop(ts, None)
+            layer.MarkDirty()
+
+            if Log.bDebug:
+                Log.debug('Layer %s dropping %d message(s) at %s', layer, len(q), ts)
+
+            while q:
+                m = q.pop()
+                if m.GetTypeId() == Message.TYPEID_NOTIFICATION:
+                    notified = layer.GetNotifiedLayer(m)
+                    if notified is not None:
+                        stack.append(notified)
 
     def __str__(self):
         return f'{self.id}'
+
+Layer.BuildClassDispatchTable()
+Layer.BuildClassCoalescingTable()
@@ -1,29 +1,114 @@
+'''
+    Logging for the engine, through a named 'LayersOfSpace' logger.
+
+    Importing this module doesn't configure anything: the root logger is left alone, and until Log.Configure(...)
+        is called only warnings and errors reach the console (via the logging module's last-resort handler).
+
+    The dispatch path logs a lot at debug level, so it must cost nothing when debug is off:
+        1. Hot paths guard their calls with "if Log.bDebug:", a cached flag, so disabled calls are one attribute check.
+        2. Messages take %-style arguments, e.g. Log.debug('Layer %s added %s', layer, message),
+            so str() is only called on the arguments if a handler actually emits the record.
+
+    Log.bDebug is refreshed by Configure/Reset. If the logger's level is changed some other way, call Log.Refresh().
+
+    Sinks:
+        SINK_STREAM: Write each record to the stream as it's logged.
+        SINK_BUFFERED: Hold up to capacity records in memory and write them out in batches (or on an error/Flush()).
+        SINK_ASYNC: Hand records to a queue; a background thread formats and writes them.
+'''
+
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 
+SINK_STREAM     = 'stream'
+SINK_BUFFERED   = 'buffered'
+SINK_ASYNC      = 'async'
+
 class _Log:
-    instance = None
+    def __init__(self, name='LayersOfSpace'):
+        self.logger = logging.getLogger(name)
+
+        # Handler installed by Configure, and the background listener for the async sink.
+        self.handler = None
+        self.listener = None
+
+        self.bDebug = False
+        self.Refresh()
+
+        atexit.register(self.Reset)
+
+    def Configure(self, level=logging.DEBUG, stream=None, sink=SINK_STREAM, capacity=1024, fmt=None):
+        '''
+            Send records at or above level to stream (stdout by default) through the chosen sink.
+                Replaces any previous Configure call.
+        '''
+        self.Reset()
+
+        target = logging.StreamHandler(stream or sys.stdout)
+        if fmt:
+            target.setFormatter(logging.Formatter(fmt))
+
+        if sink == SINK_BUFFERED:
+            handler = logging.handlers.MemoryHandler(capacity, flushLevel=logging.ERROR, target=target)
+        elif sink == SINK_ASYNC:
+            q = queue.SimpleQueue()
+            handler = logging.handlers.QueueHandler(q)
+            self.listener = logging.handlers.QueueListener(q, target)
+            self.listener.start()
+        else:
+            handler = target
+
+        self.handler = handler
+        self.logger.addHandler(handler)
+        self.logger.setLevel(level)
+
+        # The engine's records are handled here; don't also pass them to whatever the application put on the root.
+        self.logger.propagate = False
+
+        self.Refresh()
+
+    def Reset(self):
+        '''
+            Flush and remove whatever Configure installed, returning to the unconfigured state.
+        '''
+        if self.handler is not None:
+            self.Flush()
+            self.logger.removeHandler(self.handler)
+            self.handler.close()
+            self.handler = None
+
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
 
-    @staticmethod
-    def getInstance():
-        return _Log.instance if _Log.instance else _Log()
+        self.logger.setLevel(logging.NOTSET)
+        self.logger.propagate = True
+        self.Refresh()
 
-    def __init__(self):
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.DEBUG)
-        self.handler = logging.StreamHandler(sys.stdout)
-        self.handler.setLevel(logging.DEBUG)
-        self.logger.addHandler(self.handler)
+    def Flush(self):
+        '''
+            Write out any records held by a buffered or async sink.
+        '''
+        if self.listener is not None:
+            # Stopping the listener processes everything already queued.
+            self.listener.stop()
+            self.listener.start()
+        elif self.handler is not None:
+            self.handler.flush()
 
-        self.debug('Initialized logger')
+    def Refresh(self):
+        self.bDebug = self.logger.isEnabledFor(logging.DEBUG)
 
-    def debug(self, s):
-        self.logger.debug(s)
+    def debug(self, s, *args):
+        self.logger.debug(s, *args)
 
-    def info(self, s):
-        return self.logger.info(s)
+    def info(self, s, *args):
+        return self.logger.info(s, *args)
 
-    def warning(self, s):
-        return self.logger.warning(s)
+    def warning(self, s, *args):
+        return self.logger.warning(s, *args)
 
 Log = _Log()
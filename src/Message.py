@@ -3,34 +3,117 @@
 
     They contain:
         1. Type (str): Identifier for what kind of message this is.
+            Internally types are interned to small ints (see TypeId); GetType() still returns the name.
         2. Dest (str): Id of the destination Item.
-        3. Prop (str): Method of propagating to other layers starting from Dest.
-            See the PROP_* types defined in this file.
+        3. Prop (int): Method of propagating to other layers starting from Dest.
+            See the PROP_* types defined in this file. The older one-character codes ('=', '*', ...) are also accepted.
         4. Src (str): Id of the originating Item.
         5. Data (no fixed type): Contents of the message.
 
     In many cases, the data field will just be a dictionary.
-'''
+    A message's topic (see GetTopic and Layer.Subscribe) is found from its data, by a key set per type with SetTopicKey.
 
-TYPE_NOTIFICATION = '!'
+    Copies made while propagating a message to other layers are MessageHops,
+        which share the original's type/src/data and only store their own dest and prop.
+'''
 
-PROP_EXACT  = '='   # Exact match, don't propagate to other layers.
-PROP_LT     = '<'   # Propagate to lower values, skip the actual destination layer.
-PROP_LTE    = '['   # Propagate to lower values, include the current layer.
-PROP_GT     = '>'   # Greater than version of PROP_LT.
-PROP_GTE    = ']'   # Greater than version of PROP_LTE.
-PROP_BI     = 'B'   # Bidirectional propagation, skip the destination.
-PROP_ALL    = '*'   # Propagate in both directions and include the destination.
+# Interned message types: name -> id, and id -> name.
+_typeIds = {}
+_typeNames = []
+
+def TypeId(type):
+    '''
+        Return the int id for a message type name, registering the name if it's new.
+            Ids are passed through unchanged.
+    '''
+    typeId = _typeIds.get(type)
+    if typeId is None:
+        if isinstance(type, int):
+            return type
+
+        typeId = len(_typeNames)
+        _typeIds[type] = typeId
+        _typeNames.append(type)
+
+    return typeId
+
+def TypeName(typeId):
+    '''
+        Return the name a message type id was registered with.
+    '''
+    return _typeNames[typeId]
+
+def ByTypeName(table):
+    '''
+        Return a copy of a map keyed by type id, keyed by type name instead.
+            Type ids are only valid in the process that interned them, so maps keyed by them are pickled this way.
+    '''
+    return {_typeNames[typeId]: value for typeId, value in table.items()}
+
+def ByTypeId(table):
+    '''
+        Undo ByTypeName, interning the names in this process.
+    '''
+    return {TypeId(type): value for type, value in table.items()}
+
+# Map message type id -> function returning the topic of a message of that type from its data.
+# Types without one use the data itself.
+_topicKeys = {}
+
+def SetTopicKey(type, key):
+    '''
+        Set how the topic of messages of a type is found: key(data) returns it, e.g. lambda data: data['region'].
+            Pass None to go back to using the data itself.
+    '''
+    if key is None:
+        _topicKeys.pop(TypeId(type), None)
+    else:
+        _topicKeys[TypeId(type)] = key
 
-class Message:
-    def __init__(self, type, dest, src=None, data=None, prop=PROP_EXACT):
-        self.type = type
-        self.dest = dest
-        self.prop = prop
-        self.src = src
-        self.data = data
+TYPE_NOTIFICATION = '!'
+TYPEID_NOTIFICATION = TypeId(TYPE_NOTIFICATION)
+
+# Propagation targets, combined into the PROP_* bitmasks below.
+PROP_TARGET_EQUAL   = 1
+PROP_TARGET_LOWER   = 2
+PROP_TARGET_HIGHER  = 4
+
+PROP_EXACT  = PROP_TARGET_EQUAL                         # Exact match, don't propagate to other layers.
+PROP_LT     = PROP_TARGET_LOWER                         # Propagate to lower values, skip the actual destination layer.
+PROP_LTE    = PROP_TARGET_LOWER | PROP_TARGET_EQUAL     # Propagate to lower values, include the current layer.
+PROP_GT     = PROP_TARGET_HIGHER                        # Greater than version of PROP_LT.
+PROP_GTE    = PROP_TARGET_HIGHER | PROP_TARGET_EQUAL    # Greater than version of PROP_LTE.
+PROP_BI     = PROP_TARGET_LOWER | PROP_TARGET_HIGHER    # Bidirectional propagation, skip the destination.
+PROP_ALL    = PROP_BI | PROP_TARGET_EQUAL               # Propagate in both directions and include the destination.
+
+# One-character codes that were used for the PROP_* values before they were bitmasks.
+PROP_CODES = {
+    '=': PROP_EXACT,
+    '<': PROP_LT,
+    '[': PROP_LTE,
+    '>': PROP_GT,
+    ']': PROP_GTE,
+    'B': PROP_BI,
+    '*': PROP_ALL,
+}
+
+def IsSubIdOrEqual(id, refId):
+    '''
+        True if id names the refId layer or one of its (transitive) sub-layers.
+            Ids are compared by '.'-separated segment, so '0.10' is not under '0.1'.
+    '''
+    return id == refId or (id.startswith(refId) and id[len(refId)] == '.')
+
+class _MessageBase:
+    '''
+        Behaviour shared by Message and MessageHop. Subclasses provide type, dest, prop, src and data.
+    '''
+    __slots__ = ()
 
     def GetType(self):
+        return _typeNames[self.type]
+
+    def GetTypeId(self):
         return self.type
 
     def GetDest(self):
@@ -48,38 +131,110 @@ class Message:
     def SetData(self, data):
         self.data = data
 
+    def GetTopic(self):
+        key = _topicKeys.get(self.GetTypeId())
+        return self.GetData() if key is None else key(self.GetData())
+
     def DestIsSubLayerOrEqualTo(self, ref):
-        return self.dest.startswith(ref.GetId())
+        return IsSubIdOrEqual(self.dest, ref.GetId())
 
     def PropTargetsLower(self):
-        return self.prop in [PROP_ALL, PROP_BI, PROP_LT, PROP_LTE]
+        return self.prop & PROP_TARGET_LOWER != 0
 
     def PropTargetsHigher(self):
-        return self.prop in [PROP_ALL, PROP_BI, PROP_GT, PROP_GTE]
+        return self.prop & PROP_TARGET_HIGHER != 0
 
     def PropTargetsEqual(self):
-        return self.prop in [PROP_EXACT, PROP_ALL, PROP_LTE, PROP_GTE]
+        return self.prop & PROP_TARGET_EQUAL != 0
+
+    def GetPayload(self):
+        '''
+            Return the Message holding this message's type, src and data.
+        '''
+        return self
 
     def LowerEqCopy(self, newDest=None):
-        return Message(
-            self.type,
-            newDest or self.dest,
-            src=self.src,
-            data=self.data,
-            prop=PROP_LTE,
-        )
+        return MessageHop(self.GetPayload(), newDest or self.dest, PROP_LTE)
 
     def HigherEqCopy(self, newDest=None):
-        return Message(
-            self.type,
-            newDest or self.dest,
-            src=self.src,
-            data=self.data,
-            prop=PROP_GTE,
-        )
+        return MessageHop(self.GetPayload(), newDest or self.dest, PROP_GTE)
 
     def __str__(self):
-        return f'<{self.type}: d: {self.dest}, s: {self.src}: {self.data}>'
+        return f'<{self.GetType()}: d: {self.dest}, s: {self.src}: {self.data}>'
+
+class Message(_MessageBase):
+    __slots__ = ('type', 'dest', 'prop', 'src', 'data')
+
+    def __init__(self, type, dest, src=None, data=None, prop=PROP_EXACT):
+        self.type = TypeId(type)
+        self.dest = dest
+        self.prop = PROP_CODES.get(prop, prop)
+        self.src = src
+        self.data = data
+
+    def __reduce__(self):
+        # Pickled by type name, which is interned again on load (see ByTypeName).
+        return (Message, (_typeNames[self.type], self.dest, self.src, self.data, self.prop))
+
+class MessageHop(_MessageBase):
+    '''
+        A propagated copy of a message: its own dest and prop, over the original message's type, src and data.
+            Fan-out creates one of these per layer instead of a full Message, and every hop shares the same payload.
+            The payload is copied on write, so SetSrc/SetData on a hop never changes what other layers see.
+    '''
+    __slots__ = ('payload', 'dest', 'prop')
+
+    def __init__(self, payload, dest, prop):
+        self.payload = payload
+        self.dest = dest
+        self.prop = prop
+
+    @property
+    def type(self):
+        return self.payload.type
+
+    @property
+    def src(self):
+        return self.payload.src
+
+    @src.setter
+    def src(self, src):
+        self.Detach()
+        self.payload.src = src
+
+    @property
+    def data(self):
+        return self.payload.data
+
+    @data.setter
+    def data(self, data):
+        self.Detach()
+        self.payload.data = data
+
+    def GetType(self):
+        return _typeNames[self.payload.type]
+
+    def GetTypeId(self):
+        return self.payload.type
+
+    def GetSrc(self):
+        return self.payload.src
+
+    def GetData(self):
+        return self.payload.data
+
+    def GetPayload(self):
+        return self.payload
+
+    def __reduce__(self):
+        return (MessageHop, (self.payload, self.dest, self.prop))
+
+    def Detach(self):
+        '''
+            Give this hop a private copy of the payload.
+        '''
+        p = self.payload
+        self.payload = Message(p.type, p.dest, src=p.src, data=p.data, prop=p.prop)
 
 def Notification(tgtId):
     return Message(
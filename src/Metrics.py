@@ -0,0 +1,306 @@
+'''
+    Opt-in instrumentation for the dispatch engine: where messages go, and where tick time is spent.
+
+    Nothing is recorded until Metrics.Configure(...) is called. Like Log.bDebug, the engine guards every
+        recording call with "if Metrics.bEnabled:", so disabled metrics cost one attribute check per site.
+
+    Counters, each kept per (layer id, message type):
+        COUNTER_HOPS: Layers a message visits while ScheduleMessage routes it to its destination.
+        COUNTER_NOTIFICATIONS: Notifications posted to parents.
+        COUNTER_COPIES: Copies made when a message propagates to sub-layers/parents (see Message prop).
+        COUNTER_HANDLED: Messages run through one of the layer's handlers.
+    Handler times, per message type: calls, total seconds and the slowest call.
+        Only measured with bTimeHandlers, as reading the clock around every handler isn't free;
+        wrap individual handlers with Timed(...) to time just those, under their own names.
+    Queue depths, per layer: live events pending in each scheduler, sampled by SampleQueues(root).
+
+    Read them in-process with Counts/ByLayer/ByType/Hottest/HandlerTimes, or write them out with Dump,
+        as JSON or Prometheus text. Given a path, Configure also dumps every interval seconds of wall-clock time,
+        checked as the clock steps (see Clock.Step), so dumps never interrupt a tick.
+    Metrics are per process: sharded workers (see Shards) keep their own.
+'''
+
+from collections import defaultdict
+import functools
+import json
+import os
+import time
+
+from . import Message
+
+COUNTER_HOPS            = 'hops'
+COUNTER_NOTIFICATIONS   = 'notifications'
+COUNTER_COPIES          = 'copies'
+COUNTER_HANDLED         = 'handled'
+
+FORMAT_JSON         = 'json'
+FORMAT_PROMETHEUS   = 'prometheus'
+
+PROMETHEUS_PREFIX = 'layersofspace'
+
+class _Metrics:
+    def __init__(self):
+        self.bEnabled = False
+        self.bTimeHandlers = False
+
+        # Periodic dumps: where, how often (wall-clock seconds), in which format, and the tree to sample queues from.
+        self.path = None
+        self.interval = 10.0
+        self.format = FORMAT_JSON
+        self.root = None
+        self.lastDump = 0.0
+
+        self.Clear()
+
+    def Configure(self, bTimeHandlers=False, path=None, interval=10.0, format=FORMAT_JSON, root=None):
+        '''
+            Start recording. With a path, dump to it every interval seconds; queue depths are sampled from root if given.
+                Replaces any previous Configure call, keeping what's been recorded so far.
+        '''
+        self.bTimeHandlers = bTimeHandlers
+        self.path = path
+        self.interval = interval
+        self.format = format
+        self.root = root
+        self.lastDump = time.monotonic()
+        self.bEnabled = True
+
+    def Reset(self):
+        '''
+            Stop recording and forget everything recorded.
+        '''
+        self.bEnabled = False
+        self.bTimeHandlers = False
+        self.path = None
+        self.root = None
+        self.Clear()
+
+    def Clear(self):
+        # Map (counter, layer id, message type id) -> count.
+        self.counts = defaultdict(int)
+
+        # Map handler name -> [calls, total seconds, slowest call in seconds].
+        self.handlerTimes = {}
+
+        # Map layer id -> live events in its scheduler, as of the last SampleQueues.
+        self.queueDepths = {}
+
+    # The engine's recording sites. They write to counts directly, as they run on every hop, copy and handler call.
+
+    def Hop(self, layer, message):
+        self.counts[(COUNTER_HOPS, layer.id, message.GetTypeId())] += 1
+
+    def Notified(self, layer, n=1):
+        self.counts[(COUNTER_NOTIFICATIONS, layer.id, Message.TYPEID_NOTIFICATION)] += n
+
+    def Copied(self, layer, message):
+        self.counts[(COUNTER_COPIES, layer.id, message.GetTypeId())] += 1
+
+    def Handle(self, layer, message, handler, *args):
+        '''
+            Run handler(*args, message) on behalf of layer, counting it and timing it if bTimeHandlers is set.
+        '''
+        typeId = message.GetTypeId()
+        self.counts[(COUNTER_HANDLED, layer.id, typeId)] += 1
+
+        if not self.bTimeHandlers:
+            handler(*args, message)
+            return
+
+        start = time.perf_counter()
+        try:
+            handler(*args, message)
+        finally:
+            self.AddHandlerTime(Message.TypeName(typeId), time.perf_counter() - start)
+
+    def HandleBatch(self, layer, typeId, count, handler, *args):
+        '''
+            Run handler(*args) on behalf of layer, for count messages of a type at once (see Entities.EntityLayer).
+                Each message counts as handled; the call is timed as one.
+        '''
+        self.counts[(COUNTER_HANDLED, layer.id, typeId)] += count
+
+        if not self.bTimeHandlers:
+            handler(*args)
+            return
+
+        start = time.perf_counter()
+        try:
+            handler(*args)
+        finally:
+            self.AddHandlerTime(Message.TypeName(typeId), time.perf_counter() - start)
+
+    def AddHandlerTime(self, name, seconds):
+        t = self.handlerTimes.get(name)
+        if t is None:
+            self.handlerTimes[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+
+    def Timed(self, handler, name=None):
+        '''
+            Wrap handler so its calls are timed under name (its qualified name by default) while metrics are enabled.
+                Works on handler functions in messageHandlers tables (as a decorator) and on bound methods alike.
+        '''
+        name = name or getattr(handler, '__qualname__', repr(handler))
+
+        @functools.wraps(handler)
+        def TimedHandler(*args):
+            if not self.bEnabled:
+                return handler(*args)
+
+            start = time.perf_counter()
+            try:
+                return handler(*args)
+            finally:
+                self.AddHandlerTime(name, time.perf_counter() - start)
+
+        return TimedHandler
+
+    def SampleQueues(self, root):
+        '''
+            Record the queue depth of every layer in the tree under root that has anything queued.
+        '''
+        self.queueDepths = {}
+        seen = set()
+        stack = [root]
+        while stack:
+            layer = stack.pop()
+            if id(layer) in seen:
+                continue
+            seen.add(id(layer))
+
+            depth = layer.scheduler.Depth()
+            if depth:
+                self.queueDepths[layer.id] = depth
+            stack.extend(layer.GetSubLayers())
+
+    def Counts(self, counter):
+        '''
+            Return {(layer id, message type): count} for counter.
+        '''
+        return {(layerId, Message.TypeName(typeId)): n
+            for (name, layerId, typeId), n in list(self.counts.items()) if name == counter}
+
+    def ByLayer(self, counter):
+        '''
+            Return {layer id: count} for counter, over all message types.
+        '''
+        totals = defaultdict(int)
+        for (layerId, _type), n in self.Counts(counter).items():
+            totals[layerId] += n
+        return dict(totals)
+
+    def ByType(self, counter):
+        '''
+            Return {message type: count} for counter, over all layers.
+        '''
+        totals = defaultdict(int)
+        for (_layerId, type), n in self.Counts(counter).items():
+            totals[type] += n
+        return dict(totals)
+
+    def Hottest(self, counter, n=10):
+        '''
+            Return the n layers with the highest counts for counter, as (layer id, count) pairs, highest first.
+        '''
+        return sorted(self.ByLayer(counter).items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def HandlerTimes(self):
+        '''
+            Return {handler name: (calls, total seconds, slowest call in seconds)}.
+        '''
+        return {name: tuple(t) for name, t in self.handlerTimes.items()}
+
+    def ToDict(self):
+        counters = {}
+        for counter in [COUNTER_HOPS, COUNTER_NOTIFICATIONS, COUNTER_COPIES, COUNTER_HANDLED]:
+            counts = self.Counts(counter)
+            byLayer = defaultdict(dict)
+            for (layerId, type), n in counts.items():
+                byLayer[layerId][type] = n
+            counters[counter] = byLayer
+
+        return {
+            'time': time.time(),
+            'counters': counters,
+            'handlers': {name: {'calls': calls, 'seconds': seconds, 'maxSeconds': maxSeconds}
+                for name, (calls, seconds, maxSeconds) in self.HandlerTimes().items()},
+            'queueDepths': dict(self.queueDepths),
+        }
+
+    def ToJson(self):
+        return json.dumps(self.ToDict(), sort_keys=True)
+
+    def ToPrometheus(self):
+        '''
+            Return the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+
+        def Metric(name, kind, help, samples):
+            lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {help}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} {kind}')
+            for labels, value in samples:
+                labelText = ','.join(f'{key}="{_EscapeLabel(str(label))}"' for key, label in labels)
+                lines.append(f'{PROMETHEUS_PREFIX}_{name}{{{labelText}}} {value}')
+
+        helps = {
+            COUNTER_HOPS: 'Layers visited while routing messages.',
+            COUNTER_NOTIFICATIONS: 'Notifications posted to parent layers.',
+            COUNTER_COPIES: 'Message copies made by propagation.',
+            COUNTER_HANDLED: 'Messages run through a handler.',
+        }
+        for counter, help in helps.items():
+            samples = [((('layer', layerId), ('type', type)), n) for (layerId, type), n in sorted(self.Counts(counter).items())]
+            Metric(f'{counter}_total', 'counter', help, samples)
+
+        times = sorted(self.HandlerTimes().items())
+        Metric('handler_calls_total', 'counter', 'Timed handler calls.',
+            [((('handler', name),), calls) for name, (calls, _seconds, _maxSeconds) in times])
+        Metric('handler_seconds_total', 'counter', 'Time spent in timed handlers.',
+            [((('handler', name),), seconds) for name, (_calls, seconds, _maxSeconds) in times])
+        Metric('handler_max_seconds', 'gauge', 'Slowest timed handler call.',
+            [((('handler', name),), maxSeconds) for name, (_calls, _seconds, maxSeconds) in times])
+
+        Metric('queue_depth', 'gauge', 'Live events queued in a layer, as of the last sample.',
+            [((('layer', layerId),), depth) for layerId, depth in sorted(self.queueDepths.items())])
+
+        return '\n'.join(lines) + '\n'
+
+    def Dump(self, path=None, format=None):
+        '''
+            Write the metrics to path (the configured one by default) in format, replacing the file atomically.
+                Queue depths are sampled first if Configure was given a root.
+        '''
+        path = path or self.path
+        format = format or self.format
+
+        if self.root is not None:
+            self.SampleQueues(self.root)
+
+        text = self.ToPrometheus() if format == FORMAT_PROMETHEUS else self.ToJson()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def Tick(self):
+        '''
+            Dump if a path is configured and interval seconds have passed since the last dump. Called by Clock.Step.
+        '''
+        if self.path is None:
+            return
+
+        now = time.monotonic()
+        if now - self.lastDump >= self.interval:
+            self.lastDump = now
+            self.Dump()
+
+def _EscapeLabel(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+Metrics = _Metrics()
@@ -0,0 +1,285 @@
+'''
+    Paging of dormant subtrees: keep only a budget of layers resident, with the rest stored in compact form.
+
+    The tree is divided into pages at a configurable depth below the root, like Shards: each layer at that depth
+        heads a page made of itself and everything below it. The layers above (the trunk) always stay resident.
+    Paging out saves a page with Snapshot (zlib-compressed) into a store, and puts a PagedStub in its place.
+        The stub keeps the page's notifications in its parent's queue, so pending timestamps still come due.
+    A stub pages back in as soon as anything reaches it:
+        a message routed to it by ScheduleMessage/ScheduleMessageFor, a notification coming due in its parent,
+        a propagated copy, or a new sub-layer registration.
+
+    Pager is the Clock for its tree (as a World is): each Step processes the root as usual, then evicts
+        least recently used pages until the resident layers fit in maxLayers. Pages without pending events go first.
+        Eviction only happens between steps, never while a page is being processed.
+        The resident pages are counted again before evicting, so layers registered since (in a page, or as new pages
+        at the paging depth) count too, at the cost of a walk over the resident layers per step.
+    A page is used whenever its parent finds it in its sub-layer index: routing a message into it, or processing it
+        when its notification comes due. The pages' parents get an index that tells the Pager (see _TouchingIndex),
+        so recency costs nothing per step, and nothing at all in layers outside the pages' parents.
+
+    Store: any dict-like object (a plain dict keeps pages in memory), or a DirectoryStore to keep them on disk.
+    Handles to messages inside a page stop working once it's paged out (Cancel returns False).
+    Page everything in (PageInAll) before saving a Snapshot of the whole tree.
+'''
+
+from collections import OrderedDict
+import io
+import os
+import zlib
+
+from . import Clock, Layer, Scheduler, Snapshot
+from .Log import Log
+
+class DirectoryStore:
+    '''
+        Dict-like page store keeping one file per page in a directory.
+    '''
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def File(self, key):
+        return os.path.join(self.path, f'{key}.page')
+
+    def __setitem__(self, key, data):
+        with open(self.File(key), 'wb') as f:
+            f.write(data)
+
+    def __getitem__(self, key):
+        try:
+            with open(self.File(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def pop(self, key):
+        data = self[key]
+        os.remove(self.File(key))
+        return data
+
+    def __contains__(self, key):
+        return os.path.exists(self.File(key))
+
+class _TouchingIndex(dict):
+    '''
+        Sub-layer index of a page's parent: finding a page in it marks the page as recently used.
+    '''
+    __slots__ = ('pager',)
+
+    def __init__(self, pager, index):
+        super().__init__(index)
+        self.pager = pager
+
+    def get(self, key, default=None):
+        resident = self.pager.resident
+        if key in resident:
+            resident.move_to_end(key)
+        return dict.get(self, key, default)
+
+    def __reduce__(self):
+        # A plain index anywhere else.
+        return (dict, (dict(self),))
+
+class PagedStub(Layer.Layer):
+    '''
+        Stands in for a paged-out subtree under its parent, and pages it back in when it's needed.
+    '''
+    bProxy = True
+
+    def __init__(self, pager=None, id=None, typeIds=(), layerCount=0):
+        super().__init__()
+        self.pager = pager
+        self.id = id
+        self.layerCount = layerCount
+
+        # The resident page root, once paged back in.
+        self.layer = None
+
+        # Whether the page had changes not yet in an incremental snapshot when it was paged out.
+        self.bPageDirty = False
+
+        # Look like the page root to its parent.
+        self.dispatch = {}
+        self.registrations = {type: {} for type in typeIds}
+
+    def PageIn(self):
+        '''
+            Return the resident page root, paging it in if needed.
+        '''
+        if self.layer is None:
+            self.pager.PageIn(self)
+        return self.layer
+
+    def QueueMessage(self, ts, message):
+        return self.PageIn().ScheduleMessage(ts, message)
+
+    def AddMessage(self, ts, message):
+        self.PageIn().AddMessage(ts, message)
+
+    def ProcessSteps(self, ts):
+        yield from self.PageIn().ProcessSteps(ts)
+
+    def DispatchSteps(self, ts, message):
+        return self.PageIn().DispatchSteps(ts, message)
+
+    def RegisterSubLayer(self, subLayer):
+        return self.PageIn().RegisterSubLayer(subLayer)
+
+    def GetSubLayers(self):
+        return []
+
+class Pager(Clock.Clock):
+    def __init__(self, root, depth=1, maxLayers=100000, store=None):
+        '''
+            Page the subtrees depth levels below root in and out, keeping at most maxLayers of their layers resident
+                (measured between steps). Pages are kept in store, a dict by default.
+        '''
+        if root.world is not None:
+            raise ValueError(f'{root} is attached to a World, which can\'t be paged')
+
+        self.root = root
+        self.now = root.now
+        self.depth = depth
+        self.maxLayers = maxLayers
+        self.store = store if store is not None else {}
+
+        # Resident page root id -> (page root, layer count), least recently used first.
+        self.resident = OrderedDict()
+        self.residentLayers = 0
+
+        # Paged-out page root id -> stub.
+        self.stubs = {}
+
+        self.pageIns = 0
+        self.pageOuts = 0
+
+        self.Collect()
+
+    def Recount(self):
+        '''
+            Count the layers of the resident pages again, taking on pages registered at depth since the last count
+                (as the most recently used) and dropping those no longer in the tree.
+        '''
+        pages = {page.id: page for page in self.root.GetSubtreesAt(self.depth) if not isinstance(page, PagedStub)}
+
+        for pageId, (page, _count) in list(self.resident.items()):
+            if pages.get(pageId) is not page:
+                del self.resident[pageId]
+
+        self.residentLayers = 0
+        for pageId, page in pages.items():
+            if pageId not in self.resident:
+                parent = page.parents[0]
+                if not isinstance(parent.subLayerIndex, _TouchingIndex):
+                    parent.subLayerIndex = _TouchingIndex(self, parent.subLayerIndex)
+
+            # Reassigning an existing key keeps its place in the recency order.
+            count = self.CountLayers(page)
+            self.resident[pageId] = (page, count)
+            self.residentLayers += count
+
+    @staticmethod
+    def CountLayers(page):
+        seen = set()
+        stack = [page]
+        while stack:
+            layer = stack.pop()
+            if id(layer) not in seen:
+                seen.add(id(layer))
+                stack.extend(layer.GetSubLayers())
+        return len(seen)
+
+    def PageOut(self, pageId):
+        '''
+            Save the resident page pageId to the store and put a stub in its place.
+        '''
+        page, count = self.resident.pop(pageId)
+        self.residentLayers -= count
+        parent = page.parents[0]
+
+        stub = PagedStub(self, pageId, page.GetMessageTypeIds(), count)
+        stub.parents = [parent]
+        stub.bPageDirty = page.bDirty or page.bDirtyBelow
+
+        f = io.BytesIO()
+        Snapshot.Save(page, f)
+        self.store[pageId] = zlib.compress(f.getvalue(), 1)
+
+        # The notifications stay in the parent's queue; the stub holds them until the page comes back.
+        stub.notifications = page.notifications
+        parent.ReplaceSubLayer(page, stub)
+        self.stubs[pageId] = stub
+
+        # Leave the old layers empty, so stale handles into them can't cancel anything.
+        stack = [page]
+        while stack:
+            layer = stack.pop()
+            layer.scheduler = Scheduler.EMPTY
+            stack.extend(layer.GetSubLayers())
+
+        self.pageOuts += 1
+        if Log.bDebug:
+            Log.debug('Pager paged out %s (%d layer(s))', pageId, count)
+
+    def PageIn(self, stub):
+        '''
+            Load stub's page from the store and put it back in the tree.
+        '''
+        pageId = stub.id
+        parent = stub.parents[0]
+
+        data = zlib.decompress(self.store.pop(pageId))
+        page = Snapshot.Load(io.BytesIO(data), external={parent.id: parent})
+
+        parent.ReplaceSubLayer(stub, page)
+        stub.layer = page
+        del self.stubs[pageId]
+
+        self.resident[pageId] = (page, stub.layerCount)
+        self.residentLayers += stub.layerCount
+
+        # Changes made before paging out still need to reach the next incremental snapshot.
+        if stub.bPageDirty:
+            stack = [page]
+            while stack:
+                layer = stack.pop()
+                layer.MarkDirty()
+                stack.extend(layer.GetSubLayers())
+
+        self.pageIns += 1
+        if Log.bDebug:
+            Log.debug('Pager paged in %s (%d layer(s))', pageId, stub.layerCount)
+        return page
+
+    def PageInAll(self):
+        for stub in list(self.stubs.values()):
+            stub.PageIn()
+
+    def Collect(self):
+        '''
+            Page out least recently used pages, dormant ones (nothing scheduled) first, until within maxLayers.
+        '''
+        self.Recount()
+        if self.residentLayers <= self.maxLayers:
+            return
+
+        for bDormantOnly in [True, False]:
+            for pageId, (page, _count) in list(self.resident.items()):
+                if self.residentLayers <= self.maxLayers:
+                    return
+                if not bDormantOnly or page.scheduler.Peek() is None:
+                    self.PageOut(pageId)
+
+    def NextTs(self):
+        return self.root.NextTs()
+
+    def Process(self, ts):
+        if self.root.now is None or self.root.now < ts:
+            self.root.now = ts
+
+        self.root.Process(ts)
+        self.Collect()
+
+    def Discard(self, ts):
+        self.root.Discard(ts)
@@ -0,0 +1,248 @@
+'''
+    Distributed trees: subtrees hosted by other processes (or hosts), each standing in the local tree as a RemoteLayer.
+
+    A RemoteHost serves one subtree over a socket: its root keeps the id it has in the whole tree (e.g. '0.3'),
+        and a Shards.ShardPort with the parent's id ('0') becomes its only parent, collecting the messages headed out.
+    A RemoteLayer connects to a host and looks like the subtree's root to the local tree: create it, then register it
+        with the parent like any layer (RegisterSubLayer keeps its id). It's a ShardPort, standing in for the subtree
+        as a port does for a shard: messages scheduled for anything under it, and copies propagated to it,
+        wait in its outbox.
+
+    Time stays in step with the local clock. Whenever the local tree processes a timestamp that concerns the subtree
+        (something was queued for it, or the host reported it as its next timestamp), the RemoteLayer sends the outbox
+        and the timestamp in one frame, the host delivers them and processes the timestamp, and replies with what
+        its subtree sent out and its next timestamp. Those messages are delivered into the local tree before the tick
+        goes on, so the remote subtree takes part in the tick as if it were local, one round trip per exchange.
+
+    The wire format is a stream of frames, each a varint length and a Codec value (so messages are sent compactly,
+        by type name), with a whole exchange batched into one frame each way.
+        Frames are decoded without unpickling anything (see Codec), so the other end can't make this one run code:
+        message data must be plain values (numbers, strings, bytes, lists, tuples, dicts and Messages),
+        errors come back as their text, and a host hands its subtree back as a Snapshot, loaded untrusted.
+    Handles to messages already sent can't cancel them, and Discard doesn't reach remote subtrees.
+        When a host closes, its layers come back as Snapshot recreates them (by class, with their SnapshotState),
+        so their classes must be imported here too.
+'''
+
+import io
+import multiprocessing
+import socket
+
+from . import Codec, Message, Shards, Snapshot
+from .Log import Log
+
+class RemoteError(Exception):
+    pass
+
+def SendFrame(sock, value):
+    '''
+        Send value as one frame: a varint length, then its Codec encoding.
+    '''
+    data = Codec.Dumps(value)
+    frame = bytearray()
+    Codec.EncodeVarint(len(data), frame)
+    frame += data
+    sock.sendall(frame)
+
+def RecvFrame(f):
+    '''
+        Read one frame from the binary file object f (see socket.makefile) and return its value.
+    '''
+    n = 0
+    shift = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            raise ConnectionError('Connection closed')
+        n |= (b[0] & 0x7f) << shift
+        if b[0] < 0x80:
+            break
+        shift += 7
+
+    data = f.read(n)
+    if len(data) != n:
+        raise ConnectionError('Connection closed mid-frame')
+    return Codec.Loads(data, bPickle=False)
+
+class RemoteHost:
+    def __init__(self, root, address=('127.0.0.1', 0)):
+        '''
+            Serve the subtree under root (which must have its final id, under its parent's) at address.
+        '''
+        if root.id is None or '.' not in root.id:
+            raise ValueError(f'Remote subtree root {root} needs the id it has in the whole tree')
+
+        self.root = root
+        self.port = Shards.ShardPort(root.id.rpartition('.')[0])
+        self.port.subLayerIndex = {root.id: root}
+        root.parents = [self.port]
+        root.ForgetAncestors()
+
+        self.listener = socket.create_server(address)
+        self.address = self.listener.getsockname()
+
+    def Serve(self):
+        '''
+            Serve one RemoteLayer until it closes the connection (see RemoteLayer.Close) or drops it.
+        '''
+        conn, _ = self.listener.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        f = conn.makefile('rb')
+        try:
+            while True:
+                try:
+                    command = RecvFrame(f)
+                except ConnectionError:
+                    Log.info('RemoteHost %s lost its connection', self.root)
+                    return
+
+                try:
+                    if command[0] == 'tick':
+                        _, ts, now, inbox = command
+                        self.port.now = now
+                        Shards.Deliver(self.root, inbox)
+
+                        nextTs = self.root.NextTs()
+                        if nextTs is not None and nextTs <= ts:
+                            self.root.Process(ts)
+                        reply = ('ok', self.port.TakeOutbox(), self.root.NextTs())
+
+                    elif command[0] == 'hello':
+                        reply = ('ok', self.root.id, sorted(self.root.GetMessageTypes()))
+
+                    else:
+                        # Hand the subtree back, in its current state, and stop.
+                        self.root.parents = []
+                        self.root.ForgetAncestors()
+                        snapshot = io.BytesIO()
+                        Snapshot.Save(self.root, snapshot)
+                        SendFrame(conn, ('ok', snapshot.getvalue()))
+                        return
+
+                except Exception as e:
+                    reply = ('error', f'{type(e).__name__}: {e}')
+
+                SendFrame(conn, reply)
+        finally:
+            f.close()
+            conn.close()
+            self.listener.close()
+
+def _Host(build, address, conn):
+    host = RemoteHost(build(), address)
+    conn.send(host.address)
+    host.Serve()
+
+def StartHost(build, address=('127.0.0.1', 0)):
+    '''
+        Start a process serving the subtree build() returns (build must be picklable, e.g. a module-level function).
+            Return (process, address), to connect RemoteLayers to.
+    '''
+    conn, hostConn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_Host, args=(build, address, hostConn), daemon=True)
+    process.start()
+    return process, tuple(conn.recv())
+
+class RemoteLayer(Shards.ShardPort):
+    def __init__(self, address=None, timeout=None):
+        '''
+            Connect to the RemoteHost at address, taking the id and message types of its subtree's root.
+        '''
+        super().__init__(None)
+
+        # The host's next pending timestamp as of the last exchange, which keeps its wake-up when messages are cancelled.
+        self.hostNextTs = None
+
+        self.sock = None
+        self.file = None
+        if address is None:
+            # Only for Snapshot and pickling, which can't reconnect.
+            return
+
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile('rb')
+
+        self.id, typeNames = self.Call('hello')
+        self.registrations = {Message.TypeId(type): {} for type in typeNames}
+
+    def Call(self, *command):
+        SendFrame(self.sock, command)
+        status, *reply = RecvFrame(self.file)
+        if status == 'error':
+            raise RemoteError(f'{self} failed: {reply[0]}')
+        return reply
+
+    def Wake(self, ts):
+        '''
+            Make sure the local tree processes this layer at ts.
+        '''
+        if ts not in self.notifications:
+            self.PostNotifications(ts)
+
+    def QueueMessage(self, ts, message):
+        self.Wake(ts)
+        return super().QueueMessage(ts, message)
+
+    def DispatchSteps(self, ts, message):
+        # Copies propagated here with AddMessage need no waking: the layer is processed right after (see Layer.ProcessSteps).
+        self.Wake(ts)
+        return super().DispatchSteps(ts, message)
+
+    def CancelMessage(self, handle):
+        # Like Layer.CancelMessage: once nothing is left for the host at ts, the wake-up goes too.
+        if not super().CancelMessage(handle):
+            return False
+
+        ts = handle.ts
+        if ts in self.notifications and ts != self.hostNextTs and all(entryTs != ts for _kind, entryTs, _message in self.outbox):
+            self.CancelNotifications(ts)
+        return True
+
+    def ProcessSteps(self, ts):
+        self.Exchange(ts)
+        return iter(())
+
+    def Exchange(self, ts):
+        '''
+            Exchange with the host for ts, delivering what its subtree sent out into the local tree,
+                until nothing's left to send for ts. Then wake up again for the host's next timestamp.
+        '''
+        parent = self.parents[0]
+        while True:
+            inbox, nextTs = self.Call('tick', ts, self.GetNow(), self.TakeOutbox())
+            Shards.Deliver(parent, inbox)
+
+            # Delivering may have sent more back for ts.
+            if not any(entryTs <= ts for _kind, entryTs, _message in self.outbox):
+                break
+
+        self.notifications.pop(ts, None)
+        self.hostNextTs = nextTs
+        for entryTs in {entryTs for _kind, entryTs, _message in self.outbox}:
+            self.Wake(entryTs)
+        if nextTs is not None:
+            self.Wake(nextTs)
+
+    def Close(self):
+        '''
+            Stop the host and put its subtree, in its current state, back in this layer's place. Return the subtree.
+        '''
+        (snapshot,) = self.Call('close')
+        root = Snapshot.Load(io.BytesIO(snapshot), bTrusted=False)
+        self.file.close()
+        self.sock.close()
+
+        parent = self.parents[0]
+        for ts in list(self.notifications):
+            self.CancelNotifications(ts)
+        root.parents = [parent]
+        root.ForgetAncestors()
+        root.notifications = {}
+        parent.ReplaceSubLayer(self, root)
+
+        # Wake the local tree up for the subtree's pending timestamps, and hand it what's still waiting.
+        for ts in list(root.scheduler.schedule.map):
+            root.PostNotifications(ts)
+        Shards.Deliver(parent, self.TakeOutbox())
+        return root
@@ -6,27 +6,140 @@
 
     The queue's are envisioned as having the next upcoming event on the right end, i.e. calling pop() will pop the
         next event to process, and calling popleft() would pop the event furthest in the future.
+
+    Cancelled events are deleted lazily: Cancel leaves a tombstone for the event at its timestamp,
+        and whoever pops the queue checks IsCancelled and skips it. Once every event at a timestamp is cancelled,
+        the timestamp is removed from the schedule (see SchedulingList.Remove).
+
+    Coalescing (opt-in, per message type; see Layer.coalescing) removes redundant messages as they're added,
+        among those of the same type for the same destination at the same timestamp:
+        COALESCE_DUPLICATES: Drop a message whose payload (the same Message, or a copy of it) is already there.
+            This also covers messages that already ran at the latest timestamp popped, such as the second copy of a
+            broadcast reaching a layer through two parents.
+        COALESCE_LAST: Keep only the latest message; the earlier one is cancelled if it hasn't run yet.
+        A function reducer(old, new): Replace the earlier message, if it hasn't run yet, with the Message it returns.
+    A message coalesced away can't be cancelled by its Handle.
 '''
 
 from collections import deque
 
-from . import SchedulingList
+from . import Message, SchedulingList
+
+COALESCE_DUPLICATES = 'duplicates'
+COALESCE_LAST       = 'last'
 
 class Scheduler:
-    def __init__(self):
-        self.schedule = SchedulingList.SchedulingList()
+    def __init__(self, backend=None, coalescing=None):
+        # backend orders the timestamps; see SchedulingList. Defaults to a heap.
+        self.schedule = SchedulingList.SchedulingList(backend)
+
+        # Map ts -> {id(event): number of cancelled occurrences} for events still sitting in the queue at ts.
+        self.cancelled = {}
+
+        # Map message type id -> coalescing policy, or None to queue every event as it comes.
+        self.coalescing = coalescing
+
+        # Map ts -> {coalescing key: (event, number of events added at ts before it)} for the coalesced events
+        # queued at ts, and the number of events added at each ts so far (see Coalesce).
+        # Then {coalescing key: event} for the latest timestamp popped, whose events may already have run.
+        self.coalesced = {}
+        self.added = {}
+        self.lastTs = None
+        self.lastCoalesced = None
 
     def Add(self, ts, event):
         '''
             Add an event at time ts into the tracked events queue for that time.
         '''
         e = self.schedule.Get(ts)
+
+        if self.coalescing is not None:
+            policy = self.coalescing.get(event.GetTypeId())
+            if policy is not None:
+                event = self.Coalesce(ts, e, event, policy)
+                if event is None:
+                    return
+
+            self.added[ts] = self.added.get(ts, 0) + 1
+
         if e is None:
             e = deque()
             self.schedule.Add(ts, e)
 
         e.appendleft(event)
 
+    @staticmethod
+    def CoalescingKey(event, policy):
+        '''
+            Return the key events that coalesce with event under policy share.
+        '''
+        if policy == COALESCE_DUPLICATES:
+            return (event.GetTypeId(), event.dest, id(event.GetPayload()))
+        return (event.GetTypeId(), event.dest)
+
+    def Coalesce(self, ts, q, event, policy):
+        '''
+            Apply a coalescing policy to event, about to be added to the queue q at ts (None if there's none yet).
+                Return the event to add in its place, or None to drop it.
+        '''
+        key = self.CoalescingKey(event, policy)
+
+        index = self.coalesced.get(ts)
+        entry = index.get(key) if index else None
+        if entry is not None:
+            # Events are popped from the right end of the queue in the order they were added, so the earlier one
+            # has been popped (and run) once more events have been popped at ts than were added before it.
+            old, before = entry
+            bQueued = before >= self.added[ts] - len(q)
+        else:
+            old = self.lastCoalesced.get(key) if ts == self.lastTs else None
+            bQueued = False
+
+        if old is not None:
+            if policy == COALESCE_DUPLICATES:
+                return None
+
+            # Only an earlier message that hasn't run yet is replaced.
+            if bQueued:
+                tomb = self.cancelled.get(ts)
+                if tomb is None:
+                    tomb = self.cancelled[ts] = {}
+                tomb[id(old)] = tomb.get(id(old), 0) + 1
+                if policy != COALESCE_LAST:
+                    event = policy(old, event)
+
+        if index is None:
+            index = self.coalesced[ts] = {}
+        index[key] = (event, self.added.get(ts, 0))
+        return event
+
+    def AddMany(self, entries):
+        '''
+            Add an iterable of (ts, event) pairs, the same as calling Add for each in order.
+                Queues for new timestamps are added to the schedule in bulk.
+                Return the list of timestamps that had no queue before.
+        '''
+        if self.coalescing is not None:
+            newTs = []
+            for ts, event in entries:
+                if self.schedule.Get(ts) is None:
+                    newTs.append(ts)
+                self.Add(ts, event)
+            return [ts for ts in newTs if self.schedule.Get(ts) is not None]
+
+        newQueues = {}
+        for ts, event in entries:
+            e = newQueues.get(ts)
+            if e is None:
+                e = self.schedule.Get(ts)
+                if e is None:
+                    e = newQueues[ts] = deque()
+
+            e.appendleft(event)
+
+        self.schedule.AddMany(newQueues.items())
+        return list(newQueues)
+
     def Peek(self):
         '''
             Return the next (ts, event) tuple, or None if there are no scheduled events.
@@ -36,12 +149,169 @@ class Scheduler:
     def Pop(self):
         '''
             The events are returned as a tuple: (timestamp, event).
+                Cancelled events are removed from the returned queue.
                 If no events are present, return None.
         '''
-        return self.schedule.Pop()
+        t = self.schedule.Pop()
+        if t and self.coalescing is not None:
+            self.PopCoalesced(t[0])
+        if t and self.cancelled and t[0] in self.cancelled:
+            ts, q = t
+            live = [e for e in q if not self.IsCancelled(ts, e)]
+            del self.cancelled[ts]
+            q.clear()
+            q.extend(live)
+        return t
+
+    def PopCoalesced(self, ts):
+        '''
+            ts was popped: its coalesced events become the latest ones, added to those of earlier pops of the same ts.
+        '''
+        index = self.coalesced.pop(ts, None)
+        self.added.pop(ts, None)
+        if ts != self.lastTs:
+            self.lastTs = ts
+            self.lastCoalesced = {}
+        if index:
+            self.lastCoalesced.update((key, event) for key, (event, _before) in index.items())
+
+    def Cancel(self, ts, event):
+        '''
+            Cancel one queued occurrence of event at time ts.
+                Return True if it was found. If no live events are left at ts, ts is removed from the schedule.
+        '''
+        q = self.schedule.Get(ts)
+        if q is None or not self.Tombstone(ts, q, event):
+            return False
+
+        tomb = self.cancelled[ts]
+        if sum(tomb.values()) >= len(q):
+            del self.cancelled[ts]
+            q.clear()
+            self.schedule.Remove(ts)
+            self.coalesced.pop(ts, None)
+            self.added.pop(ts, None)
+
+        elif self.coalescing is not None:
+            # A cancelled event no longer coalesces with the ones added after it.
+            policy = self.coalescing.get(event.GetTypeId())
+            index = self.coalesced.get(ts) if policy is not None else None
+            if index:
+                key = self.CoalescingKey(event, policy)
+                entry = index.get(key)
+                if entry is not None and entry[0] is event:
+                    del index[key]
+
+        return True
+
+    def Tombstone(self, ts, q, event):
+        '''
+            Mark one occurrence of event in the queue q at ts as cancelled. Return False if it isn't there.
+        '''
+        key = id(event)
+        tomb = self.cancelled.get(ts)
+        dead = tomb.get(key, 0) if tomb else 0
+
+        # The head queue may be part way through processing, so check the event hasn't already been popped.
+        # Otherwise it must still be queued, unless it was queued more than once and already cancelled,
+        # or coalescing dropped it.
+        s = self.schedule.Peek()
+        if dead or s[1] is q or self.coalescing is not None:
+            if sum(1 for e in q if e is event) <= dead:
+                return False
+
+        if tomb is None:
+            tomb = self.cancelled[ts] = {}
+        tomb[key] = dead + 1
+        return True
+
+    def IsCancelled(self, ts, event):
+        '''
+            Call for each event popped from the queue at ts: return True if it was cancelled (and forget the tombstone).
+        '''
+        tomb = self.cancelled.get(ts)
+        if tomb:
+            key = id(event)
+            dead = tomb.get(key)
+            if dead:
+                if dead == 1:
+                    del tomb[key]
+                else:
+                    tomb[key] = dead - 1
+                return True
+        return False
 
     def Get(self, ts):
         '''
             Return the event queue for time ts if it exists, else None.
         '''
         return self.schedule.Get(ts)
+
+    def Depth(self):
+        '''
+            Return the number of live events queued, over all timestamps.
+        '''
+        return sum(len(q) for q in self.schedule.map.values()) - sum(sum(tomb.values()) for tomb in self.cancelled.values())
+
+    def Items(self):
+        '''
+            Return a list of (ts, [events]) for every pending timestamp, in timestamp order,
+                with each queue's events in the order they'll be popped and cancelled ones left out.
+        '''
+        items = []
+        for ts in sorted(self.schedule.map):
+            tomb = dict(self.cancelled.get(ts, ()))
+            events = []
+            for e in reversed(self.schedule.map[ts]):
+                dead = tomb.get(id(e))
+                if dead:
+                    tomb[id(e)] = dead - 1
+                else:
+                    events.append(e)
+            items.append((ts, events))
+        return items
+
+    def __getstate__(self):
+        # Layers are pickled to move them between processes (see Shards), where object ids and type ids differ:
+        # tombstones are kept with the events they cancel, coalescing policies by type name, and the coalescing
+        # indexes as their entries, to be keyed again on load.
+        state = self.__dict__.copy()
+        state['cancelled'] = {}
+        for ts, tomb in self.cancelled.items():
+            events = {id(e): e for e in self.schedule.Get(ts) or ()}
+            state['cancelled'][ts] = [(events[key], dead) for key, dead in tomb.items() if key in events]
+        if self.coalescing is not None:
+            state['coalescing'] = Message.ByTypeName(self.coalescing)
+        state['coalesced'] = {ts: list(index.values()) for ts, index in self.coalesced.items()}
+        if self.lastCoalesced is not None:
+            state['lastCoalesced'] = list(self.lastCoalesced.values())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cancelled = {ts: {id(e): dead for e, dead in tomb} for ts, tomb in state['cancelled'].items()}
+        if self.coalescing is not None:
+            self.coalescing = Message.ByTypeId(self.coalescing)
+            self.coalesced = {ts: {self.KeyOf(entry[0]): entry for entry in entries} for ts, entries in state['coalesced'].items()}
+            if self.lastCoalesced is not None:
+                self.lastCoalesced = {self.KeyOf(e): e for e in self.lastCoalesced}
+
+    def KeyOf(self, event):
+        return self.CoalescingKey(event, self.coalescing[event.GetTypeId()])
+
+class _EmptyScheduler(Scheduler):
+    '''
+        Empty scheduler shared by every layer that hasn't queued anything yet (see Layer.AddMessage).
+            It reads like any empty scheduler, but adding to it would add to all of them, so that raises.
+    '''
+    def Add(self, ts, event):
+        raise TypeError('The shared empty scheduler is read-only; give the layer its own scheduler first')
+
+    def AddMany(self, entries):
+        raise TypeError('The shared empty scheduler is read-only; give the layer its own scheduler first')
+
+    def __reduce__(self):
+        # Stay the shared instance when layers are pickled (see Shards).
+        return 'EMPTY'
+
+EMPTY = _EmptyScheduler()
@@ -1,27 +1,184 @@
 '''
     Underlying data structure for scheduling events.
     It should maintain a list/queue/etc. of events in the order in which they'll be run.
+
+    The ordering itself is delegated to a pluggable backend:
+        HeapBackend: Binary heap. O(log n) insert/pop for any orderable timestamps; the default.
+        WheelBackend: Timing wheel (a calendar queue) over a window of upcoming integer timestamps,
+            giving O(1) amortized insert and pop-min for near-future ticks. Anything else goes to an overflow heap.
+
+    A backend provides Push(ts, event), PushMany(entries), Peek() and Pop(),
+        where Peek/Pop return a (ts, event) tuple or None. Entries with equal timestamps come out in insertion order.
+
+    Removing a timestamp is lazy: its entry stays in the backend and is skipped once it reaches the front,
+        and the backend is compacted once dead entries make up most of it.
 '''
 
+from collections import deque
 import heapq
+import itertools
 
-class SchedulingList:
+class HeapBackend:
     def __init__(self):
+        # Heap of (ts, seq, (ts, event)) entries. The sequence number keeps equal timestamps in insertion order
+        # without ever comparing events, and keeping the (ts, event) pair around lets Peek return it without allocating.
+        self.heap = []
+        self.seq = itertools.count()
+
+    def Push(self, ts, event):
+        heapq.heappush(self.heap, (ts, next(self.seq), (ts, event)))
+
+    def PushMany(self, entries):
+        batch = [(ts, next(self.seq), (ts, event)) for ts, event in entries]
+
+        # heapify is linear in the whole heap, so it only pays off once the batch is a decent fraction of it.
+        if len(batch) * 8 > len(self.heap):
+            self.heap.extend(batch)
+            heapq.heapify(self.heap)
+        else:
+            for entry in batch:
+                heapq.heappush(self.heap, entry)
+
+    def Peek(self):
+        return self.heap[0][2] if self.heap else None
+
+    def Pop(self):
+        return heapq.heappop(self.heap)[2] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __getstate__(self):
+        # Layers are pickled to move them between processes; itertools.count only pickles on older Pythons.
+        return {'heap': self.heap, 'seq': next(self.seq)}
+
+    def __setstate__(self, state):
+        self.heap = state['heap']
+        self.seq = itertools.count(state['seq'])
+
+class WheelBackend:
+    '''
+        Ring of size slots covering the integer timestamps [base, base + size), one slot per timestamp.
+            Each slot is a deque of its entries in the order they were pushed, so many entries on one tick pop in O(1).
+            Pop-min walks forward from base to the next occupied slot, so dense near-future ticks cost O(1) amortized.
+            Timestamps outside the window (far future, already past, or not ints) go to an overflow HeapBackend.
+            When the wheel runs dry, the window jumps to the earliest overflow timestamp and pulls in what fits.
+        size is rounded up to a power of two.
+    '''
+    def __init__(self, size=256):
+        self.size = 1 << max(size - 1, 1).bit_length()
+        self.mask = self.size - 1
+        self.slots = [None] * self.size
+        self.base = 0
+        self.count = 0
+        self.overflow = HeapBackend()
+
+    def Push(self, ts, event):
+        if type(ts) is int and 0 <= ts - self.base < self.size:
+            i = ts & self.mask
+            slot = self.slots[i]
+            if slot is None:
+                self.slots[i] = deque(((ts, event),))
+            else:
+                slot.append((ts, event))
+            self.count += 1
+        else:
+            self.overflow.Push(ts, event)
+
+    def PushMany(self, entries):
+        for ts, event in entries:
+            self.Push(ts, event)
+
+    def NextSlot(self):
+        '''
+            Advance base to the earliest occupied slot and return that slot's index, or None if the wheel is empty.
+        '''
+        if not self.count and not self.Refill():
+            return None
+
+        slots = self.slots
+        mask = self.mask
+        base = self.base
+        i = base & mask
+        while slots[i] is None:
+            base += 1
+            i = base & mask
+
+        self.base = base
+        return i
+
+    def Refill(self):
+        '''
+            Move the (empty) window to the earliest overflow timestamp and pull in the entries that fit.
+                Return True if anything was pulled in.
+        '''
+        overflow = self.overflow
+        top = overflow.Peek()
+        if top is None or type(top[0]) is not int:
+            return False
+
+        self.base = top[0]
+        end = self.base + self.size
+        while top is not None and type(top[0]) is int and top[0] < end:
+            self.Push(*overflow.Pop())
+            top = overflow.Peek()
+
+        return True
+
+    def Peek(self):
+        i = self.NextSlot()
+        heap = self.overflow.heap
+
+        if i is None or (heap and heap[0][0] <= self.base):
+            return heap[0][2] if heap else None
+        return self.slots[i][0]
+
+    def Pop(self):
+        i = self.NextSlot()
+        heap = self.overflow.heap
+
+        if i is None or (heap and heap[0][0] <= self.base):
+            return self.overflow.Pop()
+
+        self.count -= 1
+        slot = self.slots[i]
+        if len(slot) == 1:
+            self.slots[i] = None
+            return slot[0]
+        return slot.popleft()
+
+    def __len__(self):
+        return self.count + len(self.overflow)
+
+class SchedulingList:
+    def __init__(self, backend=None):
         # This is the underlying structure for the priority queue.
-        self.events = []
+        self.events = backend if backend is not None else HeapBackend()
 
         # Maintain a dict that maps event timestamps to those events.
         # This will be useful for quickly querying if there's an event at a certain time,
         # as well as for directly modifying the event (if it's an object).
         self.map = {}
 
+        # Number of removed entries still sitting in the backend.
+        self.dead = 0
+
     def Add(self, ts, event):
         '''
             Add an event at time ts into the tracked events.
+                Timestamps are expected to be unique (Scheduler keeps one queue per timestamp).
         '''
-        heapq.heappush(self.events, (ts, event))
+        self.events.Push(ts, event)
         self.map[ts] = event
 
+    def AddMany(self, entries):
+        '''
+            Add an iterable of (ts, event) pairs, in bulk where the backend supports it.
+        '''
+        entries = list(entries)
+        self.events.PushMany(entries)
+        self.map.update(entries)
+
     def Get(self, ts):
         '''
             Returns an event if it exists at the specified timestamp, else None.
@@ -32,10 +189,9 @@ class SchedulingList:
         '''
             Return the next (ts, event) tuple, or None if there are no scheduled events.
         '''
-        if len(self.events) == 0:
-            return None
-        else:
-            return self.events[0]
+        if self.dead:
+            self.SkipDead()
+        return self.events.Peek()
 
     def Pop(self):
         '''
@@ -46,7 +202,49 @@ class SchedulingList:
         if not self.map:
             return None
         else:
-            t = heapq.heappop(self.events)
+            if self.dead:
+                self.SkipDead()
+            t = self.events.Pop()
             ts, _event = t
             del self.map[ts]
             return t
+
+    def Remove(self, ts):
+        '''
+            Stop tracking the event at ts. Return it, or None if there wasn't one.
+        '''
+        event = self.map.pop(ts, None)
+        if event is None:
+            return None
+
+        self.dead += 1
+        if self.dead > 32 and self.dead * 2 > len(self.events):
+            self.Compact()
+        return event
+
+    def IsLive(self, t):
+        return self.map.get(t[0]) is t[1]
+
+    def SkipDead(self):
+        '''
+            Drop removed entries from the front of the backend.
+        '''
+        t = self.events.Peek()
+        while t is not None and not self.IsLive(t):
+            self.events.Pop()
+            self.dead -= 1
+            t = self.events.Peek()
+
+    def Compact(self):
+        '''
+            Rebuild the backend without the removed entries.
+        '''
+        live = []
+        t = self.events.Pop()
+        while t is not None:
+            if self.IsLive(t):
+                live.append(t)
+            t = self.events.Pop()
+
+        self.events.PushMany(live)
+        self.dead = 0
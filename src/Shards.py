@@ -0,0 +1,286 @@
+'''
+    Parallel tick executor: runs independent subtrees of a Layer tree in worker processes.
+
+    The tree is cut at a configurable depth below the root. Every layer at that depth becomes the root of a shard,
+        and each shard (with everything below it) is moved into one of the worker processes.
+        The layers above the cut (the trunk) stay in this process.
+    A ShardPort stands in for the missing half on each side of the cut:
+        in the trunk, a port with the shard root's id replaces the shard root under its parent;
+        in the worker, a port with the parent's id becomes the shard root's only parent.
+    Messages that reach a port are held in its outbox rather than handled.
+
+    ShardedRunner is the Clock while shards are out. Each tick at ts runs in rounds:
+        1. The trunk processes ts.
+        2. Every worker receives what the trunk's ports collected for its shards, then processes ts in each shard.
+        3. Each shard's port outbox comes back, and the messages in it are delivered into the trunk
+            (and from there to other shards' ports), in shard order.
+        Rounds repeat until nothing is left at or before ts.
+    Each shard and the trunk always see their messages in the same order, whatever the number of workers,
+        so results are deterministic. Within a tick, messages that cross the cut are handled after the round
+        that produced them, so the interleaving differs from running the tree serially.
+
+    Shards must be real subtrees: each layer in a shard may only have parents inside the same shard
+        (the shard root has exactly one parent, in the trunk). Trees attached to a World can't be sharded.
+    Layers are pickled to move them between processes, so handlers must be picklable (methods, not lambdas).
+        Message types are pickled by name (see Message.ByTypeName), as each process interns them itself,
+        so any start method works: fork, spawn or forkserver.
+'''
+
+import multiprocessing
+import os
+
+from . import Clock, Handle, Layer, Message
+from .Log import Log
+
+# Outbox entry kinds.
+KIND_SCHEDULE   = 'schedule'    # Schedule the message for its destination (as ScheduleMessageFor).
+KIND_DISPATCH   = 'dispatch'    # A propagated copy, to be run in its destination layer now.
+
+class ShardPort(Layer.Layer):
+    bProxy = True
+
+    def __init__(self, id, typeIds=()):
+        super().__init__()
+        self.id = id
+
+        # (kind, ts, message) entries waiting to cross to the other side of the cut.
+        self.outbox = []
+
+        # Make the port look like the layer it replaces to whoever registers it.
+        self.dispatch = {}
+        self.registrations = {type: {} for type in typeIds}
+
+    def QueueMessage(self, ts, message):
+        self.outbox.append((KIND_SCHEDULE, ts, message))
+        return Handle.Handle(self, ts, message)
+
+    def AddMessage(self, ts, message):
+        # The other side tracks its own timestamps, so notifications stop here.
+        if message.GetTypeId() != Message.TYPEID_NOTIFICATION:
+            self.outbox.append((KIND_DISPATCH, ts, message))
+
+    def DispatchSteps(self, ts, message):
+        self.outbox.append((KIND_DISPATCH, ts, message))
+        return iter(())
+
+    def CancelMessage(self, handle):
+        for i, (_kind, ts, message) in enumerate(self.outbox):
+            if message is handle.message and ts == handle.ts:
+                del self.outbox[i]
+                return True
+        return False
+
+    def TakeOutbox(self):
+        outbox = self.outbox
+        self.outbox = []
+        return outbox
+
+    def NextTs(self):
+        return min((ts for _kind, ts, _message in self.outbox), default=None)
+
+def Deliver(root, outbox):
+    '''
+        Deliver the (kind, ts, message) entries of a port's outbox into the tree under root.
+    '''
+    for kind, ts, message in outbox:
+        if kind == KIND_SCHEDULE:
+            if not root.ScheduleMessageFor(ts, message):
+                Log.warning('Shard exchange found no layer %s', message.GetDest())
+        else:
+            layer = root.FindLayer(message.GetDest())
+            if layer is None:
+                Log.warning('Shard exchange found no layer %s', message.GetDest())
+            elif layer is root:
+                # A shard root's queue is processed directly by the worker, so no notification is needed.
+                layer.AddMessage(ts, message)
+            else:
+                layer.DispatchMessage(ts, message)
+
+def _Work(conn, shards):
+    '''
+        Worker process loop. shards is a list of (shard root, port) pairs.
+    '''
+    while True:
+        command = conn.recv()
+
+        try:
+            if command[0] == 'tick':
+                _, ts, latePolicy, inboxes = command
+                results = []
+                for (root, port), inbox in zip(shards, inboxes):
+                    if port.now is None or port.now < ts:
+                        port.now = ts
+                    root.latePolicy = latePolicy
+
+                    Deliver(root, inbox)
+
+                    nextTs = root.NextTs()
+                    if nextTs is not None and nextTs <= ts:
+                        root.Process(ts)
+
+                    results.append((port.TakeOutbox(), root.NextTs()))
+                conn.send(('ok', results))
+
+            elif command[0] == 'discard':
+                _, ts = command
+                for root, _port in shards:
+                    root.Discard(ts)
+                conn.send(('ok', [(port.TakeOutbox(), root.NextTs()) for root, port in shards]))
+
+            else:
+                conn.send(('ok', shards))
+                return
+
+        except Exception as e:
+            conn.send(('error', e))
+
+class ShardedRunner(Clock.Clock):
+    def __init__(self, root, depth=1, workers=None, context=None):
+        '''
+            Move the subtrees depth levels below root into up to workers processes (the CPU count by default).
+                context is the multiprocessing context to start them with (e.g. multiprocessing.get_context('spawn')),
+                or None for the default start method.
+                Call Close() to stop the workers and put the shards back into the tree.
+        '''
+        if root.world is not None:
+            raise ValueError(f'{root} is attached to a World, which can\'t be sharded')
+
+        self.root = root
+        self.now = root.now
+
+        # Shard roots, the trunk ports standing in for them, and each shard's next timestamp.
+        self.shards = root.GetSubtreesAt(depth)
+        self.ports = []
+        self.nextTs = []
+
+        workerShards = [[] for _ in range(min(workers or os.cpu_count() or 1, len(self.shards)))]
+
+        # Which shards (by index) each worker runs.
+        self.assigned = [[] for _ in workerShards]
+
+        for i, shard in enumerate(self.shards):
+            parent = shard.parents[0]
+
+            # The trunk no longer wakes up for the shard's timestamps; the runner asks the workers instead.
+            for ts in list(shard.notifications):
+                shard.CancelNotifications(ts)
+
+            typeIds = shard.GetMessageTypeIds()
+            trunkPort = ShardPort(shard.id, typeIds)
+            trunkPort.parents = [parent]
+            parent.ReplaceSubLayer(shard, trunkPort)
+            self.ports.append(trunkPort)
+
+            shardPort = ShardPort(parent.id)
+            shardPort.now = self.now
+            shardPort.subLayerIndex = {shard.id: shard}
+            shard.parents = [shardPort]
+            shard.ForgetAncestors()
+
+            self.nextTs.append(shard.NextTs())
+
+            w = i % len(workerShards)
+            workerShards[w].append((shard, shardPort))
+            self.assigned[w].append(i)
+
+        context = context or multiprocessing
+        self.conns = []
+        self.workers = []
+        for shards in workerShards:
+            conn, workerConn = context.Pipe()
+            worker = context.Process(target=_Work, args=(workerConn, shards), daemon=True)
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+        Log.info('Sharded %s into %d shard(s) on %d worker(s)', root, len(self.shards), len(self.workers))
+
+    def NextTs(self):
+        nextTs = [ts for ts in self.nextTs if ts is not None]
+        nextTs.extend(ts for ts in (self.root.NextTs(), *(port.NextTs() for port in self.ports)) if ts is not None)
+        return min(nextTs, default=None)
+
+    def Process(self, ts):
+        '''
+            Process ts across the trunk and every shard, exchanging messages that cross the cut until none are left.
+        '''
+        if self.root.now is None or self.root.now < ts:
+            self.root.now = ts
+        self.root.latePolicy = self.latePolicy
+
+        while True:
+            self.root.Process(ts)
+            self.Exchange('tick', ts, self.latePolicy)
+
+            nextTs = self.NextTs()
+            if nextTs is None or nextTs > ts:
+                break
+
+    def Discard(self, ts):
+        self.root.Discard(ts)
+        for port in self.ports:
+            port.outbox = [entry for entry in port.outbox if entry[1] != ts]
+        self.Exchange('discard', ts)
+
+    def Exchange(self, command, ts, *args):
+        '''
+            Send each worker the command, with the inboxes for its shards on a tick,
+                then deliver what comes back into the trunk in shard order.
+        '''
+        # Only a tick takes the ports' outboxes; on a discard they wait for the next one.
+        if command == 'tick':
+            inboxes = [port.TakeOutbox() for port in self.ports]
+        for conn, assigned in zip(self.conns, self.assigned):
+            if command == 'tick':
+                conn.send((command, ts, *args, [inboxes[i] for i in assigned]))
+            else:
+                conn.send((command, ts))
+
+        results = [None] * len(self.shards)
+        for conn, assigned in zip(self.conns, self.assigned):
+            status, reply = conn.recv()
+            if status == 'error':
+                raise reply
+            for i, result in zip(assigned, reply):
+                results[i] = result
+
+        for i, (outbox, nextTs) in enumerate(results):
+            self.nextTs[i] = nextTs
+            Deliver(self.root, outbox)
+
+    def Close(self):
+        '''
+            Stop the workers and put the shards, in their current state, back into the tree.
+        '''
+        for conn in self.conns:
+            conn.send(('close',))
+
+        shards = [None] * len(self.shards)
+        for conn, assigned, worker in zip(self.conns, self.assigned, self.workers):
+            status, reply = conn.recv()
+            if status == 'error':
+                raise reply
+            worker.join()
+
+            for i, (shard, _shardPort) in zip(assigned, reply):
+                shards[i] = shard
+
+        for shard, port in zip(shards, self.ports):
+            parent = port.parents[0]
+            shard.parents = [parent]
+            shard.ForgetAncestors()
+            shard.notifications.clear()
+            parent.ReplaceSubLayer(port, shard)
+
+            # Wake the trunk up again for the shard's pending timestamps.
+            for ts in list(shard.scheduler.schedule.map):
+                shard.PostNotifications(ts)
+
+        # Messages still waiting to cross into the shards.
+        for port in self.ports:
+            Deliver(self.root, port.TakeOutbox())
+
+        self.shards = shards
+        self.conns = []
+        self.workers = []
+        self.root.now = self.now
@@ -0,0 +1,255 @@
+'''
+    Save and restore a whole Layer tree, including every pending message, in a compact binary format.
+
+    A snapshot stream is MAGIC followed by values, each a varint length and then a Codec encoding:
+        a header (kind, root id),
+        one record per layer:
+            (class, id, idCntr, now, parent ids, registrations, sub-layer index, queues, notification timestamps, state)
+        then a zero length.
+    Records are written and read one at a time, so large trees stream without being built up in memory first.
+
+    Save writes every layer. SaveIncremental writes only the layers that changed since the last snapshot
+        (see Layer.MarkDirty), plus the root; it skips clean subtrees without visiting them.
+    Load reads a full snapshot followed by any incremental ones, in the order they were saved,
+        with later records replacing earlier ones, and returns the rebuilt root.
+        Layers unregistered since an earlier snapshot are left out: the records rewritten for their old parents
+        no longer list them, so they're dropped with whatever else the root doesn't reach any more.
+
+    Layers are recreated by calling their class with no arguments, then their structure and queues are filled in
+        and RestoreState is called with what SnapshotState returned. Handlers come from the class,
+        so handler tables changed after construction aren't saved, and neither are subscriptions (see Layer.Subscribe)
+        made after it; those made by the constructor are made again once the tree is rebuilt.
+    Trees attached to a World can't be saved; their messages live in the World's queue.
+    Snapshots from anywhere untrusted (see Remote) are loaded with bTrusted=False: values can't be pickled
+        (see Codec), and layer classes must be in modules already imported, rather than importing whatever they name.
+'''
+
+import importlib
+import sys
+
+from . import Codec, Layer, Message, Scheduler
+
+MAGIC = b'LOSnap\x01'
+
+KIND_FULL           = 'full'
+KIND_INCREMENTAL    = 'incremental'
+
+class SnapshotError(Exception):
+    pass
+
+def Save(root, f):
+    '''
+        Write a full snapshot of the tree under root to the binary file object f. Return the number of layers written.
+    '''
+    return _Write(root, f, KIND_FULL)
+
+def SaveIncremental(root, f):
+    '''
+        Write the layers that changed since the last snapshot to f. Return the number of layers written.
+    '''
+    return _Write(root, f, KIND_INCREMENTAL)
+
+def _Write(root, f, kind):
+    if root.world is not None:
+        raise SnapshotError(f'{root} is attached to a World; its messages aren\'t in the layers')
+
+    f.write(MAGIC)
+    _WriteValue(f, (kind, root.id))
+
+    count = 0
+    seen = set()
+    stack = [root]
+    while stack:
+        layer = stack.pop()
+        if id(layer) in seen:
+            continue
+        seen.add(id(layer))
+
+        if kind == KIND_FULL or layer.bDirty or layer is root:
+            _WriteValue(f, _Record(layer))
+            count += 1
+
+        subLayers = layer.GetSubLayers()
+        if kind == KIND_FULL:
+            stack.extend(reversed(subLayers))
+        elif layer.bDirtyBelow:
+            stack.extend(sub for sub in reversed(subLayers) if sub.bDirty or sub.bDirtyBelow)
+
+        layer.bDirty = False
+        layer.bDirtyBelow = False
+
+    f.write(b'\x00')
+    return count
+
+def _Record(layer):
+    cls = type(layer)
+    return (
+        f'{cls.__module__}:{cls.__qualname__}',
+        layer.id,
+        layer.idCntr,
+        layer.now,
+        [parent.id for parent in layer.parents],
+        [(Message.TypeName(type), [sub.id for sub in subs]) for type, subs in layer.registrations.items()],
+        [(key, sub.id) for key, sub in layer.subLayerIndex.items()],
+        layer.scheduler.Items(),
+        list(layer.notifications),
+        layer.SnapshotState(),
+    )
+
+def _WriteValue(f, value):
+    data = bytearray()
+    Codec.Encode(value, data)
+
+    out = bytearray()
+    Codec.EncodeVarint(len(data), out)
+    f.write(out)
+    f.write(data)
+
+def _ReadVarint(f):
+    n = 0
+    shift = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            raise SnapshotError('Truncated snapshot')
+        n |= (b[0] & 0x7f) << shift
+        if b[0] < 0x80:
+            return n
+        shift += 7
+
+def Read(f, bTrusted=True):
+    '''
+        Generator over a snapshot stream: yield its header (kind, root id), then each layer record tuple.
+    '''
+    if f.read(len(MAGIC)) != MAGIC:
+        raise SnapshotError('Not a snapshot, or an unsupported version')
+
+    while True:
+        n = _ReadVarint(f)
+        if n == 0:
+            return
+
+        data = f.read(n)
+        if len(data) != n:
+            raise SnapshotError('Truncated snapshot')
+        yield Codec.Loads(data, bTrusted)
+
+def Load(*files, external=None, bTrusted=True):
+    '''
+        Rebuild a tree from a full snapshot followed by incremental ones, and return its root layer.
+            external maps ids to existing layers that the snapshot refers to but doesn't contain,
+            e.g. the parent of a saved subtree.
+    '''
+    records = {}
+    rootId = None
+    for i, f in enumerate(files):
+        reader = Read(f, bTrusted)
+        kind, rootId = next(reader)
+        if (kind == KIND_FULL) != (i == 0):
+            raise SnapshotError(f'Expected a {KIND_FULL if i == 0 else KIND_INCREMENTAL} snapshot, got {kind}')
+
+        for record in reader:
+            records[record[1]] = record
+
+    if len(files) > 1:
+        records = _Reachable(records, rootId)
+
+    # Create every layer first, so the records can refer to each other by id.
+    layers = {}
+    for id, record in records.items():
+        layers[id] = _NewLayer(record[0], bTrusted)
+
+    lookup = dict(external or {})
+    lookup.update(layers)
+
+    for id, record in records.items():
+        _className, _id, idCntr, now, parentIds, registrations, subLayerIndex, queues, _notificationTs, state = record
+        layer = layers[id]
+
+        layer.id = id
+        layer.idCntr = idCntr
+        if now is not None:
+            layer.now = now
+
+        try:
+            layer.parents = [lookup[parentId] for parentId in parentIds]
+            if registrations:
+                layer.registrations = {Message.TypeId(type): dict.fromkeys(lookup[sub] for sub in subs) for type, subs in registrations}
+            if subLayerIndex:
+                layer.subLayerIndex = {key: lookup[sub] for key, sub in subLayerIndex}
+        except KeyError as e:
+            raise SnapshotError(f'Layer {id} refers to {e}, which isn\'t in the snapshot') from None
+
+        layer.scheduler = layer.NewScheduler() if queues else Scheduler.EMPTY
+        for ts, events in queues:
+            for event in events:
+                layer.scheduler.Add(ts, event)
+
+        layer.RestoreState(state)
+
+    # Each notification is one object shared by all the parents it was posted to (see Layer.CancelNotifications).
+    for id, record in records.items():
+        layer = layers[id]
+        layer.notifications = {} if record[8] else Layer.EMPTY_MAP
+        for ts in record[8]:
+            shared = None
+            for parent in layer.parents:
+                q = parent.scheduler.Get(ts) or ()
+                for i, m in enumerate(q):
+                    if m.GetTypeId() == Message.TYPEID_NOTIFICATION and m.dest == id:
+                        if shared is None:
+                            shared = m
+                        else:
+                            q[i] = shared
+                        break
+            if shared is not None:
+                layer.notifications[ts] = shared
+
+    for layer in layers.values():
+        layer.BuildDispatchTable()
+        layer.bDirty = False
+        layer.bDirtyBelow = False
+
+    # Constructors subscribed before their layers had sub-layers or parents: subscribe again so the filters cover the tree.
+    subscribed = [(layer, layer.subscriptions.own) for layer in layers.values() if layer.subscriptions is not None]
+    for layer, _own in subscribed:
+        layer.subscriptions = None
+    for layer, own in subscribed:
+        for type, subscription in own.items():
+            layer.Subscribe(type, subscription.topics, subscription.predicate)
+
+    if rootId not in layers:
+        raise SnapshotError(f'Root {rootId} isn\'t in the snapshot')
+    return layers[rootId]
+
+def _Reachable(records, rootId):
+    '''
+        Return the records of the layers reachable from the root through their registrations and sub-layer indexes.
+    '''
+    reached = set()
+    stack = [rootId]
+    while stack:
+        id = stack.pop()
+        record = records.get(id)
+        if record is None or id in reached:
+            continue
+
+        reached.add(id)
+        for _type, subs in record[5]:
+            stack.extend(subs)
+        stack.extend(sub for _key, sub in record[6])
+
+    return {id: record for id, record in records.items() if id in reached}
+
+def _NewLayer(className, bTrusted):
+    moduleName, _, qualName = className.partition(':')
+    try:
+        obj = importlib.import_module(moduleName) if bTrusted else sys.modules[moduleName]
+        for name in qualName.split('.'):
+            obj = getattr(obj, name)
+    except (ImportError, KeyError, AttributeError):
+        raise SnapshotError(f'Can\'t find layer class {className}') from None
+
+    if not (isinstance(obj, type) and issubclass(obj, Layer.Layer)):
+        raise SnapshotError(f'{className} isn\'t a layer class')
+    return obj()
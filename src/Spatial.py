@@ -0,0 +1,294 @@
+'''
+    Positions for layers, and messages delivered by area: to the sub-layers within some range of a point,
+        or the nearest few, instead of to every sibling.
+
+    A SpatialLayer has an optional (x, y) position, and indexes the positions of its own SpatialLayer sub-layers
+        in a grid hash (GridIndex): positions are bucketed into square cells of cellSize,
+        so a query only looks at the cells overlapping it. Moving a layer (SetPosition) updates its parents' indexes,
+        and costs nothing beyond the position itself until it crosses into another cell.
+
+    A message type is delivered by area once SetAreaKey gives a way to find the area from its data,
+        e.g. SetAreaKey('EXPLOSION', lambda data: InRange(data['x'], data['y'], data['radius'])).
+        When such a message propagates down from a SpatialLayer (PROP_LT/PROP_LTE/...), only the sub-layers
+        registered for its type whose positions are in the area get a copy. Sub-layers without a position get none.
+        Each copy is filtered the same way again in the sub-layers that are SpatialLayers themselves,
+        so positions are in one coordinate space for the whole tree. Messages whose area is None go everywhere as usual.
+    Topic subscriptions (see Layer.Subscribe) don't apply to messages delivered by area.
+'''
+
+from math import floor
+
+from . import Layer, Message
+
+class InRange:
+    '''
+        Area: the layers within radius of (x, y).
+    '''
+    __slots__ = ('x', 'y', 'radius')
+
+    def __init__(self, x, y, radius):
+        self.x = x
+        self.y = y
+        self.radius = radius
+
+    def Query(self, index, accept):
+        return index.InRange(self.x, self.y, self.radius, accept)
+
+class Nearest:
+    '''
+        Area: the count layers nearest to (x, y), closest first, ignoring any further than maxRadius (if given).
+    '''
+    __slots__ = ('x', 'y', 'count', 'maxRadius')
+
+    def __init__(self, x, y, count=1, maxRadius=None):
+        self.x = x
+        self.y = y
+        self.count = count
+        self.maxRadius = maxRadius
+
+    def Query(self, index, accept):
+        return index.Nearest(self.x, self.y, self.count, self.maxRadius, accept)
+
+# Map message type id -> function returning the area of a message of that type from its data (see SetAreaKey).
+_areaKeys = {}
+
+def SetAreaKey(type, key):
+    '''
+        Deliver messages of a type by area: key(data) returns the area (an InRange, a Nearest or None).
+            Pass None to deliver them as usual again.
+    '''
+    if key is None:
+        _areaKeys.pop(Message.TypeId(type), None)
+    else:
+        _areaKeys[Message.TypeId(type)] = key
+
+def GetArea(message):
+    '''
+        Return the area a message is delivered to, or None if it isn't delivered by area.
+    '''
+    key = _areaKeys.get(message.GetTypeId())
+    return None if key is None else key(message.GetData())
+
+class GridIndex:
+    '''
+        Grid hash of layer positions: map cell -> the layers in it, as ordered sets.
+    '''
+    __slots__ = ('cellSize', 'cells', 'positions')
+
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = {}
+
+        # Map layer -> (x, y).
+        self.positions = {}
+
+    def Cell(self, x, y):
+        return (floor(x / self.cellSize), floor(y / self.cellSize))
+
+    def Move(self, layer, x, y):
+        '''
+            Put layer at (x, y), adding it if it isn't indexed yet.
+        '''
+        old = self.positions.get(layer)
+        self.positions[layer] = (x, y)
+        cell = self.Cell(x, y)
+        if old is not None:
+            oldCell = self.Cell(*old)
+            if oldCell == cell:
+                return
+            self.Discard(layer, oldCell)
+
+        layers = self.cells.get(cell)
+        if layers is None:
+            layers = self.cells[cell] = {}
+        layers[layer] = None
+
+    def Remove(self, layer):
+        position = self.positions.pop(layer, None)
+        if position is not None:
+            self.Discard(layer, self.Cell(*position))
+
+    def Replace(self, old, new):
+        '''
+            Put new at old's position, in old's place.
+        '''
+        position = self.positions.pop(old, None)
+        if position is not None:
+            self.positions[new] = position
+            cell = self.Cell(*position)
+            self.cells[cell] = {(new if layer is old else layer): None for layer in self.cells[cell]}
+
+    def Discard(self, layer, cell):
+        layers = self.cells[cell]
+        del layers[layer]
+        if not layers:
+            del self.cells[cell]
+
+    def InRange(self, x, y, radius, accept=None):
+        '''
+            Return the layers within radius of (x, y) for which accept(layer) is true (all of them if accept is None).
+        '''
+        (minX, minY), (maxX, maxY) = self.Cell(x - radius, y - radius), self.Cell(x + radius, y + radius)
+        if (maxX - minX + 1) * (maxY - minY + 1) > len(self.cells):
+            # Fewer occupied cells than cells in range: go through those instead.
+            cells = [layers for (cx, cy), layers in self.cells.items() if minX <= cx <= maxX and minY <= cy <= maxY]
+        else:
+            cells = [layers for layers in (self.cells.get((cx, cy)) for cx in range(minX, maxX + 1) for cy in range(minY, maxY + 1)) if layers]
+
+        r2 = radius * radius
+        positions = self.positions
+        found = []
+        for layers in cells:
+            for layer in layers:
+                px, py = positions[layer]
+                if (px - x) ** 2 + (py - y) ** 2 <= r2 and (accept is None or accept(layer)):
+                    found.append(layer)
+        return found
+
+    def Nearest(self, x, y, count=1, maxRadius=None, accept=None):
+        '''
+            Return up to count layers nearest to (x, y), closest first, for which accept(layer) is true,
+                ignoring any further than maxRadius. Searches rings of cells outward from (x, y)'s cell,
+                until the layers found are nearer than anything in the rings left.
+        '''
+        if count <= 0 or not self.positions:
+            return []
+
+        cx, cy = self.Cell(x, y)
+        positions = self.positions
+        limit = None if maxRadius is None else maxRadius * maxRadius
+        candidates = []
+        order = 0
+        seen = 0
+        ring = 0
+        while True:
+            if ring == 0:
+                ringCells = [(cx, cy)]
+            elif 8 * ring > len(self.cells):
+                # The rings have more cells than are occupied: go through the rest of the occupied cells instead.
+                ringCells = [cell for cell in self.cells if max(abs(cell[0] - cx), abs(cell[1] - cy)) >= ring]
+                ring = None
+            else:
+                ringCells = [(cx + dx, cy + d) for dx in range(-ring, ring + 1) for d in (-ring, ring)]
+                ringCells += [(cx + d, cy + dy) for d in (-ring, ring) for dy in range(-ring + 1, ring)]
+
+            for cell in ringCells:
+                layers = self.cells.get(cell)
+                if not layers:
+                    continue
+                seen += len(layers)
+                for layer in layers:
+                    px, py = positions[layer]
+                    d2 = (px - x) ** 2 + (py - y) ** 2
+                    if (limit is None or d2 <= limit) and (accept is None or accept(layer)):
+                        candidates.append((d2, order, layer))
+                        order += 1
+
+            candidates.sort()
+            del candidates[count:]
+            if ring is None or seen == len(positions):
+                break
+
+            # Anything in a further ring is at least ring cells away from (x, y).
+            bound = ring * self.cellSize
+            if len(candidates) == count and candidates[-1][0] <= bound * bound:
+                break
+            if limit is not None and bound * bound > limit:
+                break
+            ring += 1
+
+        return [layer for _d2, _i, layer in candidates]
+
+class SpatialLayer(Layer.Layer):
+    '''
+        Layer with an optional position, indexing the positions of its sub-layers (see the module docstring).
+            The position is kept in snapshots: subclasses with state of their own should include
+            super().SnapshotState() in theirs, and pass it back to super().RestoreState(...).
+    '''
+    __slots__ = ('position', 'spatialIndex')
+
+    # Side of the grid cells the sub-layers' positions are bucketed into: about the radius of a typical query.
+    cellSize = 16
+
+    def __init__(self):
+        super().__init__()
+
+        # (x, y), or None if the layer has no position.
+        self.position = None
+
+        # GridIndex of the positioned sub-layers, created when the first one joins.
+        self.spatialIndex = None
+
+    def GetPosition(self):
+        return self.position
+
+    def SetPosition(self, x, y):
+        '''
+            Move this layer to (x, y), updating its parents' indexes.
+        '''
+        self.position = (x, y)
+        if not self.bDirty:
+            self.MarkDirty()
+        for parent in self.parents:
+            if isinstance(parent, SpatialLayer):
+                parent.IndexSubLayer(self)
+
+    def ClearPosition(self):
+        self.position = None
+        if not self.bDirty:
+            self.MarkDirty()
+        for parent in self.parents:
+            if isinstance(parent, SpatialLayer) and parent.spatialIndex is not None:
+                parent.spatialIndex.Remove(self)
+
+    def IndexSubLayer(self, subLayer):
+        if self.spatialIndex is None:
+            self.spatialIndex = GridIndex(self.cellSize)
+        self.spatialIndex.Move(subLayer, *subLayer.position)
+
+    def AddParent(self, parentLayer):
+        super().AddParent(parentLayer)
+        if self.position is not None and isinstance(parentLayer, SpatialLayer):
+            parentLayer.IndexSubLayer(self)
+
+    def UnregisterSubLayer(self, subLayer):
+        if not super().UnregisterSubLayer(subLayer):
+            return False
+        if self.spatialIndex is not None:
+            self.spatialIndex.Remove(subLayer)
+        return True
+
+    def ReplaceSubLayer(self, old, new):
+        super().ReplaceSubLayer(old, new)
+        if self.spatialIndex is not None:
+            self.spatialIndex.Replace(old, new)
+
+    def InRange(self, x, y, radius):
+        '''
+            Return the sub-layers within radius of (x, y).
+        '''
+        return self.spatialIndex.InRange(x, y, radius) if self.spatialIndex is not None else []
+
+    def Nearest(self, x, y, count=1, maxRadius=None):
+        '''
+            Return up to count sub-layers nearest to (x, y), closest first.
+        '''
+        return self.spatialIndex.Nearest(x, y, count, maxRadius) if self.spatialIndex is not None else []
+
+    def SnapshotState(self):
+        return self.position
+
+    def RestoreState(self, state):
+        if state is not None:
+            self.SetPosition(*state)
+
+    def GetLowerTargets(self, message):
+        # Messages delivered by area only go to the registered sub-layers in it.
+        area = GetArea(message) if _areaKeys else None
+        if area is None:
+            return super().GetLowerTargets(message)
+
+        registered = self.registrations.get(message.GetTypeId())
+        if not registered or self.spatialIndex is None:
+            return ()
+        return area.Query(self.spatialIndex, registered.__contains__)
@@ -0,0 +1,194 @@
+'''
+    Content-based subscriptions: a layer can handle a message type for some topics only (see Layer.Subscribe),
+        and broadcasts of that type then skip the parts of the tree that don't want their topic.
+
+    A message's topic comes from its data (see Message.SetTopicKey), e.g. a region or an entity id.
+    Each layer keeps a TopicFilter per message type that it or a layer below it filters: which topics its own handler wants,
+        and which sub-layers want which topics. A layer wants a topic if its handler or any layer below it does,
+        so a broadcast copied down the tree only goes to sub-layers that want its topic (or want every topic),
+        and is pruned at each hop rather than at the leaves.
+    Changes travel up as deltas (topics gained and lost), so subscribing costs one step per ancestor, not a rescan.
+
+    Predicates can't be indexed: a layer with one wants every topic as far as its parents are concerned,
+        and the predicate is checked against each message before its own handler runs.
+'''
+
+from itertools import chain
+
+from . import Message
+
+class Subscription:
+    '''
+        What one layer's own handler for one message type wants: topics (None for all of them) and a predicate (or None).
+    '''
+    __slots__ = ('topics', 'predicate')
+
+    def __init__(self, topics=None, predicate=None):
+        self.topics = None if topics is None else frozenset(topics)
+        self.predicate = predicate
+
+    def Accepts(self, message):
+        if self.topics is not None and message.GetTopic() not in self.topics:
+            return False
+        return self.predicate is None or self.predicate(message)
+
+class TopicFilter:
+    '''
+        The topics of one message type that a layer and each of its sub-layers registered for the type want.
+            Every registered sub-layer is either unfiltered (wants every topic) or has a set of topics.
+
+        Changes are given and returned as (bAll, added, removed): bAll if every topic is now wanted;
+            otherwise the topics gained and lost, where added holds them all if every topic was wanted before.
+    '''
+    __slots__ = ('ownTopics', 'unfiltered', 'byTopic', 'subTopics')
+
+    def __init__(self, ownTopics, subLayers):
+        # Topics the layer's own handler wants: None for every topic, empty if it has no handler for the type.
+        self.ownTopics = ownTopics
+
+        # Sub-layers wanting every topic, as an ordered set.
+        self.unfiltered = dict.fromkeys(subLayers)
+
+        # Map topic -> sub-layers wanting it, and sub-layer -> its topics, for the others.
+        self.byTopic = {}
+        self.subTopics = {}
+
+    def IsAll(self):
+        return self.ownTopics is None or bool(self.unfiltered)
+
+    def IsRedundant(self):
+        '''
+            True if the filter tells nothing apart: every sub-layer, and the layer itself if it has a handler, wants every topic.
+        '''
+        return not self.subTopics and (self.ownTopics is None or (not self.ownTopics and bool(self.unfiltered)))
+
+    def Topics(self):
+        return frozenset(self.byTopic).union(self.ownTopics)
+
+    def Targets(self, topic):
+        '''
+            Return the sub-layers wanting topic: the unfiltered ones, then those that subscribed to it.
+        '''
+        subLayers = self.byTopic.get(topic)
+        return chain(self.unfiltered, subLayers) if subLayers else self.unfiltered
+
+    def Update(self, subLayer, bAll, added=(), removed=()):
+        '''
+            Apply a change in what subLayer wants, and return the resulting change in what the layer wants, or None.
+        '''
+        bWasAll = self.IsAll()
+        own = self.ownTopics or ()
+        gained = []
+        lost = []
+
+        if bAll:
+            if subLayer in self.unfiltered:
+                return None
+            for topic in self.subTopics.pop(subLayer, ()):
+                if self.Drop(subLayer, topic) and topic not in own:
+                    lost.append(topic)
+            self.unfiltered[subLayer] = None
+
+        else:
+            self.unfiltered.pop(subLayer, None)
+            topics = self.subTopics.get(subLayer)
+            if topics is None:
+                topics = self.subTopics[subLayer] = set()
+
+            for topic in removed:
+                if topic in topics:
+                    topics.discard(topic)
+                    if self.Drop(subLayer, topic) and topic not in own:
+                        lost.append(topic)
+
+            for topic in added:
+                if topic not in topics:
+                    topics.add(topic)
+                    subLayers = self.byTopic.get(topic)
+                    if subLayers is None:
+                        subLayers = self.byTopic[topic] = {}
+                        if topic not in own:
+                            gained.append(topic)
+                    subLayers[subLayer] = None
+
+        return self.Change(bWasAll, gained, lost)
+
+    def Remove(self, subLayer):
+        '''
+            Forget subLayer (it was unregistered). Return the resulting change in what the layer wants, or None.
+        '''
+        bWasAll = self.IsAll()
+        own = self.ownTopics or ()
+        self.unfiltered.pop(subLayer, None)
+        lost = [topic for topic in self.subTopics.pop(subLayer, ()) if self.Drop(subLayer, topic) and topic not in own]
+        return self.Change(bWasAll, [], lost)
+
+    def Replace(self, old, new):
+        '''
+            Put new in old's place, wanting the same topics.
+        '''
+        if old in self.unfiltered:
+            self.unfiltered = {(new if layer is old else layer): None for layer in self.unfiltered}
+
+        topics = self.subTopics.pop(old, None)
+        if topics is not None:
+            self.subTopics[new] = topics
+            for topic in topics:
+                self.byTopic[topic] = {(new if layer is old else layer): None for layer in self.byTopic[topic]}
+
+    def SetOwn(self, ownTopics):
+        '''
+            Change the topics the layer's own handler wants. Return the resulting change in what the layer wants, or None.
+        '''
+        bWasAll = self.IsAll()
+        old = self.ownTopics or ()
+        self.ownTopics = ownTopics
+
+        new = ownTopics or ()
+        gained = [topic for topic in new if topic not in old and topic not in self.byTopic]
+        lost = [topic for topic in old if topic not in new and topic not in self.byTopic]
+        return self.Change(bWasAll, gained, lost)
+
+    def Change(self, bWasAll, gained, lost):
+        if self.IsAll():
+            return None if bWasAll else (True, (), ())
+        if bWasAll:
+            return (False, self.Topics(), ())
+        return (False, gained, lost) if gained or lost else None
+
+    def Drop(self, subLayer, topic):
+        '''
+            Remove subLayer from topic's sub-layers. Return True if none are left.
+        '''
+        subLayers = self.byTopic[topic]
+        del subLayers[subLayer]
+        if subLayers:
+            return False
+        del self.byTopic[topic]
+        return True
+
+class Subscriptions:
+    '''
+        A layer's subscriptions, created the first time it needs one (see Layer.Subscribe).
+    '''
+    __slots__ = ('own', 'filters')
+
+    def __init__(self):
+        # Map message type id -> Subscription for the layer's own handler.
+        self.own = {}
+
+        # Map message type id -> TopicFilter, for types filtered here or below.
+        self.filters = {}
+
+    def __getstate__(self):
+        # Keyed by type name when pickled (see Message.ByTypeName).
+        return Message.ByTypeName(self.own), Message.ByTypeName(self.filters)
+
+    def __setstate__(self, state):
+        own, filters = state
+        self.own = Message.ByTypeId(own)
+        self.filters = Message.ByTypeId(filters)
+
+    def Accepts(self, message):
+        subscription = self.own.get(message.GetTypeId())
+        return subscription is None or subscription.Accepts(message)
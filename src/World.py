@@ -0,0 +1,173 @@
+'''
+    Optional engine that drives a whole Layer tree from a single timestamp-ordered queue.
+
+    Without a World, every Layer keeps its own Scheduler, and advancing time means posting notifications up
+        through every ancestor and then walking back down the tree in Process(ts).
+    Once a tree is attached to a World, messages that reach their destination layer are queued here as
+        (ts, layer, message) entries and dispatched straight to that layer, so no notifications are generated.
+    Handling and propagation (see Layer.DispatchMessage) behave the same way in both modes.
+
+    Each queued entry is a [layer, message] list. Cancelling (see Handle) clears the message in place,
+        and the entry is skipped when it comes up; the queue is compacted once cancelled entries make up most of it.
+
+    The World is the Clock for its tree: use Step/RunUntil/RunFor on it (rather than on the root layer)
+        to advance virtual time, and set its latePolicy to control past-due events.
+'''
+
+from . import Clock, Message, SchedulingList
+from .Log import Log
+
+class World(Clock.Clock):
+    def __init__(self, root=None, backend=None):
+        # Priority queue of (ts, (layer, message)) entries; see SchedulingList for the backends.
+        # The World holds every pending message, so a WheelBackend pays off here for dense integer ticks.
+        self.events = backend if backend is not None else SchedulingList.HeapBackend()
+
+        # Number of cancelled entries still in the queue.
+        self.cancelled = 0
+
+        self.root = None
+        if root is not None:
+            self.SetRoot(root)
+
+    def SetRoot(self, root):
+        self.root = root
+        self.Attach(root)
+
+    def Attach(self, layer):
+        '''
+            Attach layer and every layer below it to this World.
+                Messages already waiting in their schedulers are moved into the World's queue.
+                Layers registered to an attached layer later on are attached automatically.
+        '''
+        stack = [layer]
+        while stack:
+            layer = stack.pop()
+            if layer.world is self:
+                continue
+
+            layer.world = self
+            layer.notifications.clear()
+            if Log.bDebug:
+                Log.debug('World attached Layer %s', layer)
+
+            s = layer.scheduler.Pop()
+            while s:
+                ts, q = s
+                while q:
+                    m = q.pop()
+                    # Notifications only exist to walk the tree, which the World makes unnecessary.
+                    if m.GetTypeId() != Message.TYPEID_NOTIFICATION:
+                        self.Add(ts, layer, m)
+                s = layer.scheduler.Pop()
+
+            stack.extend(layer.GetSubLayers())
+
+    def Add(self, ts, layer, message):
+        '''
+            Queue message for dispatch to layer at time ts. Return the queue entry (see Cancel).
+        '''
+        entry = [layer, message]
+        self.events.Push(ts, entry)
+        return entry
+
+    def AddMany(self, entries):
+        '''
+            Queue an iterable of (ts, layer, message) entries, in bulk where the backend supports it.
+        '''
+        self.events.PushMany((ts, [layer, message]) for ts, layer, message in entries)
+
+    def Cancel(self, entry):
+        '''
+            Cancel a queued entry returned by Add. Return True if it was still pending.
+        '''
+        if entry[1] is None:
+            return False
+
+        entry[1] = None
+        self.cancelled += 1
+        if self.cancelled > 32 and self.cancelled * 2 > len(self.events):
+            self.Compact()
+        return True
+
+    def Compact(self):
+        '''
+            Rebuild the queue without the cancelled entries.
+        '''
+        live = []
+        e = self.events.Pop()
+        while e:
+            if e[1][1] is not None:
+                live.append(e)
+            e = self.events.Pop()
+
+        self.events.PushMany(live)
+        self.cancelled = 0
+
+    def Peek(self):
+        '''
+            Return the next live (ts, [layer, message]) entry, dropping cancelled ones from the front, or None.
+        '''
+        events = self.events
+        e = events.Peek()
+        if self.cancelled:
+            while e and e[1][1] is None:
+                events.Pop()
+                self.cancelled -= 1
+                e = events.Peek()
+        return e
+
+    def NextTs(self):
+        '''
+            Return the timestamp of the next queued message, or None if nothing is queued.
+        '''
+        e = self.Peek()
+        return e[0] if e else None
+
+    def Process(self, ts):
+        '''
+            Dispatch every message queued for time ts, including ones queued for ts while processing.
+                Messages queued before ts are dealt with first, according to the late policy.
+                Return the number of messages dispatched at ts, or None if nothing is queued at ts.
+        '''
+        events = self.events
+        e = self.Peek()
+        while e and e[0] < ts:
+            self.ProcessLate(e[0])
+            e = self.Peek()
+
+        if not e or e[0] != ts:
+            return None
+
+        count = 0
+        while e and e[0] == ts:
+            events.Pop()
+            entry = e[1]
+            layer, message = entry
+            if message is None:
+                self.cancelled -= 1
+            else:
+                # Mark the entry as done so its handle can't cancel it any more.
+                entry[1] = None
+                layer.DispatchMessage(ts, message)
+                count += 1
+            e = events.Peek()
+
+        return count
+
+    def Discard(self, ts):
+        '''
+            Drop every message queued for time ts without dispatching it.
+        '''
+        events = self.events
+        e = events.Peek()
+        while e and e[0] == ts:
+            events.Pop()
+            if e[1][1] is None:
+                self.cancelled -= 1
+            else:
+                e[1][1] = None
+            e = events.Peek()
+
+    def __str__(self):
+        return f'World({self.root})'
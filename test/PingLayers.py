@@ -0,0 +1,66 @@
+# Shared fixture for the tests that run a small tree of planets and leaves pinging each other,
+# locally and split across processes (test_Shards, test_Remote, test_Pager, test_Metrics).
+
+from src import Layer, Message
+
+class PingLayer(Layer.Layer):
+    # Handlers are instance methods, so they pickle into worker processes, and the layer records into itself,
+    # keeping its log as snapshot state so it survives paging and comes back from remote hosts.
+    def __init__(self):
+        super().__init__()
+        self.handlers['PING'] = self.OnPing
+        self.handlers['UP'] = self.OnUp
+        self.handlers['FAIL'] = self.OnFail
+        self.log = []
+
+    def OnPing(self, message):
+        # data is (hops left, id to ping back), or None for a PING that just lands.
+        if message.GetData() is None:
+            return
+
+        hops, target = message.GetData()
+        self.log.append((self.GetNow(), hops))
+        if hops:
+            self.ScheduleMessageFor(self.GetNow() + 1, Message.Message('PING', dest=target, data=(hops - 1, self.id)))
+
+    def OnUp(self, message):
+        self.log.append((self.GetNow(), 'up'))
+
+    def OnFail(self, message):
+        raise RuntimeError('failed on purpose')
+
+    def SnapshotState(self):
+        return self.log
+
+    def RestoreState(self, state):
+        self.log = state
+
+def BuildPlanet(id, leaves=2):
+    # A planet with its final id, and its leaves (id.0, id.1, ...).
+    planet = PingLayer()
+    planet.SetId(id)
+    planet.RegisterSubLayers([PingLayer() for _ in range(leaves)])
+    return planet
+
+def BuildTree(planets, leaves=2):
+    # top(0) with planets under it: a number of new ones (0.0, 0.1, ...), each with leaves, or a list of layers.
+    top = PingLayer()
+    top.SetId('0')
+    if isinstance(planets, int):
+        planets = [PingLayer() for _ in range(planets)]
+        top.RegisterSubLayers(planets)
+        for planet in planets:
+            planet.RegisterSubLayers([PingLayer() for _ in range(leaves)])
+    else:
+        top.RegisterSubLayers(planets)
+    return top
+
+def Logs(top):
+    # Map layer id -> log, for every layer in the tree.
+    logs = {}
+    stack = [top]
+    while stack:
+        layer = stack.pop()
+        logs[layer.id] = layer.log
+        stack.extend(layer.GetSubLayers())
+    return logs
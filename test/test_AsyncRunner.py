@@ -0,0 +1,114 @@
+# From the main directory, call 'python -m pytest -v test\test_AsyncRunner.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import asyncio
+
+from src import AsyncRunner, Layer, Message
+
+class _EchoClient(AsyncRunner.AsyncClient):
+    def __init__(self):
+        super().__init__()
+        self.handlers['ECHO'] = self.Deliver
+
+    def ParseInput(self, text):
+        return Message.Message('SHOUT', dest='0', data=text.strip())
+
+    def FormatOutput(self, message):
+        return f'{message.GetData()}\n'
+
+class _Server(Layer.Layer):
+    # Answers each SHOUT with an ECHO back to the client that sent it.
+    def __init__(self):
+        super().__init__()
+        self.handlers['SHOUT'] = self.HandleShout
+        self.times = []
+
+    def HandleShout(self, message):
+        self.times.append(self.GetNow())
+        echo = Message.Message('ECHO', dest=message.GetSrc(), data=message.GetData().upper())
+        self.ScheduleMessageFor(self.GetNow(), echo)
+
+class _Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+def _BuildTree(clients):
+    top = _Server()
+    top.SetId('0')
+    for client in clients:
+        top.RegisterSubLayer(client)
+    return top
+
+class TestClass():
+
+    def test_Input_Handled_Immediately(self):
+        async def Run():
+            client = _EchoClient()
+            top = _BuildTree([client])
+            top.ScheduleMessage(1000, Message.Message('SHOUT', dest='0', data='later'))
+
+            # A whole tick lasts an hour, so only immediate scheduling can answer in time.
+            runner = AsyncRunner.AsyncRunner(top, tickSeconds=3600)
+            task = asyncio.create_task(runner.Run())
+            await asyncio.sleep(0)
+
+            runner.Submit(client, Message.Message('SHOUT', dest='0', src=client.GetId(), data='now'))
+            echo = await asyncio.wait_for(client.Receive(), 1)
+
+            runner.Stop()
+            await task
+            return echo.GetData(), top.times
+
+        assert(asyncio.run(Run()) == ('NOW', [0]))
+
+    def test_Run_Until(self):
+        async def Run():
+            client = _EchoClient()
+            top = _BuildTree([client])
+            for ts in [1, 5, 12]:
+                top.ScheduleMessage(ts, Message.Message('SHOUT', dest='0', src=client.GetId(), data=str(ts)))
+
+            runner = AsyncRunner.AsyncRunner(top)
+            steps = await runner.Run(until=10)
+            return steps, top.now, [client.toUser.get_nowait().GetData() for _ in range(client.toUser.qsize())]
+
+        assert(asyncio.run(Run()) == (2, 10, ['1', '5']))
+
+    def test_Many_Clients(self):
+        async def Run():
+            clients = [_EchoClient() for _ in range(2000)]
+            top = _BuildTree(clients)
+            runner = AsyncRunner.AsyncRunner(top, tickSeconds=3600)
+            task = asyncio.create_task(runner.Run())
+
+            readers = []
+            writers = []
+            pumps = []
+            for i, client in enumerate(clients):
+                readers.append(asyncio.StreamReader())
+                readers[-1].feed_data(f'hello {i}\n'.encode())
+                writers.append(_Writer())
+                pumps.append(asyncio.create_task(client.Pump(runner, readers[-1], writers[-1])))
+
+            async def AllAnswered():
+                while not all(writer.data for writer in writers):
+                    await asyncio.sleep(0.001)
+            await asyncio.wait_for(AllAnswered(), 10)
+
+            # Disconnect everyone.
+            for reader in readers:
+                reader.feed_eof()
+            await asyncio.gather(*pumps)
+
+            runner.Stop()
+            await task
+            return [writer.data for writer in writers]
+
+        outputs = asyncio.run(Run())
+        assert(outputs == [f'HELLO {i}\n'.encode() for i in range(2000)])
@@ -0,0 +1,138 @@
+# From the main directory, call 'python -m pytest -v test\test_Entities.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import io
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from src import Entities, Layer, Message, Snapshot
+
+class _Citizens(Entities.EntityLayer):
+    # Records each batch handler call in calls (shared), as (type, slots).
+    calls = []
+
+    columnTypes = {
+        'wealth': 'f8',
+        'age': 'i4',
+    }
+
+    batchHandlers = {
+        'TAX': 'HandleTax',
+        'BIRTHDAY': 'HandleBirthday',
+    }
+
+    def HandleTax(self, indices, messages):
+        _Citizens.calls.append(('TAX', indices.tolist()))
+        self.columns['wealth'][indices] -= np.fromiter((m.GetData() for m in messages), float, len(messages))
+
+    def HandleBirthday(self, indices, messages):
+        _Citizens.calls.append(('BIRTHDAY', indices.tolist()))
+        self.columns['age'][indices] += 1
+
+        # The oldest are taxed a year later.
+        old = indices[self.columns['age'][indices] >= 65]
+        self.ScheduleMany((self.GetNow() + 1, Message.Message('TAX', dest=self.GetEntityId(i), data=1.0)) for i in old)
+
+class _Mayor(Layer.Layer):
+    calls = []
+
+    messageHandlers = {
+        'BIRTHDAY': 'HandleBirthday',
+    }
+
+    def HandleBirthday(self, message):
+        _Mayor.calls.append(self.id)
+
+class TestEntityLayer():
+
+    def setup_method(self):
+        _Citizens.calls = []
+        _Mayor.calls = []
+
+        #      city(0)
+        #     /      \
+        # mayor(0.0)  citizens(0.1), 1000 entities: 0.1.0, 0.1.1, ...
+        self.city = Layer.Layer()
+        self.city.SetId('0')
+        self.mayor = _Mayor()
+        self.citizens = _Citizens()
+        self.city.RegisterSubLayers([self.mayor, self.citizens])
+        self.citizens.Spawn(1000, wealth=100.0, age=np.arange(1000) % 70)
+
+    def test_Addressed(self):
+        assert(self.city.FindLayer('0.1.17') is self.citizens)
+
+        self.city.ScheduleMessage(1, Message.Message('TAX', dest='0.1.3', data=10.0))
+        self.mayor.ScheduleMessageFor(1, Message.Message('TAX', dest='0.1.5', data=20.0))
+        self.city.ScheduleMany([(1, Message.Message('TAX', dest=f'0.1.{i}', data=1.0)) for i in range(10, 20)])
+        self.city.ScheduleMessage(1, Message.Message('TAX', dest='0.1.5000', data=1.0))
+        self.city.RunUntil(1)
+
+        # One call for every addressed entity that exists.
+        assert(len(_Citizens.calls) == 1)
+        assert(sorted(_Citizens.calls[0][1]) == [3, 5] + list(range(10, 20)))
+        wealth = self.citizens.columns['wealth']
+        assert(wealth[3] == 90.0 and wealth[5] == 80.0 and wealth[12] == 99.0 and wealth[4] == 100.0)
+
+    def test_Broadcast(self):
+        self.city.ScheduleMessage(1, Message.Message('BIRTHDAY', dest='0', prop=Message.PROP_ALL))
+        self.city.RunUntil(2)
+
+        assert(_Mayor.calls == ['0.0'])
+        assert(_Citizens.calls[0] == ('BIRTHDAY', list(range(1000))))
+        assert(self.citizens.columns['age'][:3].tolist() == [1, 2, 3])
+
+        # The ones 65 and over were taxed the tick after, in one call.
+        assert(_Citizens.calls[1] == ('TAX', [i for i in range(1000) if i % 70 >= 64]))
+        assert(self.citizens.columns['wealth'][64] == 99.0)
+
+    def test_Propagates_Up(self):
+        # top(0, a _Mayor) with citizens(0.0): messages from an entity go up through its layer like any other's.
+        top = _Mayor()
+        top.SetId('0')
+        citizens = _Citizens()
+        top.RegisterSubLayer(citizens)
+        citizens.Spawn(3)
+
+        top.ScheduleMessage(1, Message.Message('BIRTHDAY', dest='0.0.1', prop=Message.PROP_GTE))
+        top.RunUntil(1)
+        assert(_Citizens.calls == [('BIRTHDAY', [1])])
+        assert(_Mayor.calls == ['0'])
+
+        # Sub-ids are ASCII digits only.
+        assert(citizens.GetEntityIndex('0.0.2') == 2)
+        assert(citizens.GetEntityIndex('0.0.\u00b2') is None)
+        assert(citizens.GetEntityIndex('0.0.\u0662') is None)
+
+    def test_Spawn_Kill(self):
+        self.citizens.Kill([3, 4, 4, 5000])
+        assert(self.citizens.GetEntityCount() == 998)
+
+        self.city.ScheduleMessage(1, Message.Message('TAX', dest='0.1.3', data=1.0))
+        self.city.ScheduleMessage(1, Message.Message('TAX', dest='0.1.6', data=1.0))
+        self.city.RunUntil(1)
+        assert(_Citizens.calls == [('TAX', [6])])
+
+        # Dead slots are reused, then the columns grow.
+        indices = self.citizens.Spawn(3, wealth=5.0)
+        assert(sorted(indices.tolist()) == [3, 4, 1000])
+        assert(self.citizens.columns['wealth'][indices].tolist() == [5.0] * 3)
+        assert(self.citizens.columns['age'][indices].tolist() == [0] * 3)
+        assert(len(self.citizens.GetIndices()) == 1001)
+
+    def test_Snapshot(self):
+        self.citizens.Kill(7)
+        self.city.ScheduleMessage(3, Message.Message('TAX', dest='0.1.8', data=50.0))
+
+        f = io.BytesIO()
+        Snapshot.Save(self.city, f)
+        f.seek(0)
+        city = Snapshot.Load(f)
+        citizens = city.FindLayer('0.1')
+
+        assert(citizens.GetEntityCount() == 999)
+        assert(citizens.columns['age'][:10].tolist() == list(range(10)))
+        city.RunUntil(3)
+        assert(citizens.columns['wealth'][8] == 50.0)
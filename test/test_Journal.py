@@ -0,0 +1,144 @@
+# From the main directory, call 'python -m pytest -v test\test_Journal.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import io
+
+import pytest
+
+from src import Journal as JournalModule
+from src import Layer, Message
+from src.Journal import Journal
+
+class _EchoLayer(Layer.Layer):
+    # Records every handled message in calls (shared); ECHO keeps scheduling itself and broadcasting PINGs.
+    calls = []
+
+    messageHandlers = {
+        'ECHO': 'HandleEcho',
+        'PING': 'HandlePing',
+    }
+
+    def HandleEcho(self, message):
+        _EchoLayer.calls.append((self.id, 'ECHO', self.GetNow(), message.GetData()))
+        if message.GetData() > 0:
+            self.ScheduleMessage(self.GetNow() + 1, Message.Message('ECHO', dest=self.id, data=message.GetData() - 1))
+            self.ScheduleMessage(self.GetNow() + 1, Message.Message('PING', dest=self.id, prop=Message.PROP_LTE))
+
+    def HandlePing(self, message):
+        _EchoLayer.calls.append((self.id, 'PING', self.GetNow(), None))
+
+def _BuildTree(cls=_EchoLayer):
+    #      top(0)
+    #     /      \
+    #   a(0.0)  b(0.1)
+    #    |
+    #   c(0.0.0)
+    top = cls()
+    top.SetId('0')
+    a, b, c = cls(), cls(), cls()
+    top.RegisterSubLayer(a)
+    top.RegisterSubLayer(b)
+    a.RegisterSubLayer(c)
+    return top
+
+def _Drive(top):
+    # Inputs of every kind, from outside the engine.
+    top.ScheduleMessage(1, Message.Message('ECHO', dest='0.0', data=3))
+    top.ScheduleMany([(2, Message.Message('ECHO', dest='0.1', data=2)), (9, Message.Message('ECHO', dest='0.0.0', data=1))])
+    top.FindLayer('0.0.0').AddMessage(4, Message.Message('ECHO', dest='0.0.0', data=0))
+    top.RunUntil(3)
+    top.Discard(4)
+    top.RunUntil(20)
+
+def _Record(bCompress=True, bufferSize=1 << 16):
+    _EchoLayer.calls = []
+    f = io.BytesIO()
+    Journal.Start(f, bCompress=bCompress, bufferSize=bufferSize)
+    try:
+        _Drive(_BuildTree())
+    finally:
+        Journal.Stop()
+    return f.getvalue(), _EchoLayer.calls
+
+class TestJournal():
+
+    def teardown_method(self):
+        Journal.Stop()
+
+    @pytest.mark.parametrize('bCompress', [True, False])
+    def test_Replay(self, bCompress):
+        data, recorded = _Record(bCompress, bufferSize=16)
+        assert(len(recorded) > 10)
+
+        entries = list(JournalModule.Read(io.BytesIO(data)))
+        kinds = [kind for kind, _layerId, _ts, _value in entries]
+        # Only the inputs made from outside are recorded, not what the handlers scheduled.
+        assert([kind for kind in kinds if kind != JournalModule.KIND_HANDLED] == ['s', 'm', 'a', 'p', 'p', 'p', 'd', 'p', 'p'])
+        assert(kinds.count(JournalModule.KIND_HANDLED) == len(recorded))
+
+        _EchoLayer.calls = []
+        result = JournalModule.Replay(io.BytesIO(data), _BuildTree(), bVerify=True)
+        assert(result.inputs == 9)
+        assert(result.mismatch is None)
+        assert(_EchoLayer.calls == recorded)
+        assert(not Journal.bEnabled)
+
+    def test_Replay_Cancels(self):
+        def Drive(top):
+            # Cancelled and rescheduled handles are inputs too.
+            top.ScheduleMessage(2, Message.Message('ECHO', dest='0.1', data=0))
+            handle = top.ScheduleMessage(2, Message.Message('ECHO', dest='0.0', data=0))
+            top.ScheduleMessage(2, Message.Message('ECHO', dest='0.0', data=1)).Cancel()
+            top.ScheduleMessage(3, Message.Message('ECHO', dest='0', data=0)).Reschedule(5)
+            top.RunUntil(1)
+            handle.Cancel()
+            top.RunUntil(10)
+
+        _EchoLayer.calls = []
+        f = io.BytesIO()
+        Journal.Start(f)
+        try:
+            Drive(_BuildTree())
+        finally:
+            Journal.Stop()
+        recorded = _EchoLayer.calls
+        assert(recorded == [('0.1', 'ECHO', 2, 0), ('0', 'ECHO', 5, 0)])
+
+        _EchoLayer.calls = []
+        result = JournalModule.Replay(io.BytesIO(f.getvalue()), _BuildTree(), bVerify=True)
+        assert(result.mismatch is None)
+        assert(_EchoLayer.calls == recorded)
+
+    def test_Compression(self):
+        compressed, _calls = _Record(True)
+        raw, _calls = _Record(False)
+        assert(len(compressed) < len(raw))
+
+    def test_Mismatch(self):
+        data, _calls = _Record()
+
+        class _QuietLayer(_EchoLayer):
+            # Never broadcasts PINGs, so the replayed handler calls differ from the first PING on.
+            def HandleEcho(self, message):
+                if message.GetData() > 0:
+                    self.ScheduleMessage(self.GetNow() + 1, Message.Message('ECHO', dest=self.id, data=message.GetData() - 1))
+
+        result = JournalModule.Replay(io.BytesIO(data), _BuildTree(_QuietLayer), bVerify=True)
+        assert(result.mismatch is not None)
+        assert(result.expected[result.mismatch][1] == 'PING')
+        assert(result.actual[result.mismatch][1] == 'ECHO')
+        assert('differs' in str(result))
+
+    def test_Errors(self):
+        with pytest.raises(JournalModule.JournalError):
+            list(JournalModule.Read(io.BytesIO(b'not a journal')))
+
+        data, _calls = _Record(False)
+        with pytest.raises(JournalModule.JournalError):
+            list(JournalModule.Read(io.BytesIO(data[:-1])))
+
+        Journal.Start(io.BytesIO())
+        with pytest.raises(JournalModule.JournalError):
+            Journal.Start(io.BytesIO())
+        with pytest.raises(JournalModule.JournalError):
+            JournalModule.Replay(io.BytesIO(data), _BuildTree())
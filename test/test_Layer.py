@@ -1,7 +1,11 @@
 # From the main directory, call 'python -m pytest -v test\test_Layer.py to run this single file,
 # or run 'python -m pytest test' to run all tests.
 
-from src import Layer, Message
+import pickle
+
+import pytest
+
+from src import Clock, Layer, Message, Scheduler
 from src.Log import Log
 
 class _TestLayerWithHandler(Layer.Layer):
@@ -104,3 +108,682 @@ class TestClass():
         TestClass.layerA.Process(0)
 
         assert(_TestLayerWithHandler.calls == ['0.0'])
+
+class TestRouting():
+
+    @classmethod
+    def setup_class(cls):
+        # Eleven children so that ids 0.1 and 0.10 both exist.
+        cls.top = _TestLayerWithHandler()
+        cls.top.SetId('0')
+
+        cls.children = [_TestLayerWithHandler() for _ in range(11)]
+        for child in cls.children:
+            cls.top.RegisterSubLayer(child)
+
+    def test_Segment_Aware_Routing(self):
+        top = TestRouting.top
+        assert(top.GetSubLayerToward('0.10') is TestRouting.children[10])
+        assert(top.GetSubLayerToward('0.1') is TestRouting.children[1])
+        assert(top.GetSubLayerToward('0.10.3') is TestRouting.children[10])
+        assert(top.GetSubLayerToward('0') is None)
+        assert(top.GetSubLayerToward('01') is None)
+
+    def test_Schedule_Similar_Ids(self):
+        testMessage = Message.Message(
+            'TEST_MESSAGE_TYPE',
+            dest='0.10',
+            data='TEST_DATA',
+            prop=Message.PROP_EXACT)
+
+        _TestLayerWithHandler.calls = []
+
+        TestRouting.children[0].ScheduleMessageFor(0, testMessage)
+        TestRouting.top.Process(0)
+
+        assert(_TestLayerWithHandler.calls == ['0.10'])
+
+class TestClock():
+
+    def setup_method(self):
+        #   top(0)
+        #    |
+        #    v
+        #   mid(0.0)
+        #    |
+        #    v
+        #   leaf(0.0.0)
+        self.top = _TestLayerWithHandler()
+        self.top.SetId('0')
+        self.mid = _TestLayerWithHandler()
+        self.leaf = _TestLayerWithHandler()
+        self.top.RegisterSubLayer(self.mid)
+        self.mid.RegisterSubLayer(self.leaf)
+
+        _TestLayerWithHandler.calls = []
+
+    def Schedule(self, ts):
+        testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=self.leaf.GetId(), data=ts)
+        self.leaf.ScheduleMessage(ts, testMessage)
+
+    def test_Run_Until(self):
+        for ts in [3, 1, 2, 7]:
+            self.Schedule(ts)
+
+        assert(self.top.Step() == 1)
+        assert(self.top.RunUntil(5) == 2)
+        assert(self.top.GetNow() == 5)
+        assert(self.leaf.GetNow() == 5)
+        assert(self.top.RunFor(5) == 1)
+        assert(self.top.GetNow() == 10)
+        assert(self.top.Step() is None)
+
+        assert(_TestLayerWithHandler.calls == ['0.0.0'] * 4)
+        assert(self.leaf.scheduler.Peek() is None)
+
+    def test_Process_Drains_Stale(self):
+        self.Schedule(1)
+        self.Schedule(2)
+
+        # Processing ts 2 first still handles the events at ts 1, in order.
+        self.top.Process(2)
+        assert(_TestLayerWithHandler.calls == ['0.0.0', '0.0.0'])
+        assert(self.top.scheduler.Peek() is None)
+        assert(self.leaf.scheduler.Peek() is None)
+
+    def test_Late_Drop(self):
+        self.top.latePolicy = Clock.LATE_DROP
+        self.top.RunUntil(5)
+        self.Schedule(3)
+        self.Schedule(6)
+
+        assert(self.top.RunUntil(10) == 2)
+        assert(_TestLayerWithHandler.calls == ['0.0.0'])
+        assert(self.mid.scheduler.Peek() is None)
+        assert(self.leaf.scheduler.Peek() is None)
+
+    def test_Late_Raise(self):
+        self.top.latePolicy = Clock.LATE_RAISE
+        self.top.RunUntil(5)
+        self.Schedule(3)
+
+        with pytest.raises(Clock.PastDueError):
+            self.top.Step()
+
+class _RecordingLayer(Layer.Layer):
+    # Like _TestLayerWithHandler, but never clears the calls, so messages can reach the top layer.
+    calls = []
+
+    def __init__(self):
+        super().__init__()
+        self.handlers['TEST_MESSAGE_TYPE'] = self.TestMessageHandler
+
+    def TestMessageHandler(self, message):
+        _RecordingLayer.calls.append(str(self))
+
+class TestDepth():
+
+    def test_Deep_Chain(self):
+        # Deeper than the default recursion limit allows for nested Process calls.
+        depth = 2000
+
+        layers = [_RecordingLayer()]
+        layers[0].SetId('0')
+        for _ in range(depth):
+            layer = _RecordingLayer()
+            layers[-1].RegisterSubLayer(layer)
+            layers.append(layer)
+
+        _RecordingLayer.calls = []
+
+        testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=layers[-1].GetId())
+        layers[0].ScheduleMessageFor(0, testMessage)
+        layers[0].Process(0)
+        assert(_RecordingLayer.calls == [layers[-1].GetId()])
+
+        # Broadcast back up from the bottom of the chain.
+        _RecordingLayer.calls = []
+        testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=layers[-1].GetId(), prop=Message.PROP_GTE)
+        layers[-2].ScheduleMessageFor(1, testMessage)
+        layers[0].Process(1)
+        assert(len(_RecordingLayer.calls) == depth + 1)
+
+    def test_Recursive_Matches_Iterative(self):
+        orders = []
+        _RecordingLayer.calls = []
+        for bRecursive in [False, True]:
+            top = _RecordingLayer()
+            top.SetId('0')
+            top.bRecursiveProcessing = bRecursive
+
+            subs = [_RecordingLayer() for _ in range(4)]
+            top.RegisterSubLayer(subs[0])
+            top.RegisterSubLayer(subs[1])
+            subs[0].RegisterSubLayer(subs[2])
+            subs[1].RegisterSubLayer(subs[3])
+            subs[2].RegisterSubLayer(subs[3])
+            for sub in subs:
+                sub.bRecursiveProcessing = bRecursive
+
+            testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=subs[2].GetId(), prop=Message.PROP_ALL)
+            top.ScheduleMessageFor(0, testMessage)
+            top.Process(0)
+            orders.append(_RecordingLayer.calls)
+            _RecordingLayer.calls = []
+
+        assert(orders[0] == orders[1])
+
+class TestScheduleMany():
+
+    def test_Schedule_Many(self):
+        #   top(0)
+        #   /    \
+        #  a(0.0) b(0.1)
+        #  |
+        #  c(0.0.0)
+        top = _RecordingLayer()
+        top.SetId('0')
+        a, b, c = _RecordingLayer(), _RecordingLayer(), _RecordingLayer()
+        top.RegisterSubLayer(a)
+        top.RegisterSubLayer(b)
+        a.RegisterSubLayer(c)
+
+        entries = []
+        for ts in [1, 0, 1]:
+            for layer in [c, b, c]:
+                entries.append((ts, Message.Message('TEST_MESSAGE_TYPE', dest=layer.GetId(), data=ts)))
+        entries.append((0, Message.Message('TEST_MESSAGE_TYPE', dest='0.7')))
+
+        assert(c.ScheduleMany(entries) == 9)
+
+        # One notification per (layer, ts) at each parent.
+        for ts in [0, 1]:
+            assert(len(a.scheduler.Get(ts)) == 1)
+            assert(len(top.scheduler.Get(ts)) == 2)
+
+        _RecordingLayer.calls = []
+        top.RunUntil(1)
+        assert(sorted(_RecordingLayer.calls) == ['0.0.0'] * 6 + ['0.1'] * 3)
+        assert(top.scheduler.Peek() is None)
+
+class TestCancel():
+
+    def setup_method(self):
+        #   top(0)
+        #   /    \
+        #  a(0.0) b(0.1)
+        #  |
+        #  c(0.0.0)
+        self.top = _RecordingLayer()
+        self.top.SetId('0')
+        self.a, self.b, self.c = _RecordingLayer(), _RecordingLayer(), _RecordingLayer()
+        self.top.RegisterSubLayer(self.a)
+        self.top.RegisterSubLayer(self.b)
+        self.a.RegisterSubLayer(self.c)
+
+        _RecordingLayer.calls = []
+
+    def Schedule(self, ts, layer):
+        return self.top.ScheduleMessageFor(ts, Message.Message('TEST_MESSAGE_TYPE', dest=layer.GetId()))
+
+    def test_Cancel_Leaves_No_Notifications(self):
+        handle = self.Schedule(5, self.c)
+        self.Schedule(7, self.c)
+
+        assert(handle.Cancel())
+        assert(not handle.Cancel())
+
+        # Nothing is left at ts 5 anywhere up the tree.
+        for layer in [self.top, self.a, self.c]:
+            assert(layer.scheduler.Get(5) is None)
+            assert(layer.NextTs() == 7)
+
+        assert(self.top.RunUntil(10) == 1)
+        assert(_RecordingLayer.calls == ['0.0.0'])
+
+    def test_Cancel_Keeps_Shared_Timestamp(self):
+        handle = self.Schedule(5, self.c)
+        self.Schedule(5, self.c)
+        self.Schedule(5, self.b)
+
+        handle.Cancel()
+        assert(self.top.NextTs() == 5)
+
+        self.top.RunUntil(5)
+        assert(sorted(_RecordingLayer.calls) == ['0.0.0', '0.1'])
+
+    def test_Reschedule(self):
+        handle = self.Schedule(5, self.c)
+        self.Schedule(3, self.b)
+
+        assert(handle.Reschedule(1) is handle)
+        assert(self.top.NextTs() == 1)
+
+        self.top.RunUntil(10)
+        assert(_RecordingLayer.calls == ['0.0.0', '0.1'])
+        assert(self.top.scheduler.Peek() is None)
+
+        # It's already run, so there's nothing to cancel.
+        assert(not handle.Cancel())
+
+        # A message that can't be routed any more leaves the handle dead.
+        handle = self.Schedule(12, self.c)
+        handle.message.dest = '0.0.0.7'
+        assert(handle.Reschedule(13) is handle)
+        assert(handle.bCancelled and not handle.Cancel())
+        assert(self.top.NextTs() is None)
+
+    def test_Cancel_While_Processing(self):
+        # b cancels c's message when it's handled first at the same ts.
+        handle = self.Schedule(5, self.c)
+        self.Schedule(5, self.b)
+        self.b.handlers['TEST_MESSAGE_TYPE'] = lambda message: _RecordingLayer.calls.append(handle.Cancel())
+        self.b.BuildDispatchTable()
+
+        # Schedule b's message ahead of c's in the top layer.
+        self.top.scheduler.Get(5).rotate(1)
+
+        self.top.RunUntil(5)
+        assert(_RecordingLayer.calls == [True])
+        assert(self.top.scheduler.Peek() is None)
+        assert(self.a.scheduler.Peek() is None)
+        assert(self.c.scheduler.Peek() is None)
+
+class _LeanLayer(Layer.Layer):
+    __slots__ = ()
+
+    messageHandlers = {
+        'TEST_MESSAGE_TYPE': 'TestMessageHandler',
+    }
+
+    calls = []
+
+    def TestMessageHandler(self, message):
+        _LeanLayer.calls.append((self.id, message.GetType()))
+
+class _LeanSubLayer(_LeanLayer):
+    __slots__ = ()
+
+    messageHandlers = {
+        'TEST_MESSAGE_ALT_TYPE': 'TestMessageHandler',
+    }
+
+    def TestMessageHandler(self, message):
+        _LeanLayer.calls.append(('sub', message.GetType()))
+
+class TestLean():
+
+    def setup_method(self):
+        _LeanLayer.calls = []
+
+        self.top = Layer.Layer()
+        self.top.SetId('0')
+        self.a = _LeanLayer()
+        self.b = _LeanSubLayer()
+        self.top.RegisterSubLayer(self.a)
+        self.top.RegisterSubLayer(self.b)
+
+    def test_Slots(self):
+        for layer in [self.top, self.a, self.b]:
+            assert(not hasattr(layer, '__dict__'))
+
+        # Nothing's queued below the top or registered under it, so the leaves still share the empty ones.
+        assert(self.a.scheduler is Scheduler.EMPTY)
+        assert(self.a.registrations is Layer.EMPTY_MAP)
+        assert(self.a.subLayerIndex is Layer.EMPTY_MAP)
+        assert(self.a.notifications is Layer.EMPTY_MAP)
+        assert(self.a.instanceHandlers is None)
+        with pytest.raises(TypeError):
+            Scheduler.EMPTY.Add(0, None)
+        with pytest.raises(TypeError):
+            Layer.EMPTY_MAP['x'] = 1
+
+    def test_Class_Handlers(self):
+        # Subclasses inherit their bases' handlers, and overriding the method overrides the handler.
+        assert(self.a.GetMessageTypes() == {Message.TYPE_NOTIFICATION, 'TEST_MESSAGE_TYPE'})
+        assert(self.b.GetMessageTypes() == {Message.TYPE_NOTIFICATION, 'TEST_MESSAGE_TYPE', 'TEST_MESSAGE_ALT_TYPE'})
+        assert(self.a.classDispatch is _LeanLayer.classDispatch)
+
+        for type in ['TEST_MESSAGE_TYPE', 'TEST_MESSAGE_ALT_TYPE']:
+            self.top.ScheduleMessage(1, Message.Message(type, dest='0', prop=Message.PROP_LTE))
+        self.top.RunUntil(1)
+
+        assert(sorted(_LeanLayer.calls) == [
+            ('0.0', 'TEST_MESSAGE_TYPE'), ('sub', 'TEST_MESSAGE_ALT_TYPE'), ('sub', 'TEST_MESSAGE_TYPE'),
+        ])
+
+        # The queues that were used were created on demand, and dropped back to nothing once processed.
+        assert(self.top.scheduler is not Scheduler.EMPTY)
+        assert(self.a.scheduler.Peek() is None)
+
+    def test_Instance_Handlers(self):
+        # Instance handlers add to the class's, for this instance only.
+        self.a.handlers['TEST_MESSAGE_ALT_TYPE'] = lambda message: _LeanLayer.calls.append(('alt', self.a.id))
+        self.top.RegisterSubLayer(self.a)
+        assert('TEST_MESSAGE_ALT_TYPE' in self.a.GetMessageTypes())
+        assert('TEST_MESSAGE_ALT_TYPE' not in _LeanLayer().GetMessageTypes())
+
+        for type in ['TEST_MESSAGE_TYPE', 'TEST_MESSAGE_ALT_TYPE']:
+            self.top.ScheduleMessageFor(1, Message.Message(type, dest='0.0'))
+        self.top.RunUntil(1)
+        assert(sorted(_LeanLayer.calls) == [('0.0', 'TEST_MESSAGE_TYPE'), ('alt', '0.0')])
+
+        # Handlers added once the dispatch table is built replace the class's from the next message on.
+        self.a.handlers['TEST_MESSAGE_TYPE'] = lambda message: _LeanLayer.calls.append(('late', self.a.id))
+        self.top.ScheduleMessageFor(2, Message.Message('TEST_MESSAGE_TYPE', dest='0.0'))
+        self.top.RunUntil(2)
+        assert(_LeanLayer.calls[-1] == ('late', '0.0'))
+
+    def test_Pickle_Keeps_Shared_Empties(self):
+        a = pickle.loads(pickle.dumps(self.a))
+        assert(a.scheduler is Scheduler.EMPTY)
+        assert(a.registrations is Layer.EMPTY_MAP)
+        assert(a.parents[0].subLayerIndex['0.0'] is a)
+
+    def test_Pickle_Types_By_Name(self):
+        # Type ids differ between processes, so maps keyed by them are pickled by type name.
+        self.top.ScheduleMessage(1, Message.Message('TEST_MESSAGE_TYPE', dest='0', prop=Message.PROP_LTE))
+        assert(set(self.top.__getstate__()['registrations']) == {Message.TYPE_NOTIFICATION, 'TEST_MESSAGE_TYPE', 'TEST_MESSAGE_ALT_TYPE'})
+
+        top = pickle.loads(pickle.dumps(self.top))
+        assert(top.registrations.keys() == self.top.registrations.keys())
+        top.RunUntil(1)
+        assert(sorted(_LeanLayer.calls) == [('0.0', 'TEST_MESSAGE_TYPE'), ('sub', 'TEST_MESSAGE_TYPE')])
+
+class _TypedLayer(Layer.Layer):
+    # Handles whatever types it's given, for building trees with different types in different places.
+    def __init__(self, *types):
+        super().__init__()
+        for type in types:
+            self.handlers[type] = self.Record
+
+    def Record(self, message):
+        _RecordingLayer.calls.append(self.id)
+
+class TestRegistration():
+
+    def setup_method(self):
+        _RecordingLayer.calls = []
+
+        #         top(0)
+        #        /      \
+        #    p(0.0)     q(0.1)
+        #    /    \        |
+        # a(0.0.0) b(0.0.1) c(0.1.0)
+        self.top = _TypedLayer()
+        self.top.SetId('0')
+        self.p = _TypedLayer()
+        self.q = _TypedLayer()
+        self.a = _TypedLayer('A')
+        self.b = _TypedLayer('A', 'B')
+        self.c = _TypedLayer('C')
+
+        ids = self.top.BuildTree([(self.p, [(self.a, []), (self.b, [])]), (self.q, [(self.c, [])])])
+        assert(ids == ['0.0', '0.1'])
+
+    def Types(self, layer):
+        return layer.GetMessageTypes() - {Message.TYPE_NOTIFICATION}
+
+    def test_Build_Tree(self):
+        assert([layer.id for layer in [self.a, self.b, self.c]] == ['0.0.0', '0.0.1', '0.1.0'])
+        assert(self.Types(self.top) == {'A', 'B', 'C'})
+        assert(self.Types(self.p) == {'A', 'B'})
+        assert(list(self.top.GetSubLayers()) == [self.p, self.q])
+        assert(list(self.p.registrations[Message.TypeId('A')]) == [self.a, self.b])
+
+        # Same result as registering one at a time.
+        top = _TypedLayer()
+        top.SetId('0')
+        p = _TypedLayer()
+        top.RegisterSubLayer(p)
+        p.RegisterSubLayers([_TypedLayer('A'), _TypedLayer('A', 'B')])
+        assert(self.Types(top) == {'A', 'B'})
+
+        self.top.ScheduleMessage(1, Message.Message('A', dest='0', prop=Message.PROP_LTE))
+        self.top.RunUntil(1)
+        assert(_RecordingLayer.calls == ['0.0.0', '0.0.1'])
+
+    def test_Unregister(self):
+        # b still handles A after a goes, so only p's registration of a changes.
+        assert(self.p.UnregisterSubLayer(self.a))
+        assert(not self.p.UnregisterSubLayer(self.a))
+        assert(self.a.parents == [])
+        assert(self.p.FindLayer('0.0.0') is None)
+        assert(self.Types(self.top) == {'A', 'B', 'C'})
+
+        # Removing b removes A and B from p and, since q handles neither, from the top as well.
+        self.p.UnregisterSubLayer(self.b)
+        assert(self.Types(self.p) == set())
+        assert(self.Types(self.top) == {'C'})
+        assert(list(self.top.GetSubLayers()) == [self.p, self.q])
+
+        self.top.ScheduleMessage(1, Message.Message('A', dest='0', prop=Message.PROP_LTE))
+        self.top.ScheduleMessage(1, Message.Message('C', dest='0', prop=Message.PROP_LTE))
+        self.top.RunUntil(1)
+        assert(_RecordingLayer.calls == ['0.1.0'])
+
+    def test_Unregister_Cancels_Notifications(self):
+        self.top.ScheduleMessage(5, Message.Message('C', dest='0.1.0'))
+        self.top.UnregisterSubLayer(self.q)
+
+        # Nothing's left to wake the top at 5; q's subtree keeps its queue and can run on its own.
+        assert(self.top.scheduler.Peek() is None)
+        assert(self.q.notifications == {})
+        assert(self.q.NextTs() == 5)
+        self.q.RunUntil(5)
+        assert(_RecordingLayer.calls == ['0.1.0'])
+
+        # Register it again to put it back, under its old name.
+        assert(self.top.RegisterSubLayer(self.q) == '0.1')
+        assert(self.Types(self.top) == {'A', 'B', 'C'})
+
+class _SubscribingLayer(_TypedLayer):
+    # Handles WEATHER for the given regions only.
+    def __init__(self, *regions):
+        super().__init__('WEATHER')
+        self.Subscribe('WEATHER', regions)
+
+class TestSubscriptions():
+
+    def setup_method(self):
+        _RecordingLayer.calls = []
+        Message.SetTopicKey('WEATHER', lambda data: data['region'])
+
+        #                city(0)
+        #          /        |        \
+        #     north(0.0)  south(0.1)  radio(0.2), wants every region
+        #      /     \         |
+        # n0(0.0.0) n1(0.0.1) s0(0.1.0)
+        self.city = _TypedLayer()
+        self.city.SetId('0')
+        self.north = _TypedLayer()
+        self.south = _TypedLayer()
+        self.radio = _TypedLayer('WEATHER')
+        self.n0 = _SubscribingLayer('north')
+        self.n1 = _SubscribingLayer('north', 'coast')
+        self.s0 = _SubscribingLayer('south')
+        self.city.BuildTree([(self.north, [(self.n0, []), (self.n1, [])]), (self.south, [(self.s0, [])]), (self.radio, [])])
+
+    def teardown_method(self):
+        Message.SetTopicKey('WEATHER', None)
+
+    def Broadcast(self, region, **data):
+        _RecordingLayer.calls = []
+        ts = (self.city.now or 0) + 1
+        self.city.ScheduleMessage(ts, Message.Message('WEATHER', dest='0', data=dict(data, region=region), prop=Message.PROP_ALL))
+        self.city.RunUntil(ts)
+        return sorted(_RecordingLayer.calls)
+
+    def test_Pruned_Broadcast(self):
+        type = Message.TypeId('WEATHER')
+        assert(self.north.GetTopics(type) == {'north', 'coast'})
+        assert(self.south.GetTopics(type) == {'south'})
+        assert(self.city.GetTopics(type) is None)
+
+        # The city only copies a northern broadcast to the radio and the north.
+        assert(list(self.city.subscriptions.filters[type].Targets('north')) == [self.radio, self.north])
+        assert(self.Broadcast('north') == ['0.0.0', '0.0.1', '0.2'])
+        assert(self.Broadcast('coast') == ['0.0.1', '0.2'])
+        assert(self.Broadcast('east') == ['0.2'])
+
+    def test_Subscription_Changes(self):
+        type = Message.TypeId('WEATHER')
+        self.s0.Subscribe('WEATHER', ['south', 'coast'])
+        assert(self.Broadcast('coast') == ['0.0.1', '0.1.0', '0.2'])
+
+        # n1 takes every region again, so the north does too.
+        self.n1.Unsubscribe('WEATHER')
+        assert(self.north.GetTopics(type) is None)
+        assert(self.Broadcast('east') == ['0.0.1', '0.2'])
+
+        # Without the radio or n1 nothing wants the east, until a new layer does.
+        self.city.UnregisterSubLayer(self.radio)
+        self.north.UnregisterSubLayer(self.n1)
+        assert(self.city.GetTopics(type) == {'north', 'south', 'coast'})
+        assert(self.Broadcast('east') == [])
+
+        self.south.RegisterSubLayer(_SubscribingLayer('east'))
+        assert(self.city.GetTopics(type) == {'north', 'south', 'coast', 'east'})
+        assert(self.Broadcast('east') == ['0.1.1'])
+
+    def test_Predicate(self):
+        # Predicates filter the layer's own handler; its topics still decide what reaches it.
+        self.n0.Subscribe('WEATHER', ['north'], predicate=lambda message: message.GetData().get('bSevere'))
+        assert(self.Broadcast('north') == ['0.0.1', '0.2'])
+        assert(self.Broadcast('north', bSevere=True) == ['0.0.0', '0.0.1', '0.2'])
+        assert(self.Broadcast('south', bSevere=True) == ['0.1.0', '0.2'])
+
+class _CoalescingLayer(_TypedLayer):
+    __slots__ = ()
+
+    coalescing = {
+        'A': Scheduler.COALESCE_DUPLICATES,
+        'B': Scheduler.COALESCE_LAST,
+    }
+
+    def Record(self, message):
+        _RecordingLayer.calls.append((self.id, message.GetType(), message.GetData()))
+
+class TestCoalescing():
+
+    def test_Coalescing(self):
+        _RecordingLayer.calls = []
+
+        # m is below both p and q, so a broadcast reaches it twice.
+        top = _TypedLayer()
+        top.SetId('0')
+        p = _TypedLayer()
+        q = _TypedLayer()
+        m = _CoalescingLayer('A', 'B')
+        top.BuildTree([(p, [(m, [])]), (q, [])])
+        q.RegisterSubLayer(m)
+        assert(m.classCoalescing == {Message.TypeId('A'): Scheduler.COALESCE_DUPLICATES, Message.TypeId('B'): Scheduler.COALESCE_LAST})
+
+        top.ScheduleMessage(1, Message.Message('A', dest='0', prop=Message.PROP_LTE))
+        for data in [1, 2]:
+            top.ScheduleMessageFor(1, Message.Message('B', dest=m.id, data=data))
+        top.RunUntil(1)
+        assert(sorted(_RecordingLayer.calls) == [('0.0.0', 'A', None), ('0.0.0', 'B', 2)])
+
+    def test_Coalescing_While_Processing(self):
+        scheduler = Scheduler.Scheduler(coalescing={Message.TypeId('B'): Scheduler.COALESCE_LAST})
+        first = Message.Message('B', dest='x', data=1)
+        scheduler.Add(1, first)
+        scheduler.Add(1, Message.Message('C', dest='x'))
+
+        # The first B has been popped to run, so the next doesn't replace it, but the one after replaces that.
+        _ts, q = scheduler.Peek()
+        assert(q.pop() is first)
+        scheduler.Add(1, Message.Message('B', dest='x', data=2))
+        third = Message.Message('B', dest='x', data=3)
+        scheduler.Add(1, third)
+
+        # A cancelled message isn't replaced again.
+        assert(scheduler.Cancel(1, third))
+        scheduler.Add(1, Message.Message('B', dest='x', data=4))
+
+        handled = []
+        while q:
+            m = q.pop()
+            if not scheduler.IsCancelled(1, m):
+                handled.append((m.GetType(), m.GetData()))
+        assert(handled == [('C', None), ('B', 4)])
+
+    def test_Pickle_Keeps_Coalescing(self):
+        _RecordingLayer.calls = []
+        top = _TypedLayer()
+        top.SetId('0')
+        m = _CoalescingLayer('A', 'B')
+        top.RegisterSubLayer(m)
+        for data in [1, 2]:
+            top.ScheduleMessageFor(1, Message.Message('B', dest=m.id, data=data))
+
+        # The replaced message stays cancelled, and the one replacing it is still found to coalesce with.
+        top = pickle.loads(pickle.dumps(top))
+        top.ScheduleMessageFor(1, Message.Message('B', dest=m.id, data=3))
+        top.RunUntil(1)
+        assert(_RecordingLayer.calls == [('0.0', 'B', 3)])
+
+class TestAncestors():
+
+    def setup_method(self):
+        #         top(0)
+        #        /      \
+        #    p(0.0)     q(0.1)
+        #    /    \    /
+        # a(0.0.0) b(0.0.1), also under q
+        self.top = _TypedLayer()
+        self.top.SetId('0')
+        self.p = _TypedLayer()
+        self.q = _TypedLayer()
+        self.a = _TypedLayer('A')
+        self.b = _TypedLayer('A')
+        self.top.BuildTree([(self.p, [(self.a, []), (self.b, [])]), (self.q, [])])
+        self.q.RegisterSubLayer(self.b)
+
+    def test_Ancestry(self):
+        assert(self.b.GetAncestors() == {'0': self.top, '0.0': self.p, '0.1': self.q})
+        assert(self.q.IsAncestorOf(self.b))
+        assert(self.top.IsAncestorOf(self.a))
+        assert(not self.q.IsAncestorOf(self.a))
+        assert(not self.a.IsAncestorOf(self.top))
+
+        # Searches from a leaf start at the lowest common ancestor.
+        assert(self.a.FindAncestorToward('0.0.1') is self.p)
+        assert(self.a.FindAncestorToward('0.1') is self.top)
+        assert(self.a.FindLayer('0.1') is self.q)
+        assert(self.b.FindAncestorToward('0.1') is self.q)
+        assert(self.a.FindAncestorToward('1.0') is None)
+        assert(self.a.FindLayer('0.0.1') is self.b)
+
+    def test_Changes_Forget_Cached_Ancestors(self):
+        self.b.GetAncestors()
+        self.q.UnregisterSubLayer(self.b)
+        assert(self.b.ancestors is None)
+        assert(not self.q.IsAncestorOf(self.b))
+
+        # Moving p under q moves everything below it too.
+        self.a.GetAncestors()
+        self.q.RegisterSubLayer(self.p)
+        assert(self.a.ancestors is None)
+        assert(self.q.IsAncestorOf(self.a))
+
+    def test_Too_Deep_To_Cache(self):
+        layers = [self.a]
+        for _ in range(Layer.Layer.maxCachedAncestors - 1):
+            layer = _TypedLayer()
+            layers[-1].RegisterSubLayer(layer)
+            layers.append(layer)
+
+        assert(layers[-1].GetAncestors() is None)
+        assert(layers[-2].GetAncestors() is not None)
+        assert(self.top.IsAncestorOf(layers[-1]))
+
+        # The answer is cached too, until the layer is given a shallower parent.
+        assert(layers[-1].ancestors is Layer.UNCACHEABLE)
+        assert(layers[-1].GetAncestors() is None)
+
+        _RecordingLayer.calls = []
+        layers[-1].ScheduleMessageFor(1, Message.Message('A', dest='0.0.1'))
+        self.top.RunUntil(1)
+        assert(_RecordingLayer.calls == ['0.0.1'])
@@ -0,0 +1,49 @@
+# From the main directory, call 'python -m pytest -v test\test_Log.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import io
+import logging
+
+from src import Log as LogModule
+from src.Log import Log
+
+class _Unprintable:
+    # Formatting this would fail the test; it must never be formatted while debug is off.
+    def __str__(self):
+        raise AssertionError('formatted a disabled log record')
+
+class TestClass():
+
+    def teardown_method(self):
+        Log.Reset()
+
+    def test_Import_Leaves_Root_Alone(self):
+        Log.Reset()
+        assert(Log.logger is not logging.getLogger())
+        assert(Log.handler not in logging.getLogger().handlers)
+
+    def test_Disabled_Is_Lazy(self):
+        Log.Configure(level=logging.INFO, stream=io.StringIO())
+        assert(not Log.bDebug)
+        Log.debug('%s', _Unprintable())
+
+    def test_Buffered_Sink(self):
+        stream = io.StringIO()
+        Log.Configure(stream=stream, sink=LogModule.SINK_BUFFERED, capacity=100)
+        assert(Log.bDebug)
+
+        Log.debug('buffered %d', 1)
+        assert(stream.getvalue() == '')
+
+        Log.Flush()
+        assert(stream.getvalue() == 'buffered 1\n')
+
+    def test_Async_Sink(self):
+        stream = io.StringIO()
+        Log.Configure(stream=stream, sink=LogModule.SINK_ASYNC)
+
+        for i in range(3):
+            Log.debug('async %d', i)
+
+        Log.Flush()
+        assert(stream.getvalue() == 'async 0\nasync 1\nasync 2\n')
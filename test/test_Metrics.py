@@ -0,0 +1,96 @@
+# From the main directory, call 'python -m pytest -v test\test_Metrics.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import json
+
+from src import Message
+from src import Metrics as MetricsModule
+from src.Metrics import Metrics
+
+import PingLayers
+
+class _SlowLayer(PingLayers.PingLayer):
+    messageHandlers = {
+        'SLOW': 'OnSlow',
+    }
+
+    @Metrics.Timed
+    def OnSlow(self, message):
+        pass
+
+class TestClass():
+
+    def setup_method(self):
+        #     top(0)
+        #     /    \
+        #   a(0.0)  b(0.1)
+        #    |
+        #   c(0.0.0)
+        self.top = _SlowLayer()
+        self.top.SetId('0')
+        self.a = _SlowLayer()
+        self.b = _SlowLayer()
+        self.c = _SlowLayer()
+        self.top.RegisterSubLayer(self.a)
+        self.top.RegisterSubLayer(self.b)
+        self.a.RegisterSubLayer(self.c)
+
+    def teardown_method(self):
+        Metrics.Reset()
+
+    def test_Disabled_Records_Nothing(self):
+        self.top.ScheduleMessage(1, Message.Message('PING', dest='0.0.0'))
+        self.top.RunUntil(1)
+        assert(not Metrics.counts)
+        assert(not Metrics.handlerTimes)
+
+    def test_Counters(self):
+        Metrics.Configure(bTimeHandlers=True)
+
+        # Routed top -> a -> c; notifications from c and a.
+        self.top.ScheduleMessage(1, Message.Message('PING', dest='0.0.0'))
+        # A broadcast from the top copies to a and b, then from a to c.
+        self.top.ScheduleMessage(2, Message.Message('PING', dest='0', prop=Message.PROP_LTE))
+        self.top.RunUntil(2)
+
+        assert(Metrics.Counts(MetricsModule.COUNTER_HOPS) == {('0', 'PING'): 2, ('0.0', 'PING'): 1, ('0.0.0', 'PING'): 1})
+        assert(Metrics.ByLayer(MetricsModule.COUNTER_NOTIFICATIONS) == {'0.0': 1, '0.0.0': 1})
+        assert(Metrics.ByLayer(MetricsModule.COUNTER_COPIES) == {'0': 2, '0.0': 1})
+        assert(Metrics.ByType(MetricsModule.COUNTER_HANDLED) == {'PING': 5})
+        assert(Metrics.Hottest(MetricsModule.COUNTER_HANDLED, 1) == [('0.0.0', 2)])
+
+        calls, seconds, maxSeconds = Metrics.HandlerTimes()['PING']
+        assert(calls == 5)
+        assert(0 <= maxSeconds <= seconds)
+
+    def test_Timed_Handler(self):
+        Metrics.Configure()
+        self.top.ScheduleMessage(1, Message.Message('SLOW', dest='0.1'))
+        self.top.RunUntil(1)
+
+        # Timed handlers are timed under their own name, even without bTimeHandlers.
+        assert(list(Metrics.HandlerTimes()) == ['_SlowLayer.OnSlow'])
+        assert(Metrics.HandlerTimes()['_SlowLayer.OnSlow'][0] == 1)
+
+    def test_Queue_Depths_And_Dumps(self, tmp_path):
+        path = tmp_path / 'metrics.prom'
+        Metrics.Configure(path=str(path), interval=0, format=MetricsModule.FORMAT_PROMETHEUS, root=self.top)
+
+        self.top.ScheduleMessage(1, Message.Message('PING', dest='0.1'))
+        self.top.ScheduleMessage(5, Message.Message('PING', dest='0.1'))
+        self.top.ScheduleMessage(5, Message.Message('PING', dest='0.1'))
+
+        # Each step dumps, since the interval is 0; the dump after ts 1 still sees what's queued at 5.
+        self.top.Step()
+        assert(Metrics.queueDepths == {'0': 1, '0.1': 2})
+
+        text = path.read_text()
+        assert('# TYPE layersofspace_hops_total counter' in text)
+        assert('layersofspace_hops_total{layer="0.1",type="PING"} 3' in text)
+        assert('layersofspace_queue_depth{layer="0.1"} 2' in text)
+
+        jsonPath = tmp_path / 'metrics.json'
+        Metrics.Dump(str(jsonPath), MetricsModule.FORMAT_JSON)
+        data = json.loads(jsonPath.read_text())
+        assert(data['counters']['handled'] == {'0.1': {'PING': 1}})
+        assert(data['queueDepths'] == {'0': 1, '0.1': 2})
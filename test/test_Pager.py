@@ -0,0 +1,93 @@
+# From the main directory, call 'python -m pytest -v test\test_Pager.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+from src import Message, Pager
+
+import PingLayers
+
+def _BuildTree():
+    # top(0) with 10 planets (0.p), each with 4 cities (0.p.c): 5 layers per page.
+    top = PingLayers.BuildTree(10, leaves=4)
+
+    # A few long ping chains bouncing between planets, plus one far-future event on a planet.
+    top.ScheduleMessageFor(1, Message.Message('PING', dest='0.0.0', data=(8, '0.7.3')))
+    top.ScheduleMessageFor(2, Message.Message('PING', dest='0.4.1', data=(6, '0.9.2')))
+    top.ScheduleMessageFor(40, Message.Message('PING', dest='0.5', data=(0, '0')))
+    return top
+
+class TestClass():
+
+    @classmethod
+    def setup_class(cls):
+        top = _BuildTree()
+        top.RunUntil(50)
+        TestClass.serial = PingLayers.Logs(top)
+
+    def test_Matches_Resident_Run(self):
+        top = _BuildTree()
+        pager = Pager.Pager(top, depth=1, maxLayers=12)
+
+        # Only two planets fit, and the ones with nothing scheduled went first.
+        assert(pager.residentLayers <= 12)
+        assert(set(pager.resident) <= {'0.0', '0.4', '0.5'})
+
+        while pager.Step() is not None:
+            assert(pager.residentLayers <= 12)
+        assert(pager.pageIns > 0)
+
+        pager.PageInAll()
+        assert(PingLayers.Logs(top) == TestClass.serial)
+
+    def test_Directory_Store(self, tmp_path):
+        top = _BuildTree()
+        store = Pager.DirectoryStore(str(tmp_path))
+        pager = Pager.Pager(top, depth=1, maxLayers=5, store=store)
+
+        assert(len(list(tmp_path.iterdir())) == 9)
+        assert('0.1' in store)
+
+        pager.RunUntil(50)
+        pager.PageInAll()
+        assert(list(tmp_path.iterdir()) == [])
+        assert(PingLayers.Logs(top) == TestClass.serial)
+
+    def test_Page_In_On_Routing(self):
+        top = _BuildTree()
+        pager = Pager.Pager(top, depth=1, maxLayers=0)
+        assert(pager.resident == {})
+
+        # Scheduling into a paged-out planet pages it in straight away.
+        handle = top.ScheduleMessageFor(3, Message.Message('PING', dest='0.3.2', data=(0, '0')))
+        assert('0.3' in pager.resident)
+        assert(handle.layer.id == '0.3.2')
+
+        # Evicted again at the end of the next step, which takes the handle with it.
+        pager.Step()
+        assert(pager.resident == {})
+        assert(not handle.Cancel())
+
+    def test_Routing_Keeps_Page_Resident(self):
+        top = _BuildTree()
+        pager = Pager.Pager(top, depth=1, maxLayers=50)
+
+        # Of the planets with events pending, the one just scheduled into is the most recently used, and stays.
+        top.ScheduleMessageFor(30, Message.Message('PING', dest='0.0.2', data=(0, '0')))
+        pager.maxLayers = 5
+        pager.Collect()
+        assert(list(pager.resident) == ['0.0'])
+
+    def test_Counts_Registered_Layers(self):
+        top = _BuildTree()
+        pager = Pager.Pager(top, depth=1, maxLayers=10)
+
+        # Layers registered in a resident page, and a new page, count towards the budget from the next step.
+        page, _count = next(iter(pager.resident.values()))
+        page.RegisterSubLayers([PingLayers.PingLayer() for _ in range(20)])
+        planet = PingLayers.PingLayer()
+        top.RegisterSubLayer(planet)
+        planet.RegisterSubLayers([PingLayers.PingLayer() for _ in range(20)])
+
+        pager.Step()
+        assert(pager.residentLayers == Pager.Pager.CountLayers(top) - 1 - len(pager.stubs))
+        assert(pager.residentLayers <= 10)
+
@@ -0,0 +1,109 @@
+# From the main directory, call 'python -m pytest -v test\test_Remote.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import functools
+import io
+
+import pytest
+
+from src import Codec, Message, Remote
+
+import PingLayers
+
+def _BuildTree(planets):
+    #            top(0)
+    #       /      |      \
+    #    p(0.1)  p(0.2)  p(0.3), each a local planet or a RemoteLayer for one
+    #    /  \     /  \     /  \
+    #  leaves (0.x.0, 0.x.1)
+    top = PingLayers.BuildTree(planets)
+
+    # Leaves ping back and forth between planets, and one message goes to the top of the tree and back down.
+    top.ScheduleMessageFor(1, Message.Message('PING', dest='0.1.0', data=(6, '0.3.1')))
+    top.ScheduleMessageFor(2, Message.Message('PING', dest='0.2.1', data=(4, '0.1.1')))
+    top.ScheduleMessageFor(3, Message.Message('UP', dest='0.3.0', prop=Message.PROP_GTE))
+    top.ScheduleMessageFor(5, Message.Message('UP', dest='0', prop=Message.PROP_LTE))
+    return top
+
+class TestRemote():
+
+    def test_Matches_Local(self):
+        top = _BuildTree([PingLayers.BuildPlanet(f'0.{i}') for i in (1, 2, 3)])
+        top.RunUntil(20)
+        local = PingLayers.Logs(top)
+
+        hosts = [Remote.StartHost(functools.partial(PingLayers.BuildPlanet, f'0.{i}')) for i in (2, 3)]
+        remotes = [Remote.RemoteLayer(address) for _process, address in hosts]
+        assert([remote.GetId() for remote in remotes] == ['0.2', '0.3'])
+
+        top = _BuildTree([PingLayers.BuildPlanet('0.1')] + remotes)
+        assert(top.FindLayer('0.3.0') is remotes[1])
+        assert(top.RunUntil(20) > 0)
+
+        # Closing brings the subtrees back (as copies from the hosts), idle, with what they logged.
+        for remote in remotes:
+            remote.Close()
+        for process, _address in hosts:
+            process.join(5)
+            assert(process.exitcode == 0)
+
+        assert(top.NextTs() is None)
+        assert(not any(isinstance(layer, Remote.RemoteLayer) for layer in top.GetSubLayers()))
+        assert(PingLayers.Logs(top) == local)
+        assert(len(local['0.3.1']) == 4 and len(local['0.2.1']) == 4)
+
+    def test_Remote_Error(self):
+        process, address = Remote.StartHost(functools.partial(PingLayers.BuildPlanet, '0.2'))
+        remote = Remote.RemoteLayer(address)
+        top = _BuildTree([PingLayers.BuildPlanet('0.1'), remote])
+
+        top.ScheduleMessageFor(1, Message.Message('FAIL', dest='0.2.1'))
+        with pytest.raises(Remote.RemoteError, match='RuntimeError: failed on purpose'):
+            top.RunUntil(1)
+
+        remote.Close()
+        process.join(5)
+
+    def test_Cancel_Clears_Wake(self):
+        process, address = Remote.StartHost(functools.partial(PingLayers.BuildPlanet, '0.2'))
+        remote = Remote.RemoteLayer(address)
+        top = PingLayers.BuildTree([PingLayers.BuildPlanet('0.1'), remote])
+
+        # The wake-up stays while anything is left for the host at its timestamp, and goes with the last message.
+        first = top.ScheduleMessageFor(4, Message.Message('PING', dest='0.2.1'))
+        second = top.ScheduleMessageFor(4, Message.Message('PING', dest='0.2.0'))
+        assert(first.Cancel())
+        assert(top.NextTs() == 4)
+        assert(second.Cancel())
+        assert(top.NextTs() is None)
+        assert(top.RunUntil(10) == 0)
+
+        remote.Close()
+        process.join(5)
+
+    def test_Frames(self):
+        class _Buffer:
+            def __init__(self):
+                self.data = bytearray()
+            def sendall(self, data):
+                self.data += data
+
+        out = _Buffer()
+        message = Message.Message('PING', dest='0.2.1', data=(3, '0.1.1'))
+        Remote.SendFrame(out, ('tick', 5, 4, [('schedule', 5, message)]))
+        Remote.SendFrame(out, ('ok', [], None))
+
+        f = io.BytesIO(bytes(out.data))
+        command = Remote.RecvFrame(f)
+        assert(command[:3] == ('tick', 5, 4))
+        received = command[3][0][2]
+        assert((received.GetType(), received.GetDest(), received.GetData()) == ('PING', '0.2.1', (3, '0.1.1')))
+        assert(Remote.RecvFrame(f) == ('ok', [], None))
+        with pytest.raises(ConnectionError):
+            Remote.RecvFrame(f)
+
+        # Frames are never unpickled: a pickled value is refused rather than run.
+        out = _Buffer()
+        Remote.SendFrame(out, ('tick', 5, 4, [('schedule', 5, Message.Message('PING', dest='0.2', data=frozenset()))]))
+        with pytest.raises(Codec.DecodeError):
+            Remote.RecvFrame(io.BytesIO(bytes(out.data)))
@@ -2,8 +2,11 @@
 # or run 'python -m pytest test' to run all tests.
 
 from collections import deque
+import random
 
-from src import Scheduler, SchedulingList
+import pytest
+
+from src import Codec, Message, Scheduler, SchedulingList
 from src.Log import Log
 
 class TestClass():
@@ -65,3 +68,197 @@ class TestClass():
         q = s.Pop()[1]
         for sameTsEntry in sameTsEntries:
             assert(q.pop() == sameTsEntry)
+
+    def test_Message_Hop_Copy_On_Write(self):
+        m = Message.Message('T', '0', src='s', data={'k': 1}, prop=Message.PROP_ALL)
+        a = m.LowerEqCopy(newDest='0.0')
+        b = a.LowerEqCopy(newDest='0.0.0')
+
+        # Hops share the original payload and only keep their own dest/prop.
+        assert(b.GetPayload() is m)
+        assert((b.GetType(), b.GetDest(), b.GetSrc(), b.GetData()) == ('T', '0.0.0', 's', {'k': 1}))
+        assert(b.PropTargetsLower() and b.PropTargetsEqual() and not b.PropTargetsHigher())
+
+        b.SetSrc('other')
+        assert(b.GetSrc() == 'other')
+        assert(a.GetSrc() == 's' and m.GetSrc() == 's')
+
+    def test_Message_Type_And_Prop_Codes(self):
+        m = Message.Message('TEST_INTERNED_TYPE', '0', prop='*')
+        assert(m.GetType() == 'TEST_INTERNED_TYPE')
+        assert(m.GetTypeId() == Message.TypeId('TEST_INTERNED_TYPE'))
+        assert(Message.TypeName(m.GetTypeId()) == 'TEST_INTERNED_TYPE')
+
+        # Old one-character prop codes map onto the bitmasks.
+        assert(m.prop == Message.PROP_ALL)
+        assert(Message.Message('T', '0', prop=']').prop == Message.PROP_GTE)
+
+        for prop, lower, higher, equal in [
+            (Message.PROP_EXACT, False, False, True),
+            (Message.PROP_LT, True, False, False),
+            (Message.PROP_LTE, True, False, True),
+            (Message.PROP_GT, False, True, False),
+            (Message.PROP_GTE, False, True, True),
+            (Message.PROP_BI, True, True, False),
+            (Message.PROP_ALL, True, True, True),
+        ]:
+            m = Message.Message('T', '0', prop=prop)
+            assert((m.PropTargetsLower(), m.PropTargetsHigher(), m.PropTargetsEqual()) == (lower, higher, equal))
+
+    def test_Scheduler_Add_Many(self):
+        s = Scheduler.Scheduler()
+        s.Add(1, 'a')
+
+        newTs = s.AddMany([(3, 'x'), (1, 'b'), (2, 'y'), (3, 'z')])
+        assert(sorted(newTs) == [2, 3])
+
+        # Same queues as calling Add for each entry.
+        expected = [(1, ['a', 'b']), (2, ['y']), (3, ['x', 'z'])]
+        for ts, events in expected:
+            qTs, q = s.Pop()
+            assert(qTs == ts)
+            assert([q.pop() for _ in range(len(q))] == events)
+
+        assert(s.Pop() == None)
+
+    def test_Wheel_Matches_Heap(self):
+        rng = random.Random(0)
+        heap = SchedulingList.HeapBackend()
+        wheel = SchedulingList.WheelBackend(size=16)
+
+        now = 0
+        for i in range(5000):
+            if rng.random() < 0.55:
+                # Mostly near-future ticks, with some far-future, past and float timestamps mixed in.
+                r = rng.random()
+                if r < 0.8:
+                    ts = now + rng.randrange(20)
+                elif r < 0.9:
+                    ts = now + rng.randrange(1000)
+                elif r < 0.95:
+                    ts = now - rng.randrange(1, 5)
+                else:
+                    ts = now + rng.random() * 30
+                heap.Push(ts, i)
+                wheel.Push(ts, i)
+            else:
+                assert(wheel.Peek() == heap.Peek())
+                t = heap.Pop()
+                assert(wheel.Pop() == t)
+                if t is not None:
+                    now = max(now, int(t[0]))
+
+        while len(heap):
+            assert(wheel.Pop() == heap.Pop())
+        assert(wheel.Pop() is None)
+
+    def test_Scheduler_Wheel_Backend(self):
+        s = Scheduler.Scheduler(SchedulingList.WheelBackend(size=4))
+        for ts, event in [(9, 'c'), (0, 'a'), (2, 'b'), (2, 'b2'), (100, 'd')]:
+            s.Add(ts, event)
+
+        popped = []
+        while True:
+            t = s.Pop()
+            if t is None:
+                break
+            ts, q = t
+            while q:
+                popped.append((ts, q.pop()))
+
+        assert(popped == [(0, 'a'), (2, 'b'), (2, 'b2'), (9, 'c'), (100, 'd')])
+
+    def test_Scheduler_Cancel(self):
+        s = Scheduler.Scheduler()
+        a, b, c = Message.Message('A', '0'), Message.Message('B', '0'), Message.Message('C', '0')
+        s.Add(1, a)
+        s.Add(1, b)
+        s.Add(2, c)
+
+        assert(s.Cancel(1, a))
+        assert(not s.Cancel(1, a))
+        assert(not s.Cancel(3, a))
+
+        # Cancelled events are stripped from popped queues, and an emptied ts is dropped from the schedule.
+        assert(s.Cancel(2, c))
+        ts, q = s.Pop()
+        assert((ts, list(q)) == (1, [b]))
+        assert(s.Pop() is None)
+
+    def test_Scheduler_Coalescing(self):
+        def Add(old, new):
+            return Message.Message('SUM', new.GetDest(), data=old.GetData() + new.GetData())
+
+        s = Scheduler.Scheduler(coalescing={
+            Message.TypeId('DUP'): Scheduler.COALESCE_DUPLICATES,
+            Message.TypeId('LAST'): Scheduler.COALESCE_LAST,
+            Message.TypeId('SUM'): Add,
+        })
+
+        dup = Message.Message('DUP', '0')
+        s.Add(1, dup)
+        s.Add(1, dup)
+        s.Add(1, dup.LowerEqCopy())
+        s.Add(1, Message.Message('DUP', '0'))
+        s.Add(1, dup.LowerEqCopy(newDest='1'))
+
+        last = Message.Message('LAST', '0', data=1)
+        s.Add(1, last)
+        s.Add(1, Message.Message('LAST', '0', data=2))
+        assert(not s.Cancel(1, last))
+
+        for data in [1, 2, 3]:
+            s.Add(1, Message.Message('SUM', '0', data=data))
+
+        ts, q = s.Pop()
+        events = [(e.GetType(), e.GetDest(), e.GetData()) for e in reversed(q) if not s.IsCancelled(ts, e)]
+        assert(events == [('DUP', '0', None), ('DUP', '0', None), ('DUP', '1', None), ('LAST', '0', 2), ('SUM', '0', 6)])
+
+        # A duplicate of a message that already ran at the latest ts is still dropped; other policies add anew.
+        s.Add(1, dup)
+        s.Add(1, Message.Message('SUM', '0', data=4))
+        ts, q = s.Pop()
+        assert([(e.GetType(), e.GetData()) for e in q] == [('SUM', 4)])
+
+    def test_SchedulingList_Compaction(self):
+        sl = SchedulingList.SchedulingList()
+        for ts in range(100):
+            sl.Add(ts, str(ts))
+
+        for ts in range(0, 100, 3):
+            assert(sl.Remove(ts) == str(ts))
+        for ts in range(1, 100, 3):
+            sl.Remove(ts)
+
+        # Compacted once most of the backend was dead.
+        assert(len(sl.events) < 100)
+        assert([sl.Pop()[0] for _ in range(33)] == list(range(2, 100, 3)))
+        assert(sl.Pop() is None)
+
+    def test_Codec_Round_Trip(self):
+        values = [
+            None, True, False, 0, 1, -1, 2**70, -2**70, 1.5, '', 'héllo', b'\x00\xff',
+            [1, [2, (3, 'x')]], (), {'a': [1, 2], 3: None},
+            Message.Message('T', '0.1', src='0', data={'k': (1, 2)}, prop=Message.PROP_GTE),
+            frozenset([1, 2]),
+        ]
+        for value in values:
+            data = Codec.Dumps(value)
+            decoded = Codec.Loads(data)
+            if isinstance(value, Message.Message):
+                assert(str(decoded) == str(value))
+                assert(decoded.prop == value.prop)
+            else:
+                assert(decoded == value and type(decoded) is type(value))
+
+        # Small ints take a tag byte and a short varint.
+        assert(len(Codec.Dumps(300)) == 3)
+        assert(len(Codec.Dumps(None)) == 1)
+
+        with pytest.raises(Codec.DecodeError):
+            Codec.Loads(Codec.Dumps('truncated')[:-1])
+
+        # Pickle-free decoding takes plain values, but not a pickle, however deep inside.
+        assert(Codec.Loads(Codec.Dumps([1, {'a': (2, 'b')}]), bPickle=False) == [1, {'a': (2, 'b')}])
+        with pytest.raises(Codec.DecodeError):
+            Codec.Loads(Codec.Dumps({'k': [frozenset([1])]}), bPickle=False)
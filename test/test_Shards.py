@@ -0,0 +1,93 @@
+# From the main directory, call 'python -m pytest -v test\test_Shards.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import multiprocessing
+
+import pytest
+
+from src import Clock, Message, Shards
+
+import PingLayers
+
+def _BuildTree():
+    #            top(0)
+    #       /      |      \
+    #    p(0.0)  p(0.1)  p(0.2)
+    #    /  \     /  \     /  \
+    #  leaves (0.x.0, 0.x.1)
+    top = PingLayers.BuildTree(3)
+
+    # Leaves ping back and forth between planets, and one message goes to the top of the tree and back down.
+    top.ScheduleMessageFor(1, Message.Message('PING', dest='0.0.0', data=(6, '0.2.1')))
+    top.ScheduleMessageFor(2, Message.Message('PING', dest='0.1.1', data=(4, '0.0.1')))
+    top.ScheduleMessageFor(3, Message.Message('UP', dest='0.2.0', prop=Message.PROP_GTE))
+    top.ScheduleMessageFor(5, Message.Message('UP', dest='0', prop=Message.PROP_LTE))
+    return top
+
+class TestClass():
+
+    @classmethod
+    def setup_class(cls):
+        # Spawned workers intern message types in their own order: make this process's differ from theirs.
+        Message.TypeId('SHARDS_ONLY_IN_PARENT')
+
+        top = _BuildTree()
+        top.RunUntil(20)
+        TestClass.serial = PingLayers.Logs(top)
+
+    def RunSharded(self, workers, context=None):
+        top = _BuildTree()
+        runner = Shards.ShardedRunner(top, depth=1, workers=workers, context=context)
+        assert(runner.RunUntil(20) > 0)
+        runner.Close()
+
+        # Everything's back in the tree (as copies from the workers) and idle.
+        assert(top.NextTs() is None)
+        logs = PingLayers.Logs(top)
+        for id in logs:
+            assert(not any(isinstance(parent, Shards.ShardPort) for parent in top.FindLayer(id).parents))
+        return logs
+
+    def test_Matches_Serial(self):
+        logs = self.RunSharded(workers=3)
+        assert(logs == TestClass.serial)
+
+    def test_Spawned_Workers(self):
+        logs = self.RunSharded(workers=2, context=multiprocessing.get_context('spawn'))
+        assert(logs == TestClass.serial)
+
+    def test_Deterministic_Across_Worker_Counts(self):
+        assert(self.RunSharded(workers=1) == self.RunSharded(workers=2))
+
+    def test_Close_Restores_Pending(self):
+        top = _BuildTree()
+        runner = Shards.ShardedRunner(top, depth=1, workers=2)
+        runner.RunUntil(2)
+        runner.Close()
+
+        # The rest of the run continues serially.
+        top.now = runner.now
+        top.RunUntil(20)
+        assert(PingLayers.Logs(top) == TestClass.serial)
+
+    def test_Discard_Keeps_Later_Traffic(self):
+        top = _BuildTree()
+        runner = Shards.ShardedRunner(top, depth=1, workers=2)
+        runner.latePolicy = Clock.LATE_DROP
+        runner.RunUntil(5)
+
+        # A late event at 2 is dropped, but a message waiting to cross into a shard at 8 isn't.
+        top.ScheduleMessageFor(2, Message.Message('UP', dest='0'))
+        top.ScheduleMessageFor(8, Message.Message('PING', dest='0.1.0', data=(0, '0')))
+        runner.RunUntil(20)
+        runner.Close()
+
+        assert((2, 'up') not in top.log)
+        assert((8, 0) in top.FindLayer('0.1.0').log)
+
+    def test_Rejects_Shared_Sub_Layers(self):
+        top = _BuildTree()
+        top.FindLayer('0.0').RegisterSubLayer(top.FindLayer('0.2.1'))
+
+        with pytest.raises(ValueError):
+            Shards.ShardedRunner(top, depth=1)
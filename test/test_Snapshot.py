@@ -0,0 +1,210 @@
+# From the main directory, call 'python -m pytest -v test\test_Snapshot.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import io
+
+import pytest
+
+from src import Codec, Handle, Layer, Message, Snapshot
+
+class _CountingLayer(Layer.Layer):
+    # Records every handled message in calls (shared), and keeps a count of its own as snapshot state.
+    calls = []
+
+    # Instances created so far.
+    created = 0
+
+    def __init__(self):
+        super().__init__()
+        _CountingLayer.created += 1
+        self.handlers['TICK'] = self.HandleTick
+        self.count = 0
+
+    def HandleTick(self, message):
+        self.count += 1
+        _CountingLayer.calls.append((self.id, self.GetNow(), message.GetData(), self.count))
+
+        # Keep ticking a few times.
+        if message.GetData() > 0:
+            tick = Message.Message('TICK', dest=self.id, data=message.GetData() - 1)
+            self.ScheduleMessage(self.GetNow() + 2, tick)
+
+    def SnapshotState(self):
+        return self.count
+
+    def RestoreState(self, state):
+        self.count = state
+
+def _BuildTree():
+    #        top(0)
+    #       /      \
+    #    a(0.0)   b(0.1)
+    #    /   \      |
+    # c(0.0.0) d(0.0.1)
+    #        \  |
+    #        e(0.0.1.0), also under c
+    top = _CountingLayer()
+    top.SetId('0')
+    a, b, c, d, e = [_CountingLayer() for _ in range(5)]
+    top.RegisterSubLayer(a)
+    top.RegisterSubLayer(b)
+    a.RegisterSubLayer(c)
+    a.RegisterSubLayer(d)
+    d.RegisterSubLayer(e)
+    c.RegisterSubLayer(e)
+
+    for ts, layer in [(1, c), (2, e), (2, b), (3, top), (5, c)]:
+        layer.ScheduleMessage(ts, Message.Message('TICK', dest=layer.id, data=3))
+    return top
+
+def _Run(top, until):
+    _CountingLayer.calls = []
+    top.RunUntil(until)
+    return _CountingLayer.calls
+
+class TestClass():
+
+    def test_Round_Trip(self):
+        top = _BuildTree()
+        top.RunUntil(2)
+        top.FindLayer('0.0.0').ScheduleMessage(9, Message.Message('TICK', dest='0.0.0', data=0)).Cancel()
+
+        f = io.BytesIO()
+        assert(Snapshot.Save(top, f) == 6)
+        f.seek(0)
+        restored = Snapshot.Load(f)
+
+        assert(restored.now == 2)
+        assert(restored.FindLayer('0.0.1.0').parents[1].id == '0.0.0')
+        assert(_Run(restored, 20) == _Run(top, 20))
+
+    def test_Restored_Notifications_Cancel(self):
+        top = _BuildTree()
+        handle = top.FindLayer('0.0.1.0').ScheduleMessage(4, Message.Message('TICK', dest='0.0.1.0', data=0))
+
+        f = io.BytesIO()
+        Snapshot.Save(top, f)
+        f.seek(0)
+        restored = Snapshot.Load(f)
+
+        # e's notification at 4 is a single object in both c and d, so cancelling clears both.
+        e = restored.FindLayer('0.0.1.0')
+        q = e.scheduler.Get(4)
+        assert(Handle.Handle(e, 4, q[-1]).Cancel())
+        assert(restored.NextTs() == 1)
+        for layer in e.parents:
+            assert(layer.scheduler.Get(4) is None)
+        assert(restored.scheduler.Get(4) is None)
+
+        handle.Cancel()
+        assert(_Run(restored, 20) == _Run(top, 20))
+
+    def test_Incremental(self):
+        top = _BuildTree()
+        base = io.BytesIO()
+        Snapshot.Save(top, base)
+
+        # Nothing changed: only the root is written.
+        assert(Snapshot.SaveIncremental(top, io.BytesIO()) == 1)
+
+        top.FindLayer('0.1').ScheduleMessage(7, Message.Message('TICK', dest='0.1', data=1))
+        delta = io.BytesIO()
+        assert(Snapshot.SaveIncremental(top, delta) == 2)
+
+        top.RunUntil(4)
+        delta2 = io.BytesIO()
+        Snapshot.SaveIncremental(top, delta2)
+
+        for f in [base, delta, delta2]:
+            f.seek(0)
+        restored = Snapshot.Load(base, delta, delta2)
+        assert(_Run(restored, 20) == _Run(top, 20))
+
+    def test_Incremental_Unregistered(self):
+        top = _BuildTree()
+        base = io.BytesIO()
+        Snapshot.Save(top, base)
+
+        # Removing a leaves c, d and e out of the tree too.
+        top.UnregisterSubLayer(top.FindLayer('0.0'))
+        delta = io.BytesIO()
+        Snapshot.SaveIncremental(top, delta)
+
+        for f in [base, delta]:
+            f.seek(0)
+        _CountingLayer.created = 0
+        restored = Snapshot.Load(base, delta)
+        assert(_CountingLayer.created == 2)
+        assert(restored.FindLayer('0.0') is None)
+        assert(_Run(restored, 20) == _Run(top, 20))
+
+    def test_Bad_Stream(self):
+        with pytest.raises(Snapshot.SnapshotError):
+            Snapshot.Load(io.BytesIO(b'not a snapshot'))
+
+        f = io.BytesIO()
+        Snapshot.Save(_BuildTree(), f)
+        with pytest.raises(Snapshot.SnapshotError):
+            Snapshot.Load(io.BytesIO(f.getvalue()[:-10]))
+
+        # Only layer classes are created, and untrusted snapshots can't import modules, or hold pickled values.
+        for className, value in [('builtins:print', None), ('email.mime.text:MIMEText', None), (None, frozenset())]:
+            layer = _CountingLayer()
+            layer.SetId('0')
+            record = list(Snapshot._Record(layer))
+            record[0] = className or record[0]
+            record[-1] = value
+
+            f = io.BytesIO()
+            f.write(Snapshot.MAGIC)
+            Snapshot._WriteValue(f, (Snapshot.KIND_FULL, '0'))
+            Snapshot._WriteValue(f, tuple(record))
+            f.write(b'\x00')
+            with pytest.raises((Snapshot.SnapshotError, Codec.DecodeError)):
+                Snapshot.Load(io.BytesIO(f.getvalue()), bTrusted=False)
+
+class _RegionLayer(Layer.Layer):
+    # Handles WEATHER for its own region only, subscribing whenever the region is set.
+    __slots__ = ('region',)
+    calls = []
+
+    messageHandlers = {
+        'WEATHER': 'HandleWeather',
+    }
+
+    def __init__(self, region=None):
+        super().__init__()
+        self.SetRegion(region)
+
+    def SetRegion(self, region):
+        self.region = region
+        if region is not None:
+            self.Subscribe('WEATHER', [region])
+
+    def HandleWeather(self, message):
+        _RegionLayer.calls.append(self.id)
+
+    def SnapshotState(self):
+        return self.region
+
+    def RestoreState(self, state):
+        self.SetRegion(state)
+
+class TestSubscriptions():
+
+    def test_Restored_Subscriptions(self):
+        top = Layer.Layer()
+        top.SetId('0')
+        top.BuildTree([(Layer.Layer(), [(_RegionLayer('north'), []), (_RegionLayer('south'), [])])])
+
+        f = io.BytesIO()
+        Snapshot.Save(top, f)
+        f.seek(0)
+        top = Snapshot.Load(f)
+
+        # The restored tree prunes broadcasts the same way.
+        assert(top.GetTopics(Message.TypeId('WEATHER')) == {'north', 'south'})
+        _RegionLayer.calls = []
+        top.ScheduleMessage(1, Message.Message('WEATHER', dest='0', data='south', prop=Message.PROP_ALL))
+        top.RunUntil(1)
+        assert(_RegionLayer.calls == ['0.0.1'])
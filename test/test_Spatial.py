@@ -0,0 +1,128 @@
+# From the main directory, call 'python -m pytest -v test\test_Spatial.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+import io
+import random
+
+from src import Message, Snapshot, Spatial
+
+class _UnitLayer(Spatial.SpatialLayer):
+    # Records every BOOM it handles in calls (shared).
+    calls = []
+
+    messageHandlers = {
+        'BOOM': 'HandleBoom',
+    }
+
+    def HandleBoom(self, message):
+        _UnitLayer.calls.append(self.id)
+
+def _BruteForce(points, x, y):
+    return sorted(points, key=lambda item: ((item[1][0] - x) ** 2 + (item[1][1] - y) ** 2, item[0]))
+
+class TestGridIndex():
+
+    def test_Queries(self):
+        rng = random.Random(3)
+        index = Spatial.GridIndex(10)
+        points = {n: (rng.uniform(-100, 100), rng.uniform(-100, 100)) for n in range(300)}
+        for n, (x, y) in points.items():
+            index.Move(n, x, y)
+
+        # Move some around, and drop some.
+        for n in range(0, 300, 7):
+            points[n] = (rng.uniform(-100, 100), rng.uniform(-100, 100))
+            index.Move(n, *points[n])
+        for n in range(0, 300, 11):
+            del points[n]
+            index.Remove(n)
+        assert(sum(len(layers) for layers in index.cells.values()) == len(points))
+
+        for x, y in [(0, 0), (95, -95), (3.5, 40), (1000, 1000)]:
+            expected = _BruteForce(points.items(), x, y)
+
+            inRange = {n for n, (px, py) in points.items() if (px - x) ** 2 + (py - y) ** 2 <= 25 ** 2}
+            assert(set(index.InRange(x, y, 25)) == inRange)
+            assert(set(index.InRange(x, y, 25, lambda n: n % 2)) == {n for n in inRange if n % 2})
+
+            assert(index.Nearest(x, y, 5) == [n for n, _p in expected[:5]])
+            assert(index.Nearest(x, y, 3, accept=lambda n: n % 3 == 0) == [n for n, _p in expected if n % 3 == 0][:3])
+            assert(index.Nearest(x, y, 5, maxRadius=12) == [n for n in index.Nearest(x, y, 5) if n in index.InRange(x, y, 12)])
+
+class TestSpatialLayer():
+
+    def setup_method(self):
+        _UnitLayer.calls = []
+        Spatial.SetAreaKey('BOOM', lambda data: data)
+
+        # A field with a unit every 10 units along a line: 0.0 at x=0, 0.1 at x=10, ...
+        self.field = _UnitLayer()
+        self.field.SetId('0')
+        self.units = [_UnitLayer() for _ in range(10)]
+        for x, unit in enumerate(self.units):
+            unit.SetPosition(x * 10, 0)
+        self.field.RegisterSubLayers(self.units)
+
+    def teardown_method(self):
+        Spatial.SetAreaKey('BOOM', None)
+
+    def Boom(self, area, dest='0'):
+        _UnitLayer.calls = []
+        ts = (self.field.now or 0) + 1
+        self.field.ScheduleMessage(ts, Message.Message('BOOM', dest=dest, data=area, prop=Message.PROP_LT))
+        self.field.RunUntil(ts)
+        return _UnitLayer.calls
+
+    def test_Area_Delivery(self):
+        assert(sorted(self.Boom(Spatial.InRange(29, 0, 10))) == ['0.2', '0.3'])
+        assert(self.Boom(Spatial.Nearest(68, 3, 2)) == ['0.7', '0.6'])
+
+        # No area: delivered to every sub-layer.
+        assert(len(self.Boom(None)) == 10)
+
+    def test_Movement_And_Unregistering(self):
+        self.units[9].SetPosition(30, 1)
+        assert(sorted(self.Boom(Spatial.InRange(30, 0, 2))) == ['0.3', '0.9'])
+
+        self.field.UnregisterSubLayer(self.units[3])
+        assert(self.Boom(Spatial.InRange(30, 0, 2)) == ['0.9'])
+
+        self.units[9].ClearPosition()
+        assert(self.Boom(Spatial.InRange(30, 0, 2)) == [])
+        assert(self.field.Nearest(30, 0) == [self.units[2]])
+
+    def test_Nested(self):
+        # A squad positioned within the field, with units of its own: the same area is applied again below it.
+        squad = _UnitLayer()
+        squad.SetPosition(50, 5)
+        members = [_UnitLayer() for _ in range(3)]
+        for x, member in enumerate(members):
+            member.SetPosition(50 + x * 10, 5)
+        self.field.BuildTree([(squad, [(member, []) for member in members])])
+
+        assert(sorted(self.Boom(Spatial.InRange(52, 4, 5))) == ['0.10', '0.10.0', '0.5'])
+
+    def test_Snapshot(self):
+        f = io.BytesIO()
+        Snapshot.Save(self.field, f)
+        f.seek(0)
+        self.field = Snapshot.Load(f)
+
+        assert(self.field.FindLayer('0.4').GetPosition() == (40, 0))
+        assert(sorted(self.Boom(Spatial.InRange(40, 0, 10))) == ['0.3', '0.4', '0.5'])
+
+    def test_Incremental_Snapshot_Moves(self):
+        base = io.BytesIO()
+        Snapshot.Save(self.field, base)
+
+        # Moving a layer is a change like any other for the next incremental snapshot.
+        self.field.FindLayer('0.4').SetPosition(90, 0)
+        self.field.FindLayer('0.5').ClearPosition()
+        delta = io.BytesIO()
+        assert(Snapshot.SaveIncremental(self.field, delta) == 3)
+
+        base.seek(0)
+        delta.seek(0)
+        field = Snapshot.Load(base, delta)
+        assert(field.FindLayer('0.4').GetPosition() == (90, 0))
+        assert(field.FindLayer('0.5').GetPosition() is None)
@@ -0,0 +1,142 @@
+# From the main directory, call 'python -m pytest -v test\test_World.py to run this single file,
+# or run 'python -m pytest test' to run all tests.
+
+from src import Layer, Message, SchedulingList, World
+
+class _TestLayerWithHandler(Layer.Layer):
+    # Used for tracking the order in which test layer handlers are called.
+    calls = []
+
+    def __init__(self):
+        super().__init__()
+        self.handlers['TEST_MESSAGE_TYPE'] = self.TestMessageHandler
+
+    def TestMessageHandler(self, message):
+        _TestLayerWithHandler.calls.append(str(self))
+
+class TestClass():
+
+    @classmethod
+    def setup_class(cls):
+        # Same tree as test_Layer, minus X/Y.
+        #       A(0)
+        #      / \
+        #     v   v
+        # B(0.0)  C(0.1)
+        #         |  \
+        #         v   v
+        #  D(0.1.0) -> M(0.1.1)
+
+        TestClass.layerA = _TestLayerWithHandler()
+        TestClass.layerB = _TestLayerWithHandler()
+        TestClass.layerC = _TestLayerWithHandler()
+        TestClass.layerD = _TestLayerWithHandler()
+        TestClass.layerM = _TestLayerWithHandler()
+
+        TestClass.layerA.SetId('0')
+        TestClass.world = World.World(TestClass.layerA)
+
+        # Registering after attaching the root should attach the new layers too.
+        TestClass.layerA.RegisterSubLayer(TestClass.layerB)
+        TestClass.layerA.RegisterSubLayer(TestClass.layerC)
+        TestClass.layerC.RegisterSubLayer(TestClass.layerD)
+        TestClass.layerC.RegisterSubLayer(TestClass.layerM)
+        TestClass.layerD.RegisterSubLayer(TestClass.layerM)
+
+    def test_Attached(self):
+        for layer in [TestClass.layerB, TestClass.layerC, TestClass.layerD, TestClass.layerM]:
+            assert(layer.world is TestClass.world)
+
+    def test_Propagation_Order(self):
+        testMessage = Message.Message(
+            'TEST_MESSAGE_TYPE',
+            dest=TestClass.layerA.GetId(),
+            data='TEST_DATA',
+            prop=Message.PROP_ALL)
+
+        _TestLayerWithHandler.calls = []
+
+        TestClass.layerA.ScheduleMessage(0, testMessage)
+        assert(TestClass.world.Process(0) == 1)
+
+        # Same ordering as the per-layer schedulers; both C and D forward the message to M.
+        assert(_TestLayerWithHandler.calls == ['0', '0.0', '0.1', '0.1.0', '0.1.1', '0.1.1'])
+
+    def test_Timestamp_Order(self):
+        _TestLayerWithHandler.calls = []
+
+        for ts, layer in [(2, TestClass.layerB), (1, TestClass.layerM), (1, TestClass.layerD)]:
+            testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=layer.GetId())
+            TestClass.layerB.ScheduleMessageFor(ts, testMessage)
+
+        # No notifications are queued in the layers themselves.
+        assert(TestClass.layerA.scheduler.Peek() is None)
+
+        assert(TestClass.layerA.Process(0) is None)
+        assert(TestClass.layerA.Process(1) == 2)
+        assert(TestClass.layerA.Process(2) == 1)
+
+        assert(_TestLayerWithHandler.calls == ['0.1.1', '0.1.0', '0.0'])
+
+    def test_Run_Until(self):
+        _TestLayerWithHandler.calls = []
+
+        for ts in [5, 3, 4]:
+            testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=TestClass.layerB.GetId(), data=ts)
+            TestClass.layerB.ScheduleMessage(ts, testMessage)
+
+        world = TestClass.world
+        assert(world.RunUntil(4) == 2)
+        assert(world.GetNow() == 4)
+        assert(world.RunFor(10) == 1)
+        assert(world.GetNow() == 14)
+        assert(TestClass.layerM.GetNow() == 14)
+        assert(_TestLayerWithHandler.calls == ['0.0', '0.0', '0.0'])
+
+class TestWheelWorld():
+
+    def test_Wheel_Backend_Order(self):
+        top = _TestLayerWithHandler()
+        top.SetId('0')
+        world = World.World(top, backend=SchedulingList.WheelBackend(size=4))
+
+        subs = [_TestLayerWithHandler() for _ in range(3)]
+        for sub in subs:
+            top.RegisterSubLayer(sub)
+
+        for ts, sub in [(9, subs[2]), (1, subs[0]), (1, subs[1]), (3.5, subs[2]), (100, subs[0])]:
+            testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=sub.GetId())
+            top.ScheduleMessageFor(ts, testMessage)
+
+        _TestLayerWithHandler.calls = []
+        assert(world.RunUntil(100) == 4)
+        assert(_TestLayerWithHandler.calls == ['0.0', '0.1', '0.2', '0.2', '0.0'])
+
+class TestWorldCancel():
+
+    def test_Cancel_And_Reschedule(self):
+        top = _TestLayerWithHandler()
+        top.SetId('0')
+        world = World.World(top)
+
+        subs = [_TestLayerWithHandler() for _ in range(2)]
+        for sub in subs:
+            top.RegisterSubLayer(sub)
+
+        handles = []
+        for ts in range(100):
+            testMessage = Message.Message('TEST_MESSAGE_TYPE', dest=subs[ts % 2].GetId())
+            handles.append(top.ScheduleMessageFor(ts, testMessage))
+
+        # Cancel everything but ts 98/99, enough to compact the queue along the way.
+        for handle in handles[:98]:
+            assert(handle.Cancel())
+        assert(len(world.events) < 100)
+        assert(world.NextTs() == 98)
+
+        handles[99].Reschedule(150)
+
+        _TestLayerWithHandler.calls = []
+        assert(world.RunUntil(200) == 2)
+        assert(_TestLayerWithHandler.calls == ['0.0', '0.1'])
+        assert(not handles[99].Cancel())